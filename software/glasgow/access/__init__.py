@@ -78,6 +78,10 @@ class AccessMultiplexerInterface(Module, metaclass=ABCMeta):
 
         return triple
 
+    def add_event(self, name, trigger, data=None, kind="strobe"):
+        if self.analyzer:
+            self.analyzer.add_generic_event(self.applet, name, trigger, data, kind)
+
     def get_pin(self, pin, name=None):
         return self.get_pins([pin], name)
 
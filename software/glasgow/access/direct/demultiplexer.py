@@ -32,6 +32,11 @@ class DirectDemultiplexer(AccessDemultiplexer):
         return iface
 
 
+# Reading several packets in one transfer avoids a round trip per packet; the limit keeps
+# the transfer buffers small.
+_MAX_PACKETS_PER_READ = 128
+
+
 class DirectDemultiplexerInterface(AccessDemultiplexerInterface):
     def __init__(self, device, applet, mux_interface):
         super().__init__(device, applet)
@@ -74,7 +79,7 @@ class DirectDemultiplexerInterface(AccessDemultiplexerInterface):
         await self.device.write_register(self._addr_reset, 0)
 
     async def _read_packet(self, hint=0):
-        buffers = max(1, math.ceil(hint / self._endpoint_in))
+        buffers = min(max(1, math.ceil(hint / self._in_packet_size)), _MAX_PACKETS_PER_READ)
         packet  = await self.device.bulk_read(self._endpoint_in, self._in_packet_size * buffers)
         self._buffer_in += packet
 
@@ -94,7 +99,9 @@ class DirectDemultiplexerInterface(AccessDemultiplexerInterface):
             # Return exactly the requested length.
             while len(self._buffer_in) < length:
                 self.logger.trace("FIFO: need %d bytes", length - len(self._buffer_in))
-                await self._read_packet(hint)
+                # A transfer ends early on a short packet, so asking for all of the bytes that
+                # are still needed never waits for more data than one packet at a time would.
+                await self._read_packet(max(hint, length - len(self._buffer_in)))
 
         result = self._buffer_in[:length]
         self._buffer_in = self._buffer_in[length:]
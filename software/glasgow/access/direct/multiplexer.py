@@ -159,6 +159,12 @@ class DirectMultiplexerInterface(AccessMultiplexerInterface):
                 o_D_IN_0=i,
             )
 
+    def add_event(self, name, trigger, data=None, kind="strobe"):
+        if self._throttle == "full":
+            # The applet is stopped while throttled, and its strobes would be held asserted.
+            trigger = trigger & ~self.analyzer.throttle
+        super().add_event(name, trigger, data, kind)
+
     def _throttle_fifo(self, fifo):
         self.submodules += fifo
         if self._throttle == "full":
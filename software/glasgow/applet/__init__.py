@@ -47,6 +47,13 @@ class GlasgowApplet:
     async def interact(self, device, args, interface):
         pass
 
+    def protocol_decoder(self, args, clock_freq):
+        """
+        Return a :class:`ProtocolDecoder` for the pin traces of this applet configured with
+        ``args``, or ``None`` if the applet has no protocol decoder.
+        """
+        return None
+
 # -------------------------------------------------------------------------------------------------
 
 class GlasgowAppletTool:
@@ -162,6 +169,7 @@ from .jtag.mips import JTAGMIPSApplet
 from .jtag.pinout import JTAGPinoutApplet
 from .jtag.svf import JTAGSVFApplet
 from .jtag.xc9500 import JTAGXC9500Applet
+from .jtag.xsvf import JTAGXSVFApplet
 from .nand_flash import NANDFlashApplet
 from .program_ice40 import ProgramICE40Applet
 from .selftest import SelfTestApplet
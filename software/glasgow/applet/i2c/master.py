@@ -7,6 +7,7 @@ from migen.genlib.fsm import *
 from .. import *
 from ...gateware.pads import *
 from ...gateware.i2c import I2CMaster
+from ...decoder import *
 from ...pyrepl import *
 
 
@@ -358,6 +359,34 @@ class I2CMasterApplet(GlasgowApplet, name="i2c-master"):
         if args.repl:
             await AsyncInteractiveConsole(locals={"i2c_iface":i2c_iface}).interact()
 
+    def protocol_decoder(self, args, clock_freq):
+        # Decode the bus as seen by the input buffers.
+        return I2CDecoder(clock_freq, pin_names={
+            "scl": "scl_io" if args.pin_scl_io is not None else "scl_i",
+            "sda": "sda_io" if args.pin_sda_io is not None else "sda_i",
+        })
+
+
+class I2CMasterAppletTool(GlasgowAppletTool, applet=I2CMasterApplet):
+    help = "decode I2C transactions"
+    description = """
+    Decode I2C transactions from an event analyzer trace stream.
+    """
+
+    @classmethod
+    def add_arguments(cls, parser):
+        p_operation = parser.add_subparsers(dest="operation", metavar="OPERATION")
+
+        p_decode = p_operation.add_parser(
+            "decode", help="decode I2C transactions from a trace stream")
+        I2CDecoder.add_arguments(p_decode)
+        add_trace_argument(p_decode)
+
+    async def run(self, args):
+        if args.operation == "decode":
+            await decode_trace(args.trace,
+                lambda clock_freq: I2CDecoder.from_arguments(args, clock_freq))
+
 # -------------------------------------------------------------------------------------------------
 
 class I2CMasterAppletTestCase(GlasgowAppletTestCase, applet=I2CMasterApplet):
@@ -1,3 +1,7 @@
+import os
+import json
+import math
+import time
 import struct
 import logging
 import asyncio
@@ -10,6 +14,7 @@ from .. import *
 from ...gateware.pads import *
 from ...database.jedec import *
 from ...arch.jtag import *
+from ...decoder import *
 from ...pyrepl import *
 
 
@@ -47,38 +52,61 @@ CMD_RESET      = 0b00000000
 CMD_TRST       = 0b00010000
 CMD_SHIFT_TMS  = 0b00100000
 CMD_SHIFT_TDIO = 0b00110000
+CMD_SCAN       = 0b01000000
 BIT_DATA_OUT   =     0b0001
 BIT_DATA_IN    =     0b0010
 BIT_LAST       =     0b0100
 
 
 class JTAGSubtarget(Module):
-    def __init__(self, pads, out_fifo, in_fifo, period_cyc):
+    def __init__(self, pads, out_fifo, in_fifo, half_cyc):
         self.submodules.bus = bus = JTAGBus(pads)
 
+        self.cmd     = cmd = Signal(8)
+        self.cmd_stb = Signal()
+
         ###
 
-        half_cyc  = int(period_cyc // 2)
-        timer     = Signal(max=half_cyc)
+        timer     = Signal.like(half_cyc)
         timer_rdy = Signal()
         timer_stb = Signal()
         self.comb += timer_rdy.eq(timer == 0)
         self.sync += [
             If(~timer_rdy,
                 timer.eq(timer - 1)
-            ).Elif(timer_stb,
+            ).Elif(timer_stb & (half_cyc != 0),
                 timer.eq(half_cyc - 1)
             )
         ]
 
-        cmd     = Signal(8)
         count   = Signal(16)
+        # CMD_SCAN shifts TMS bits from tms_pre, then TDI/TDO bits like CMD_SHIFT_TDIO|BIT_LAST,
+        # then TMS bits from tms_post, one phase after another.
+        scan       = Signal()
+        phase      = Signal(2)
+        tms_pre    = Signal(8)
+        tms_post   = Signal(8)
+        len_pre    = Signal(4)
+        len_post   = Signal(4)
+        scan_count = Signal(16)
+        shift_tms  = Signal()
+        shift_last = Signal()
+        data_out   = Signal()
+        data_in    = Signal()
+        self.comb += [
+            scan.eq((cmd & CMD_MASK) == CMD_SCAN),
+            shift_tms.eq(((cmd & CMD_MASK) == CMD_SHIFT_TMS) | (scan & (phase != 1))),
+            shift_last.eq(((cmd & BIT_LAST) != 0) | scan),
+            data_out.eq(((cmd & BIT_DATA_OUT) != 0) & ~(scan & (phase != 1))),
+            data_in.eq(((cmd & BIT_DATA_IN) != 0) & ~(scan & (phase != 1))),
+        ]
         bit     = Signal(3)
         align   = Signal(3)
         shreg_o = Signal(8)
         shreg_i = Signal(8)
 
         self.submodules.fsm = FSM(reset_state="RECV-COMMAND")
+        self.comb += self.cmd_stb.eq(self.fsm.ongoing("COMMAND"))
         self.fsm.act("RECV-COMMAND",
             If(timer_rdy & out_fifo.readable,
                 out_fifo.re.eq(1),
@@ -99,6 +127,8 @@ class JTAGSubtarget(Module):
             ).Elif(((cmd & CMD_MASK) == CMD_SHIFT_TMS) |
                    ((cmd & CMD_MASK) == CMD_SHIFT_TDIO),
                 NextState("RECV-COUNT-1")
+            ).Elif((cmd & CMD_MASK) == CMD_SCAN,
+                NextState("RECV-TMS-LENGTHS")
             ).Else(
                 NextState("RECV-COMMAND")
             )
@@ -112,6 +142,28 @@ class JTAGSubtarget(Module):
                 NextState("RECV-COMMAND")
             )
         )
+        self.fsm.act("RECV-TMS-LENGTHS",
+            If(out_fifo.readable,
+                out_fifo.re.eq(1),
+                NextValue(len_pre,  out_fifo.dout[0:4]),
+                NextValue(len_post, out_fifo.dout[4:8]),
+                NextState("RECV-TMS-PRE")
+            )
+        )
+        self.fsm.act("RECV-TMS-PRE",
+            If(out_fifo.readable,
+                out_fifo.re.eq(1),
+                NextValue(tms_pre, out_fifo.dout),
+                NextState("RECV-TMS-POST")
+            )
+        )
+        self.fsm.act("RECV-TMS-POST",
+            If(out_fifo.readable,
+                out_fifo.re.eq(1),
+                NextValue(tms_post, out_fifo.dout),
+                NextState("RECV-COUNT-1")
+            )
+        )
         self.fsm.act("RECV-COUNT-1",
             If(out_fifo.readable,
                 out_fifo.re.eq(1),
@@ -122,13 +174,27 @@ class JTAGSubtarget(Module):
         self.fsm.act("RECV-COUNT-2",
             If(out_fifo.readable,
                 out_fifo.re.eq(1),
-                NextValue(count[8:16], out_fifo.dout),
+                If(scan,
+                    NextValue(scan_count, Cat(count[0:8], out_fifo.dout)),
+                    NextValue(count, len_pre),
+                    NextValue(phase, 0)
+                ).Else(
+                    NextValue(count[8:16], out_fifo.dout)
+                ),
                 NextState("RECV-BITS")
             )
         )
         self.fsm.act("RECV-BITS",
             If(count == 0,
-                NextState("RECV-COMMAND")
+                If(scan & (phase == 0),
+                    NextValue(count, scan_count),
+                    NextValue(phase, 1)
+                ).Elif(scan & (phase == 1),
+                    NextValue(count, len_post),
+                    NextValue(phase, 2)
+                ).Else(
+                    NextState("RECV-COMMAND")
+                )
             ).Else(
                 If(count > 8,
                     NextValue(bit, 0)
@@ -136,12 +202,18 @@ class JTAGSubtarget(Module):
                     NextValue(align, 8 - count),
                     NextValue(bit, 8 - count)
                 ),
-                If(cmd & BIT_DATA_OUT,
+                If(data_out,
                     If(out_fifo.readable,
                         out_fifo.re.eq(1),
                         NextValue(shreg_o, out_fifo.dout),
                         NextState("SHIFT-SETUP")
                     )
+                ).Elif(scan & (phase == 0),
+                    NextValue(shreg_o, tms_pre),
+                    NextState("SHIFT-SETUP")
+                ).Elif(scan & (phase == 2),
+                    NextValue(shreg_o, tms_post),
+                    NextState("SHIFT-SETUP")
                 ).Else(
                     NextValue(shreg_o, 0b11111111),
                     NextState("SHIFT-SETUP")
@@ -151,12 +223,12 @@ class JTAGSubtarget(Module):
         self.fsm.act("SHIFT-SETUP",
             If(timer_rdy,
                 timer_stb.eq(1),
-                If((cmd & CMD_MASK) == CMD_SHIFT_TMS,
+                If(shift_tms,
                     NextValue(bus.tms, shreg_o[0]),
                     NextValue(bus.tdi, 0),
                 ).Else(
                     NextValue(bus.tms, 0),
-                    If(cmd & BIT_LAST,
+                    If(shift_last,
                         NextValue(bus.tms, count == 1)
                     ),
                     NextValue(bus.tdi, shreg_o[0]),
@@ -181,7 +253,7 @@ class JTAGSubtarget(Module):
             )
         )
         self.fsm.act("SEND-BITS",
-            If(cmd & BIT_DATA_IN,
+            If(data_in,
                 If(in_fifo.writable,
                     in_fifo.we.eq(1),
                     If(count == 0,
@@ -197,181 +269,618 @@ class JTAGSubtarget(Module):
         )
 
 
+class JTAGDeferred:
+    """
+    A placeholder for the result of an operation queued in a JTAG batch. The result becomes
+    available once the batch is committed; it can be retrieved with :meth:`result`, or by
+    awaiting the placeholder.
+    """
+    def __init__(self):
+        self._done      = False
+        self._value     = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        if not self._done:
+            raise RuntimeError("result is not available until the JTAG batch is committed")
+        return self._value
+
+    def __await__(self):
+        return self.result()
+        yield
+
+    def _resolve(self, value):
+        self._done  = True
+        self._value = value
+        for callback in self._callbacks:
+            callback(value)
+        self._callbacks = []
+
+    def then(self, func):
+        """
+        Return a placeholder for ``func(result)``.
+        """
+        deferred = JTAGDeferred()
+        if self._done:
+            deferred._resolve(func(self._value))
+        else:
+            self._callbacks.append(lambda value: deferred._resolve(func(value)))
+        return deferred
+
+
+def _then(result, func):
+    # Apply `func` to a result that is either immediately available or deferred.
+    if isinstance(result, JTAGDeferred):
+        return result.then(func)
+    else:
+        return func(result)
+
+
+# Shift commands have a 16-bit count, so longer shifts are split into several commands without
+# leaving the Shift-IR or Shift-DR state. All but the last of these commands shift a multiple of
+# 8 bits, so that TDI and TDO data of consecutive commands stays byte aligned.
+_MAX_SHIFT_BITS    = 0xfff8
+# Streaming shifts are split into chunks small enough that the device FIFOs can hold TDO data
+# for one chunk while TDI data for the next one is being sent.
+_STREAM_CHUNK_BITS = 4096
+# A batch is committed automatically once this much TDO data is pending. The device stops
+# accepting commands when its IN FIFO is full, and the host waits for every command to be
+# accepted before reading anything, so larger batches would never complete.
+_MAX_BATCH_TDO_BYTES = _STREAM_CHUNK_BITS // 8
+
+
+def _iter_bit_chunks(bits, count=None, chunk_bits=_STREAM_CHUNK_BITS):
+    # Split `bits` into little endian bitarrays of `chunk_bits` bits, except for the last one.
+    # `bits` may be a bitarray, an iterable of bits or of sequences of bits, or a binary file,
+    # whose bytes are used LSB first. At most `count` bits are used, if it is specified.
+    if hasattr(bits, "read"):
+        def read_chunks():
+            while True:
+                data = bits.read(chunk_bits // 8)
+                if not data:
+                    break
+                chunk = bitarray(endian="little")
+                chunk.frombytes(data)
+                yield chunk
+        items = read_chunks()
+    elif isinstance(bits, bitarray):
+        items = [bits]
+    else:
+        items = bits
+
+    pending = bitarray(endian="little")
+    used    = 0
+    for item in items:
+        if isinstance(item, (bool, int)):
+            pending.append(item)
+        else:
+            pending.extend(item)
+        if count is not None and used + len(pending) > count:
+            del pending[count - used:]
+        if len(pending) >= chunk_bits:
+            whole = len(pending) - len(pending) % chunk_bits
+            for offset in range(0, whole, chunk_bits):
+                yield pending[offset:offset + chunk_bits]
+            pending = pending[whole:]
+            used += whole
+        if count is not None and used + len(pending) == count:
+            break
+
+    if pending:
+        yield pending
+        used += len(pending)
+    if count is not None and used < count:
+        raise ValueError("bit source ended after {} bits, expected {}".format(used, count))
+
+
+def _half_cyc(sys_clk_freq, frequency):
+    # The number of system clock cycles in a half of the TCK period closest to, but not shorter
+    # than, the one of `frequency`.
+    return max(1, math.ceil(sys_clk_freq / (2 * frequency)))
+
+
+def _with_final(iterable):
+    # Yield `(item, final)` pairs, where `final` is true for the last item.
+    iterator = iter(iterable)
+    try:
+        item = next(iterator)
+    except StopIteration:
+        return
+    for next_item in iterator:
+        yield item, False
+        item = next_item
+    yield item, True
+
+
+class JTAGBatch:
+    def __init__(self, lower):
+        self.lower = lower
+
+    async def __aenter__(self):
+        self.lower._batch_level += 1
+        return self.lower
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.lower._batch_level -= 1
+        if self.lower._batch_level == 0:
+            # Even if the batch was interrupted, the device will still return data for
+            # the operations that were already queued, so it always has to be read.
+            await self.lower.commit()
+
+
 class JTAGInterface:
-    def __init__(self, interface, logger):
+    def __init__(self, interface, logger, sys_clk_freq=None, addr_half_cyc=()):
         self.lower   = interface
         self._logger = logger
         self._level  = logging.DEBUG if self._logger.name == __name__ else logging.TRACE
 
-        self._state      = "Unknown"
-        self._current_ir = None
+        self._sys_clk_freq  = sys_clk_freq
+        self._addr_half_cyc = addr_half_cyc
+        self._half_cyc      = None
+
+        self._state       = None
+        self._current_ir  = None
+        self._tms_pending = bitarray(endian="little")
+
+        self._batch_level = 0
+        self._batch_reads = []
+        self._batch_bytes = 0
 
     def _log(self, message, *args):
         self._logger.log(self._level, "JTAG: " + message, *args)
 
+    async def _write(self, data):
+        # State transitions are only queued, to be merged with any that follow them; they have
+        # to be sent before anything else.
+        await self._flush_tms()
+        await self.lower.write(data)
+
+    async def _read(self, length):
+        await self._flush_tms()
+        return await self.lower.read(length)
+
+    # Batching
+
+    def batch(self):
+        """
+        Return an asynchronous context manager that queues operations instead of executing them
+        one by one. Inside the batch, operations that return TDO data return
+        :class:`JTAGDeferred` placeholders instead; all queued commands are sent to the device
+        together, and all TDO data is read in a single transfer when the outermost batch is
+        exited. Batches may be nested, and may be of any size; once the pending TDO data could
+        overflow the device FIFOs, the batch is committed early.
+
+        For example: ::
+
+            async with jtag_iface.batch():
+                results = [await tap_iface.read_dr(32) for _ in range(100)]
+            values = [result.result() for result in results]
+        """
+        return JTAGBatch(self)
+
+    async def commit(self):
+        """
+        Send all queued operations to the device, and resolve all pending results.
+        """
+        await self._flush_tms()
+        if not self._batch_reads:
+            return
+
+        batch_reads, self._batch_reads = self._batch_reads, []
+        batch_bytes, self._batch_bytes = self._batch_bytes, 0
+        self._log("commit reads=%d", len(batch_reads))
+        tdo_bytes = await self._read(batch_bytes)
+        offset = 0
+        for count, deferred in batch_reads:
+            size = (count + 7) // 8
+            tdo_bits = self._tdo_bits(tdo_bytes[offset:offset + size], count)
+            offset += size
+            self._log("shift tdo=<%s> (deferred)", tdo_bits.to01())
+            deferred._resolve(tdo_bits)
+
+    async def _resolve(self, result):
+        # Some operations need the TDO data right away; commit early if it was deferred.
+        if isinstance(result, JTAGDeferred):
+            await self.commit()
+            return result.result()
+        return result
+
+    @staticmethod
+    def _tdo_bits(tdo_bytes, count):
+        tdo_bits = bitarray(endian="little")
+        tdo_bits.frombytes(bytes(tdo_bytes))
+        while len(tdo_bits) > count: tdo_bits.pop()
+        return tdo_bits
+
+    async def _read_tdo(self, count):
+        if self._batch_level > 0:
+            deferred = JTAGDeferred()
+            self._batch_reads.append((count, deferred))
+            self._batch_bytes += (count + 7) // 8
+            if self._batch_bytes >= _MAX_BATCH_TDO_BYTES:
+                await self.commit()
+            return deferred
+
+        tdo_bits = self._tdo_bits(await self._read((count + 7) // 8), count)
+        self._log("shift tdo=<%s>", tdo_bits.to01())
+        return tdo_bits
+
+    # Clocking
+
+    @property
+    def frequency(self):
+        """
+        TCK frequency, in Hz, or ``None`` if it has not been set.
+        """
+        if self._half_cyc is None:
+            return None
+        return self._sys_clk_freq / (2 * self._half_cyc)
+
+    async def _sync(self):
+        # Wait until every command sent so far has been executed, by clocking TCK once in
+        # a stable state with TDO sampled, and reading it.
+        await self.commit()
+        if self._state in (None, "RESET"):
+            tms_bit = 1
+        elif self._state in ("IDLE", "IRPAUSE", "DRPAUSE"):
+            tms_bit = 0
+        else:
+            assert False, "cannot synchronize in state {}".format(self._state)
+        await self._write(struct.pack("<BHB",
+            CMD_SHIFT_TMS|BIT_DATA_OUT|BIT_DATA_IN, 1, tms_bit))
+        await self._read(1)
+
+    async def set_frequency(self, frequency):
+        """
+        Set TCK frequency to the highest frequency that does not exceed ``frequency`` Hz,
+        and return it. Operations requested earlier are completed at the previous frequency.
+        """
+        assert self._sys_clk_freq is not None and self._addr_half_cyc
+        half_cyc = _half_cyc(self._sys_clk_freq, frequency)
+        if half_cyc >= 1 << (8 * len(self._addr_half_cyc)):
+            raise GlasgowAppletError("TCK frequency %.3f kHz is too low; at least %.3f kHz "
+                                     "is required"
+                                     % (frequency / 1e3, self._sys_clk_freq / 1e3 /
+                                        (2 * ((1 << (8 * len(self._addr_half_cyc))) - 1))))
+        if half_cyc == self._half_cyc:
+            return self.frequency
+
+        if self._half_cyc is not None:
+            await self._sync()
+        for index, addr in enumerate(self._addr_half_cyc):
+            await self.lower.device.write_register(addr, (half_cyc >> (8 * index)) & 0xff)
+        self._half_cyc = half_cyc
+        self._log("set frequency=%.3f kHz", self.frequency / 1e3)
+        return self.frequency
+
+    async def tune_frequency(self, max_frequency, trials=8):
+        """
+        Find the highest TCK frequency, up to ``max_frequency`` Hz, at which IDCODEs are read
+        correctly ``trials`` times in a row. The frequency is increased in steps, starting with
+        the current one (at which the chain must work reliably), until the scan results differ
+        from those at the current frequency, and then is set to the last frequency at which
+        they did not. Returns the frequency, or ``None`` if the chain has no TAPs.
+        """
+        reference = await self.scan_idcode()
+        if not reference:
+            return
+
+        good_frequency = self.frequency
+        half_cyc = self._half_cyc
+        while half_cyc > 1:
+            half_cyc = min(half_cyc - 1, half_cyc * 3 // 4 or 1)
+            frequency = self._sys_clk_freq / (2 * half_cyc)
+            if frequency > max_frequency:
+                break
+
+            await self.set_frequency(frequency)
+            for trial in range(trials):
+                if await self.scan_idcode() != reference:
+                    self._log("tune frequency=%.3f kHz fail", frequency / 1e3)
+                    break
+            else:
+                self._log("tune frequency=%.3f kHz pass", frequency / 1e3)
+                good_frequency = frequency
+                continue
+            break
+
+        # The TAPs may be in an unexpected state after a failure; get them out of it at
+        # a frequency that is known to work.
+        await self.set_frequency(good_frequency)
+        await self.test_reset()
+        return good_frequency
+
     # Low-level operations
 
     async def set_trst(self, state):
         if state is None:
             self._log("set trst=z")
-            await self.lower.write(struct.pack("<B",
+            await self._write(struct.pack("<B",
                 CMD_TRST|0b01))
         else:
             state = state & 1
             self._log("set trst=%d", state)
-            await self.lower.write(struct.pack("<B",
+            await self._write(struct.pack("<B",
                 CMD_TRST|(state << 1)))
 
     async def pulse_trst(self):
         self._log("pulse trst")
-        await self.lower.write(struct.pack("<B",
+        await self._write(struct.pack("<B",
             CMD_RESET))
         self._current_ir = None
 
+    async def _flush_tms(self):
+        if not self._tms_pending:
+            return
+
+        tms_bits, self._tms_pending = self._tms_pending, bitarray(endian="little")
+        offset = 0
+        while offset < len(tms_bits):
+            chunk_bits = tms_bits[offset:offset + _MAX_SHIFT_BITS]
+            await self.lower.write(struct.pack("<BH",
+                CMD_SHIFT_TMS|BIT_DATA_OUT, len(chunk_bits)))
+            await self.lower.write(chunk_bits.tobytes())
+            offset += len(chunk_bits)
+
     async def shift_tms(self, tms_bits):
+        """
+        Shift ``tms_bits`` into TMS. Inside a batch, consecutive TMS shifts are merged into
+        a single command.
+        """
         tms_bits = bitarray(tms_bits, endian="little")
         self._log("shift tms=<%s>", tms_bits.to01())
-        await self.lower.write(struct.pack("<BH",
-            CMD_SHIFT_TMS|BIT_DATA_OUT, len(tms_bits)))
-        await self.lower.write(tms_bits.tobytes())
+        self._tms_pending.extend(tms_bits)
+        if self._batch_level == 0:
+            await self._flush_tms()
 
     def _shift_last(self, last):
         if last:
-            if self._state == "Shift-IR":
+            if self._state == "IRSHIFT":
                 self._log("state Shift-IR → Exit1-IR")
-                self._state = "Exit1-IR"
-            elif self._state == "Shift-DR":
+                self._state = "IREXIT1"
+            elif self._state == "DRSHIFT":
                 self._log("state Shift-DR → Exit1-DR")
-                self._state = "Exit1-DR"
+                self._state = "DREXIT1"
+
+    async def _write_shift(self, tdi_bytes, count, data_in, last):
+        offset = 0
+        while True:
+            chunk_count = min(count - offset, _MAX_SHIFT_BITS)
+            final = (offset + chunk_count == count)
+            await self._write(struct.pack("<BH",
+                CMD_SHIFT_TDIO|(BIT_DATA_IN if data_in else 0)|
+                               (BIT_DATA_OUT if tdi_bytes is not None else 0)|
+                               (BIT_LAST if last and final else 0),
+                chunk_count))
+            if tdi_bytes is not None:
+                await self._write(tdi_bytes[offset // 8:(offset + chunk_count + 7) // 8])
+            offset += chunk_count
+            if final:
+                break
 
     async def shift_tdio(self, tdi_bits, last=True):
-        assert self._state in ("Shift-IR", "Shift-DR")
+        assert self._state in ("IRSHIFT", "DRSHIFT")
         tdi_bits = bitarray(tdi_bits, endian="little")
-        tdo_bits = bitarray(endian="little")
+        if self._batch_level == 0 and len(tdi_bits) > _STREAM_CHUNK_BITS:
+            # Too long to be buffered in the device FIFOs while being sent; stream it.
+            tdo_bits = bitarray(endian="little")
+            async for tdo_chunk in self.shift_tdio_stream(tdi_bits, last=last):
+                tdo_bits += tdo_chunk
+            return tdo_bits
+
         self._log("shift tdio-i=<%s>", tdi_bits.to01())
-        await self.lower.write(struct.pack("<BH",
-            CMD_SHIFT_TDIO|BIT_DATA_IN|BIT_DATA_OUT|(BIT_LAST if last else 0),
-            len(tdi_bits)))
-        tdi_bytes = tdi_bits.tobytes()
-        await self.lower.write(tdi_bytes)
-        tdo_bytes = await self.lower.read(len(tdi_bytes))
-        tdo_bits.frombytes(bytes(tdo_bytes))
-        while len(tdo_bits) > len(tdi_bits): tdo_bits.pop()
-        self._log("shift tdio-o=<%s>", tdo_bits.to01())
+        await self._write_shift(tdi_bits.tobytes(), len(tdi_bits), data_in=True, last=last)
+        tdo_bits = await self._read_tdo(len(tdi_bits))
         self._shift_last(last)
         return tdo_bits
 
     async def shift_tdi(self, tdi_bits, last=True):
-        assert self._state in ("Shift-IR", "Shift-DR")
+        assert self._state in ("IRSHIFT", "DRSHIFT")
         tdi_bits = bitarray(tdi_bits, endian="little")
         self._log("shift tdi=<%s>", tdi_bits.to01())
-        await self.lower.write(struct.pack("<BH",
-            CMD_SHIFT_TDIO|BIT_DATA_OUT|(BIT_LAST if last else 0),
-            len(tdi_bits)))
-        tdi_bytes = tdi_bits.tobytes()
-        await self.lower.write(tdi_bytes)
+        await self._write_shift(tdi_bits.tobytes(), len(tdi_bits), data_in=False, last=last)
         self._shift_last(last)
 
     async def shift_tdo(self, count, last=True):
-        assert self._state in ("Shift-IR", "Shift-DR")
-        tdo_bits = bitarray(endian="little")
-        await self.lower.write(struct.pack("<BH",
-            CMD_SHIFT_TDIO|BIT_DATA_IN|(BIT_LAST if last else 0),
-            count))
-        tdo_bytes = await self.lower.read((count + 7) // 8)
-        tdo_bits.frombytes(bytes(tdo_bytes))
-        while len(tdo_bits) > count: tdo_bits.pop()
-        self._log("shift tdo=<%s>", tdo_bits.to01())
+        assert self._state in ("IRSHIFT", "DRSHIFT")
+        if self._batch_level == 0 and count > _STREAM_CHUNK_BITS:
+            tdo_bits = bitarray(endian="little")
+            async for tdo_chunk in self.shift_tdo_stream(count, last=last):
+                tdo_bits += tdo_chunk
+            return tdo_bits
+
+        await self._write_shift(None, count, data_in=True, last=last)
+        tdo_bits = await self._read_tdo(count)
         self._shift_last(last)
         return tdo_bits
 
+    # Streaming operations
+
+    async def shift_tdi_stream(self, tdi_bits, count=None, last=True):
+        """
+        Shift ``tdi_bits`` into TDI. ``tdi_bits`` may be a :class:`bitarray`, an iterable of bits
+        or of sequences of bits, or a binary file whose bytes are shifted LSB first; it is
+        consumed incrementally, so arbitrarily long shifts never have to be held in memory.
+        If ``count`` is specified, exactly ``count`` bits are shifted.
+        """
+        assert self._state in ("IRSHIFT", "DRSHIFT")
+        self._log("shift tdi stream")
+        total = 0
+        for chunk, final in _with_final(_iter_bit_chunks(tdi_bits, count)):
+            await self._write_shift(chunk.tobytes(), len(chunk), data_in=False,
+                                    last=last and final)
+            total += len(chunk)
+        self._log("shift tdi stream count=%d", total)
+        self._shift_last(last)
+
+    async def _stream(self, chunks, data_out, last):
+        assert self._state in ("IRSHIFT", "DRSHIFT")
+        # Inside a batch, read the queued TDO data first; the TDO data of the stream itself is
+        # always read right away.
+        await self.commit()
+        # Send the next chunk before reading TDO data for the previous one, so that the device
+        # never waits for the host.
+        pending = []
+        for chunk, final in _with_final(chunks):
+            await self._write_shift(chunk.tobytes() if data_out else None, len(chunk),
+                                    data_in=True, last=last and final)
+            pending.append(len(chunk))
+            if len(pending) > 1:
+                count = pending.pop(0)
+                yield self._tdo_bits(await self._read((count + 7) // 8), count)
+        while pending:
+            count = pending.pop(0)
+            yield self._tdo_bits(await self._read((count + 7) // 8), count)
+        self._shift_last(last)
+
+    def shift_tdio_stream(self, tdi_bits, count=None, last=True):
+        """
+        Like :meth:`shift_tdi_stream`, but also return an asynchronous iterator of TDO data,
+        as ``bitarray`` chunks. The iterator must be exhausted for the shift to complete.
+        Inside a batch, the batch is committed first, and TDO data is never deferred.
+
+        For example: ::
+
+            with open("bitstream.bin", "rb") as f:
+                async for tdo_bits in jtag_iface.shift_tdio_stream(f):
+                    ...
+        """
+        self._log("shift tdio stream")
+        return self._stream(_iter_bit_chunks(tdi_bits, count), data_out=True, last=last)
+
+    def shift_tdo_stream(self, count, last=True):
+        """
+        Shift ``count`` bits out of TDO, while holding TDI high, and return an asynchronous
+        iterator of TDO data, as ``bitarray`` chunks. The iterator must be exhausted for
+        the shift to complete.
+        """
+        self._log("shift tdo stream count=%d", count)
+        chunks = (bitarray(min(count - offset, _STREAM_CHUNK_BITS))
+                  for offset in range(0, count, _STREAM_CHUNK_BITS))
+        return self._stream(chunks, data_out=False, last=last)
+
     async def pulse_tck(self, count):
-        assert self._state in ("Run-Test/Idle", "Shift-IR", "Shift-DR", "Pause-IR", "Pause-DR")
+        assert self._state in ("IDLE", "IRSHIFT", "DRSHIFT", "IRPAUSE", "DRPAUSE")
         self._log("pulse tck count=%d", count)
         while count > 0xffff:
-            await self.lower.write(struct.pack("<BH",
+            await self._write(struct.pack("<BH",
                 CMD_SHIFT_TDIO, 0xffff))
             count -= 0xffff
-        await self.lower.write(struct.pack("<BH",
+        await self._write(struct.pack("<BH",
             CMD_SHIFT_TDIO, count))
 
     # State machine transitions
 
+    async def enter_state(self, state, path=()):
+        """
+        Move the TAP controller to ``state``, which is a state name as used in SVF (see
+        :data:`TAP_STATES`). If ``path`` is specified, the TAP controller goes through every
+        state in it, in order, before reaching ``state``; otherwise, the shortest path is used.
+
+        If the current state is not known, the TAP controller goes through Test-Logic-Reset first.
+        """
+        path = list(path) + [state]
+        if self._state is None:
+            start, tms_bits = "RESET", "11111"
+        elif path == [self._state]:
+            return
+        else:
+            start, tms_bits = self._state, ""
+
+        if len(path) > 1:
+            tms_bits += tap_path_tms(start, path)
+        else:
+            tms_bits += TAP_PATHS[start, state]
+        if self._state is None:
+            self._log("state Unknown → Test-Logic-Reset")
+            self._current_ir = None
+        if path != [start]:
+            self._log("state %s → %s", TAP_STATE_NAMES[start], TAP_STATE_NAMES[state])
+        await self.shift_tms(tms_bits)
+        self._state = state
+
     async def enter_test_logic_reset(self, force=True):
         if force:
             self._log("state * → Test-Logic-Reset")
-        elif self._state != "Test-Logic-Reset":
-            self._log("state %s → Test-Logic-Reset", self._state)
+            await self.shift_tms("11111")
+            self._state = "RESET"
         else:
-            return
-
-        await self.shift_tms("11111")
-        self._state = "Test-Logic-Reset"
+            await self.enter_state("RESET")
 
     async def enter_run_test_idle(self):
-        if self._state == "Run-Test/Idle": return
-
-        self._log("state %s → Run-Test/Idle", self._state)
-        if self._state == "Test-Logic-Reset":
-            await self.shift_tms("0")
-        elif self._state in ("Exit1-IR", "Exit1-DR"):
-            await self.shift_tms("10")
-        elif self._state in ("Pause-IR", "Pause-DR"):
-            await self.shift_tms("110")
-        else:
-            assert False
-        self._state = "Run-Test/Idle"
+        await self.enter_state("IDLE")
 
     async def enter_shift_ir(self):
-        if self._state == "Shift-IR": return
-
-        self._log("state %s → Shift-IR", self._state)
-        if self._state == "Test-Logic-Reset":
-            await self.shift_tms("01100")
-        elif self._state == "Run-Test/Idle":
-            await self.shift_tms("1100")
-        else:
-            assert False
-        self._state = "Shift-IR"
+        await self.enter_state("IRSHIFT")
 
     async def enter_pause_ir(self):
-        if self._state == "Pause-IR": return
-
-        self._log("state %s → Pause-IR", self._state)
-        if self._state == "Exit1-IR":
-            await self.shift_tms("0")
-        else:
-            assert False
-        self._state = "Pause-IR"
+        await self.enter_state("IRPAUSE")
 
     async def enter_shift_dr(self):
-        if self._state == "Shift-DR": return
-
-        self._log("state %s → Shift-DR", self._state)
-        if self._state == "Test-Logic-Reset":
-            await self.shift_tms("0100")
-        elif self._state == "Run-Test/Idle":
-            await self.shift_tms("100")
-        else:
-            assert False
-        self._state = "Shift-DR"
+        await self.enter_state("DRSHIFT")
 
     async def enter_pause_dr(self):
-        if self._state == "Pause-DR": return
-
-        self._log("state %s → Pause-DR", self._state)
-        if self._state == "Exit1-DR":
-            await self.shift_tms("0")
-        else:
-            assert False
-        self._state = "Pause-DR"
+        await self.enter_state("DRPAUSE")
 
     # High-level register manipulation
 
+    async def _scan(self, shift_state, tdi_bits=None, count=None, data_in=False):
+        # Go from the current state to `shift_state`, shift the register, and go to Run-Test/Idle.
+        # Unless the shift is long, this is done with a single command, which also includes any
+        # queued TMS bits, instead of three.
+        if tdi_bits is not None:
+            tdi_bits = bitarray(tdi_bits, endian="little")
+            count = len(tdi_bits)
+        if not 0 < count <= _STREAM_CHUNK_BITS:
+            await self.enter_state(shift_state)
+            if tdi_bits is None:
+                tdo_bits = await self.shift_tdo(count)
+            elif data_in:
+                tdo_bits = await self.shift_tdio(tdi_bits)
+            else:
+                tdo_bits = await self.shift_tdi(tdi_bits)
+            await self.enter_run_test_idle()
+            return tdo_bits
+
+        if self._state is None:
+            await self.enter_test_logic_reset()
+        tms_pre  = bitarray(TAP_PATHS[self._state, shift_state], endian="little")
+        if len(self._tms_pending) + len(tms_pre) <= 8:
+            tms_pre, self._tms_pending = self._tms_pending + tms_pre, bitarray(endian="little")
+        else:
+            await self._flush_tms()
+        exit_state = {"IRSHIFT": "IREXIT1", "DRSHIFT": "DREXIT1"}[shift_state]
+        tms_post = bitarray(TAP_PATHS[exit_state, "IDLE"], endian="little")
+
+        self._log("state %s → %s", TAP_STATE_NAMES[self._state], TAP_STATE_NAMES[shift_state])
+        if tdi_bits is None:
+            self._log("shift tdo count=%d", count)
+        elif data_in:
+            self._log("shift tdio-i=<%s>", tdi_bits.to01())
+        else:
+            self._log("shift tdi=<%s>", tdi_bits.to01())
+        self._log("state %s → Run-Test/Idle", TAP_STATE_NAMES[exit_state])
+        await self.lower.write(struct.pack("<BBBBH",
+            CMD_SCAN|(BIT_DATA_IN if data_in else 0)|
+                     (BIT_DATA_OUT if tdi_bits is not None else 0),
+            len(tms_pre) | (len(tms_post) << 4),
+            int.from_bytes(tms_pre.tobytes(), "little"),
+            int.from_bytes(tms_post.tobytes(), "little"),
+            count))
+        if tdi_bits is not None:
+            await self.lower.write(tdi_bits.tobytes())
+        self._state = "IDLE"
+        if data_in:
+            return await self._read_tdo(count)
+
     async def test_reset(self):
         self._log("test reset")
-        await self.enter_test_logic_reset()
-        await self.enter_run_test_idle()
+        async with self.batch():
+            await self.enter_test_logic_reset()
+            await self.enter_run_test_idle()
         self._current_ir = None
 
     async def run_test_idle(self, count):
@@ -386,112 +895,144 @@ class JTAGInterface:
             self._current_ir = bitarray(data, endian="little")
 
         self._log("write ir")
-        await self.enter_shift_ir()
-        await self.shift_tdi(data)
-        await self.enter_run_test_idle()
+        await self._scan("IRSHIFT", data)
 
     async def exchange_dr(self, data):
         self._log("exchange dr")
-        await self.enter_shift_dr()
-        data = await self.shift_tdio(data)
-        await self.enter_run_test_idle()
-        return data
+        return await self._scan("DRSHIFT", data, data_in=True)
 
     async def read_dr(self, count, idempotent=False):
-        if idempotent:
-            self._log("read dr idempotent")
-        else:
+        if not idempotent:
             self._log("read dr")
+            return await self._scan("DRSHIFT", count=count, data_in=True)
+
+        self._log("read dr idempotent")
         await self.enter_shift_dr()
-        data = await self.shift_tdo(count, last=not idempotent)
-        if idempotent:
-            # Shift what we just read back in. This is useful to avoid disturbing any bits
-            # in R/W DRs when we go through Update-DR.
-            await self.shift_tdi(data)
+        data = await self.shift_tdo(count, last=False)
+        # Shift what we just read back in. This is useful to avoid disturbing any bits
+        # in R/W DRs when we go through Update-DR.
+        await self.shift_tdi(await self._resolve(data))
         await self.enter_run_test_idle()
         return data
 
     async def write_dr(self, data):
         self._log("write dr")
+        await self._scan("DRSHIFT", data)
+
+    async def write_dr_stream(self, data, count=None, prefix=None, suffix=None):
+        """
+        Write ``data``, which is any bit source accepted by :meth:`shift_tdi_stream`, to DR,
+        optionally preceded by ``prefix`` and followed by ``suffix``.
+        """
+        self._log("write dr stream")
         await self.enter_shift_dr()
-        await self.shift_tdi(data)
+        if prefix:
+            await self.shift_tdi(prefix, last=False)
+        await self.shift_tdi_stream(data, count, last=not suffix)
+        if suffix:
+            await self.shift_tdi(suffix, last=True)
         await self.enter_run_test_idle()
 
     # Specialized operations
 
-    async def scan_idcode(self, max_idcodes=8):
-        await self.test_reset()
-
-        self._log("scan idcode")
-        await self.enter_shift_dr()
-
-        try:
-            idcodes = []
-            idcode_bits = bitarray()
+    def _parse_idcodes(self, chain_bits, max_idcodes):
+        idcodes = []
+        offset  = 0
+        while len(idcodes) < max_idcodes:
             while len(idcodes) < max_idcodes:
-                while len(idcodes) < max_idcodes:
-                    first_bit = await self.shift_tdo(1, last=False)
-                    if first_bit[0]:
-                        self._log("found idcode")
-                        break # IDCODE
-                    else:
-                        self._log("found bypass")
-                        idcodes.append(None)
-                        pass  # BYPASS
+                if chain_bits[offset]:
+                    self._log("found idcode")
+                    break # IDCODE
                 else:
-                    self._log("too many idcodes")
-                    return
+                    self._log("found bypass")
+                    idcodes.append(None)
+                    offset += 1 # BYPASS
+            else:
+                self._log("too many idcodes")
+                return
 
-                idcode_bits = first_bit + await self.shift_tdo(31, last=False)
-                idcode, = struct.unpack("<L", idcode_bits.tobytes())
-                if idcode == 0xffffffff:
-                    break
-                idcodes.append(idcode)
+            idcode, = struct.unpack("<L", chain_bits[offset:offset + 32].tobytes())
+            offset += 32
+            if idcode == 0xffffffff:
+                break
+            idcodes.append(idcode)
 
-            return idcodes
-        finally:
+        return idcodes
+
+    async def scan_idcode(self, max_idcodes=8):
+        # After reset, every TAP has either a 32-bit IDCODE register that starts with a one, or
+        # a 1-bit BYPASS register that contains a zero. Since TDI is held high while shifting,
+        # the end of the chain is indicated by an all-ones IDCODE. A chain of `max_idcodes` TAPs
+        # is at most `32 * max_idcodes` bits long (including that marker), so all of it can be
+        # read in a single batch and parsed afterwards.
+        async with self.batch():
+            await self.test_reset()
+
+            self._log("scan idcode")
+            await self.enter_shift_dr()
+            chain_bits = await self.shift_tdo(32 * max_idcodes, last=False)
             await self.shift_tdo(1, last=True)
             await self.enter_run_test_idle()
 
-    async def scan_ir(self, count=None, max_length=128):
-        await self.test_reset()
+        return self._parse_idcodes(chain_bits.result(), max_idcodes)
 
-        self._log("scan ir")
-        await self.enter_shift_ir()
+    def _parse_irs(self, ir_bits, count, max_length):
+        # Raises IndexError if `ir_bits` ends before the last IR in the chain does.
+        if not ir_bits[0]:
+            self._log("invalid ir[0]")
+            return
 
-        try:
-            ir_0, = await self.shift_tdo(1, last=False)
-            if not ir_0:
-                self._log("invalid ir[0]")
+        irs = []
+        ir_offset = 0
+        offset = 1
+        while count is None or len(irs) < count:
+            ir_1 = ir_bits[offset]
+            offset += 1
+            if ir_1:
+                break
+
+            ir_length = 2
+            while ir_length < max_length:
+                ir_n = ir_bits[offset]
+                offset += 1
+                if ir_n:
+                    break
+                ir_length += 1
+            else:
+                self._log("overlong ir")
                 return
 
-            irs = []
-            ir_offset = 0
-            while count is None or len(irs) < count:
-                ir_1, = await self.shift_tdo(1, last=False)
-                if ir_1:
-                    break
+            irs.append((ir_offset, ir_length))
+            ir_offset += ir_length
 
-                ir_length = 2
-                while ir_length < max_length:
-                    ir_n, = await self.shift_tdo(1, last=False)
-                    if ir_n:
-                        break
-                    ir_length += 1
-                else:
-                    self._log("overlong ir")
-                    return
+        if count is not None and len(irs) != count:
+            self._log("ir count does not match idcode count")
+            return
 
-                irs.append((ir_offset, ir_length))
-                ir_offset += ir_length
+        return irs
 
-            if count is not None and len(irs) != count:
-                self._log("ir count does not match idcode count")
-                return
+    async def scan_ir(self, count=None, max_length=128):
+        # After reset, every IR captures a value that ends in 01, and since TDI is held high
+        # while shifting, the end of the chain is indicated by a 11 pair. Rather than shifting
+        # the chain out bit by bit, it is read in blocks large enough for 8 (or `count`) IRs of
+        # a typical length, and parsed afterwards; another block is read only if the chain
+        # does not end within the ones already read.
+        await self.test_reset()
 
-            return irs
+        self._log("scan ir")
+        await self.enter_shift_ir()
+
+        try:
+            block_length = 1 + (8 if count is None else count) * min(max_length, 32)
+            ir_bits = bitarray(endian="little")
+            while True:
+                ir_bits += await self._resolve(await self.shift_tdo(block_length, last=False))
+                try:
+                    return self._parse_irs(ir_bits, count, max_length)
+                except IndexError:
+                    self._log("scan ir (continued)")
         finally:
-            await self.shift_tdo(1, last=True)
+            await self.shift_tdi(bitarray("1", endian="little"), last=True)
             await self.enter_run_test_idle()
 
     async def scan_dr_length(self, max_length, zero_ok=False):
@@ -500,17 +1041,26 @@ class JTAGInterface:
         try:
             await self.enter_shift_dr()
 
-            # Fill the entire DR chain with ones.
-            data = await self.shift_tdio(bitarray("1") * max_length, last=False)
+            # Fill the entire DR chain with ones, and then shift in zeroes; the DR length is
+            # the amount of ones that come out before the first zero. The zeroes are shifted in
+            # blocks of doubling size, the first of which is sent together with the ones.
+            async with self.batch():
+                data  = await self.shift_tdio(bitarray("1", endian="little") * max_length,
+                                              last=False)
+                probe = bitarray(endian="little")
+                while len(probe) < max_length:
+                    probe_length = min(max(len(probe), 64), max_length - len(probe))
+                    probe += await self._resolve(await self.shift_tdio(
+                        bitarray("0", endian="little") * probe_length, last=False))
+                    if not probe.all():
+                        break
+                data = await self._resolve(data)
 
-            length = 0
-            while length < max_length:
-                out = await self.shift_tdio(bitarray("0"), last=False)
-                if out[0] == 0:
-                    break
-                length += 1
-            else:
+            try:
+                length = probe.index(0)
+            except ValueError:
                 self._log("overlong dr")
+                await self.shift_tdi(data, last=True)
                 return
 
             # Restore the old contents, just in case this matters.
@@ -524,6 +1074,27 @@ class JTAGInterface:
         finally:
             await self.enter_run_test_idle()
 
+    @staticmethod
+    def _find_dr_length(probe):
+        try:
+            return probe.index(0)
+        except ValueError:
+            return None
+
+    async def probe_dr_length(self, max_length):
+        """
+        Like :meth:`scan_dr_length`, but without restoring the DR contents afterwards; the DR
+        is updated with zeroes instead. Since the probe does not depend on data read from
+        the device, it can be queued in a batch, in which case the DR length (or ``None``, if
+        it is longer than ``max_length``) is returned as a :class:`JTAGDeferred`.
+        """
+        self._log("probe dr length")
+        await self.enter_shift_dr()
+        await self.shift_tdi(bitarray("1", endian="little") * max_length, last=False)
+        probe = await self.shift_tdio(bitarray("0", endian="little") * max_length, last=True)
+        await self.enter_run_test_idle()
+        return _then(probe, self._find_dr_length)
+
     async def select_tap(self, tap):
         idcodes = await self.scan_idcode()
         if not idcodes:
@@ -564,6 +1135,18 @@ class TAPInterface:
         self._dr_suffix   = dr_suffix
         self._dr_overhead = len(dr_prefix) + len(dr_suffix)
 
+    def batch(self):
+        return self.lower.batch()
+
+    async def commit(self):
+        await self.lower.commit()
+
+    def _strip_dr(self, data):
+        if self._dr_suffix:
+            return data[len(self._dr_prefix):-len(self._dr_suffix)]
+        else:
+            return data[len(self._dr_prefix):]
+
     async def test_reset(self):
         await self.lower.test_reset()
 
@@ -577,22 +1160,20 @@ class TAPInterface:
     async def exchange_dr(self, data):
         data = bitarray(data, endian="little")
         data = await self.lower.exchange_dr(self._dr_prefix + data + self._dr_suffix)
-        if self._dr_suffix:
-            return data[len(self._dr_prefix):-len(self._dr_suffix)]
-        else:
-            return data[len(self._dr_prefix):]
+        return _then(data, self._strip_dr)
 
     async def read_dr(self, count, idempotent=False):
         data = await self.lower.read_dr(self._dr_overhead + count, idempotent=idempotent)
-        if self._dr_suffix:
-            return data[len(self._dr_prefix):-len(self._dr_suffix)]
-        else:
-            return data[len(self._dr_prefix):]
+        return _then(data, self._strip_dr)
 
     async def write_dr(self, data):
         data = bitarray(data, endian="little")
         await self.lower.write_dr(self._dr_prefix + data + self._dr_suffix)
 
+    async def write_dr_stream(self, data, count=None):
+        await self.lower.write_dr_stream(data, count,
+                                         prefix=self._dr_prefix, suffix=self._dr_suffix)
+
     async def scan_dr_length(self, max_length, zero_ok=False):
         length = await self.lower.scan_dr_length(max_length=self._dr_overhead + max_length,
                                                  zero_ok=zero_ok)
@@ -601,6 +1182,115 @@ class TAPInterface:
         assert length >= self._dr_overhead
         return length - self._dr_overhead
 
+    def _strip_dr_length(self, length):
+        if length is None:
+            return
+        assert length >= self._dr_overhead
+        return length - self._dr_overhead
+
+    async def probe_dr_length(self, max_length):
+        length = await self.lower.probe_dr_length(max_length=self._dr_overhead + max_length)
+        return _then(length, self._strip_dr_length)
+
+    async def enumerate_ir(self, ir_length, ir_values, max_dr_length, batch_size=None):
+        """
+        Determine the length of the DR selected by every IR value in ``ir_values``, and yield
+        ``(ir_value, dr_length)`` pairs, where ``dr_length`` is ``None`` if the DR is longer
+        than ``max_dr_length``.
+
+        By default, as many IR values are probed per round trip with :meth:`probe_dr_length`
+        as fit in the device FIFOs, and the DR contents are not restored. If ``batch_size`` is
+        specified, at most that many IR values are probed per round trip. If it is 1, the DR
+        contents are restored after every measurement, as with :meth:`scan_dr_length`.
+        """
+        restore = (batch_size == 1)
+        probe_bytes = (self._dr_overhead + max_dr_length + 7) // 8
+        max_batch_size = max(1, _MAX_BATCH_TDO_BYTES // probe_bytes)
+        if batch_size is None or batch_size > max_batch_size:
+            batch_size = max_batch_size
+
+        ir_values = list(ir_values)
+        for index in range(0, len(ir_values), batch_size):
+            batch_values = ir_values[index:index + batch_size]
+            dr_lengths = []
+            async with self.batch():
+                for ir_value in batch_values:
+                    await self.test_reset()
+                    await self.write_ir([(ir_value >> bit) & 1 for bit in range(ir_length)])
+                    if restore:
+                        dr_lengths.append(await self.scan_dr_length(max_length=max_dr_length,
+                                                                    zero_ok=True))
+                    else:
+                        dr_lengths.append(await self.probe_dr_length(max_length=max_dr_length))
+
+            for ir_value, dr_length in zip(batch_values, dr_lengths):
+                if isinstance(dr_length, JTAGDeferred):
+                    dr_length = dr_length.result()
+                yield ir_value, dr_length
+
+
+class JTAGIRCache:
+    """
+    An on-disk cache of DR lengths selected by IR values of a TAP, keyed by its IDCODE.
+
+    DR lengths are stored as a JSON object in ``<directory>/<IDCODE>.json``. A cached DR
+    length of ``None`` means the DR was longer than the maximum DR length used at the time,
+    and is only used if that maximum is not smaller than ``max_dr_length``.
+    """
+    def __init__(self, directory, idcode, ir_length, max_dr_length):
+        self.path           = os.path.join(directory, "{:08x}.json".format(idcode))
+        self._ir_length     = ir_length
+        self._max_dr_length = max_dr_length
+        self._dr_lengths    = {}
+
+        try:
+            with open(self.path, "r") as f:
+                cache = json.load(f)
+            if cache["ir_length"] != ir_length:
+                return
+            # Overlong DRs may fit within a larger maximum, so they have to be probed again.
+            dr_lengths = {int(ir_value): dr_length
+                          for ir_value, dr_length in cache["dr_lengths"].items()
+                          if dr_length is not None or cache["max_dr_length"] >= max_dr_length}
+        except FileNotFoundError:
+            return
+        except (ValueError, KeyError, TypeError, AttributeError):
+            # A cache file that cannot be parsed, or that is not in the expected format,
+            # is simply discarded.
+            return
+        self._dr_lengths = dr_lengths
+
+    def __len__(self):
+        return len(self._dr_lengths)
+
+    def __contains__(self, ir_value):
+        return ir_value in self._dr_lengths
+
+    def __getitem__(self, ir_value):
+        dr_length = self._dr_lengths[ir_value]
+        if dr_length is not None and dr_length > self._max_dr_length:
+            return None
+        return dr_length
+
+    def __setitem__(self, ir_value, dr_length):
+        self._dr_lengths[ir_value] = dr_length
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({
+                "ir_length":     self._ir_length,
+                "max_dr_length": self._max_dr_length,
+                "dr_lengths":    {str(ir_value): dr_length
+                                  for ir_value, dr_length in sorted(self._dr_lengths.items())},
+            }, f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def _default_cache_dir(name):
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "glasgow", name)
+
 
 class JTAGApplet(GlasgowApplet, name="jtag"):
     logger = logging.getLogger(__name__)
@@ -619,22 +1309,47 @@ class JTAGApplet(GlasgowApplet, name="jtag"):
             access.add_pin_argument(parser, pin, default=True)
         access.add_pin_argument(parser, "trst")
 
-        parser.add_argument(
-            "-f", "--frequency", metavar="FREQ", type=int, default=100,
-            help="set clock period to FREQ kHz (default: %(default)s)")
-
     def build(self, target, args):
         self.mux_interface = iface = target.multiplexer.claim_interface(self, args)
-        iface.add_subtarget(JTAGSubtarget(
+        # TCK half period, in system clock cycles. The reset value is only a safe default;
+        # the actual frequency is set at runtime.
+        half_cyc_reset = int(target.sys_clk_freq // (2 * 100e3))
+        half_cyc_lo, addr_half_cyc_lo = target.registers.add_rw(8, reset=half_cyc_reset & 0xff)
+        half_cyc_hi, addr_half_cyc_hi = target.registers.add_rw(8, reset=half_cyc_reset >> 8)
+        self.__addr_half_cyc = (addr_half_cyc_lo, addr_half_cyc_hi)
+        self.__sys_clk_freq  = target.sys_clk_freq
+        subtarget = iface.add_subtarget(JTAGSubtarget(
             pads=iface.get_pads(args, pins=self.__pins),
             out_fifo=iface.get_out_fifo(),
             in_fifo=iface.get_in_fifo(),
-            period_cyc=target.sys_clk_freq // (args.frequency * 1000),
+            half_cyc=Cat(half_cyc_lo, half_cyc_hi),
         ))
+        iface.add_event("command", trigger=subtarget.cmd_stb, data=subtarget.cmd)
+
+    @classmethod
+    def add_run_arguments(cls, parser, access):
+        super().add_run_arguments(parser, access)
+
+        parser.add_argument(
+            "-f", "--frequency", metavar="FREQ", type=int, default=100,
+            help="set TCK frequency to FREQ kHz (default: %(default)s)")
+        parser.add_argument(
+            "--tune-frequency", metavar="MAX-FREQ", type=int, default=None,
+            help="starting at FREQ kHz, find the highest TCK frequency up to MAX-FREQ kHz "
+                 "at which IDCODEs are read reliably, and use it")
 
     async def run(self, device, args):
         iface = await device.demultiplexer.claim_interface(self, self.mux_interface, args)
-        return JTAGInterface(iface, self.logger)
+        jtag_iface = JTAGInterface(iface, self.logger, sys_clk_freq=self.__sys_clk_freq,
+                                   addr_half_cyc=self.__addr_half_cyc)
+        frequency = await jtag_iface.set_frequency(args.frequency * 1000)
+        if args.tune_frequency is not None:
+            await jtag_iface.pulse_trst()
+            frequency = await jtag_iface.tune_frequency(args.tune_frequency * 1000)
+            if frequency is None:
+                raise GlasgowAppletError("cannot tune TCK frequency: no TAPs found")
+            self.logger.info("tuned TCK frequency to %.3f kHz", frequency / 1e3)
+        return jtag_iface
 
     @classmethod
     def add_interact_arguments(cls, parser):
@@ -667,10 +1382,24 @@ class JTAGApplet(GlasgowApplet, name="jtag"):
             in practice, many apparently (from the documentation) unimplemented IR values
             would actually select reserved DRs instead, which can lead to confusion. In some
             cases they even select a constant 0 level on TDO!
+
+            Discovered DR lengths are cached on disk for TAPs that have an IDCODE, so that
+            an interrupted enumeration can be resumed, and a repeated one is instant.
             """)
         p_enumerate_ir.add_argument(
             "--max-dr-length", metavar="LENGTH", type=int, default=1024,
             help="give up scanning DR after LENGTH bits")
+        p_enumerate_ir.add_argument(
+            "--batch-size", metavar="COUNT", type=int, default=None,
+            help="probe at most COUNT IR values per USB round trip (default: as many as "
+                 "the device can buffer); DR values are only restored after probing "
+                 "if COUNT is 1")
+        p_enumerate_ir.add_argument(
+            "--cache-dir", metavar="DIR", type=str, default=_default_cache_dir("jtag-ir"),
+            help="cache discovered DR lengths in DIR (default: %(default)s)")
+        p_enumerate_ir.add_argument(
+            "--no-cache", dest="cache_dir", action="store_const", const=None,
+            help="do not cache discovered DR lengths")
         p_enumerate_ir.add_argument(
             "tap_indexes", metavar="INDEX", type=int, nargs="+",
             help="enumerate IR values for TAP #INDEX")
@@ -718,20 +1447,54 @@ class JTAGApplet(GlasgowApplet, name="jtag"):
                 ir_offset, ir_length = irs[tap_index]
                 self.logger.info("TAP #%d: IR[%d]", tap_index, ir_length)
 
+                if args.cache_dir is None or idcodes[tap_index] is None:
+                    cache = {}
+                else:
+                    cache = JTAGIRCache(args.cache_dir, idcodes[tap_index],
+                                        ir_length, args.max_dr_length)
+                    if cache:
+                        self.logger.info("using %d cached DR lengths from %s",
+                                         len(cache), cache.path)
+
+                # Report DR lengths in IR value order, whether they come from the cache or not.
+                next_ir_value = 0
+                def report_dr_lengths():
+                    nonlocal next_ir_value
+                    while next_ir_value < (1 << ir_length) and next_ir_value in cache:
+                        ir_value, dr_length = next_ir_value, cache[next_ir_value]
+                        next_ir_value += 1
+                        if dr_length is None:
+                            self.logger.warning("  IR=%s DR overlong",
+                                                "{:0{}b}".format(ir_value, ir_length))
+                            continue
+                        elif dr_length == 0:
+                            level = logging.WARN
+                        elif dr_length == 1:
+                            level = logging.DEBUG
+                        else:
+                            level = logging.INFO
+                        self.logger.log(level, "  IR=%s DR[%d]",
+                                        "{:0{}b}".format(ir_value, ir_length), dr_length)
+
+                ir_values = [ir_value for ir_value in range(0, (1 << ir_length))
+                             if ir_value not in cache]
+                report_dr_lengths()
+                if not ir_values:
+                    continue
+
                 tap_iface = await jtag_iface.select_tap(tap_index)
-                for ir_value in range(0, (1 << ir_length)):
-                    await tap_iface.test_reset()
-                    await tap_iface.write_ir([ir_value & (1 << bit) for bit in range(ir_length)])
-                    dr_length = await tap_iface.scan_dr_length(max_length=args.max_dr_length,
-                                                               zero_ok=True)
-                    if dr_length == 0:
-                        level = logging.WARN
-                    elif dr_length == 1:
-                        level = logging.DEBUG
-                    else:
-                        level = logging.INFO
-                    self.logger.log(level, "  IR=%s DR[%d]",
-                                    "{:0{}b}".format(ir_value, ir_length), dr_length)
+                try:
+                    saved_at = time.time()
+                    async for ir_value, dr_length in tap_iface.enumerate_ir(ir_length, ir_values,
+                            max_dr_length=args.max_dr_length, batch_size=args.batch_size):
+                        cache[ir_value] = dr_length
+                        report_dr_lengths()
+                        if isinstance(cache, JTAGIRCache) and time.time() - saved_at > 1:
+                            cache.save()
+                            saved_at = time.time()
+                finally:
+                    if isinstance(cache, JTAGIRCache):
+                        cache.save()
 
         if args.operation == "jtag-repl":
             await AsyncInteractiveConsole(locals={"jtag_iface":jtag_iface}).interact()
@@ -744,9 +1507,388 @@ class JTAGApplet(GlasgowApplet, name="jtag"):
 
             await AsyncInteractiveConsole(locals={"tap_iface":tap_iface}).interact()
 
+    def protocol_decoder(self, args, clock_freq):
+        return JTAGDecoder(clock_freq)
+
+
+class JTAGAppletTool(GlasgowAppletTool, applet=JTAGApplet):
+    help = "decode JTAG scans"
+    description = """
+    Decode JTAG TAP resets and IR/DR scans from an event analyzer trace stream.
+    """
+
+    @classmethod
+    def add_arguments(cls, parser):
+        p_operation = parser.add_subparsers(dest="operation", metavar="OPERATION")
+
+        p_decode = p_operation.add_parser(
+            "decode", help="decode JTAG scans from a trace stream")
+        JTAGDecoder.add_arguments(p_decode)
+        add_trace_argument(p_decode)
+
+    async def run(self, args):
+        if args.operation == "decode":
+            await decode_trace(args.trace,
+                lambda clock_freq: JTAGDecoder.from_arguments(args, clock_freq))
+
 # -------------------------------------------------------------------------------------------------
 
+class _MockTAP:
+    def __init__(self, ir_length, idcode=None, dr_lengths={}):
+        self.ir_length  = ir_length
+        self.idcode     = idcode
+        self.dr_lengths = dr_lengths
+        self.ir         = None
+
+    def capture_ir(self):
+        return [1] + [0] * (self.ir_length - 1)
+
+    def capture_dr(self):
+        if self.ir is None:
+            if self.idcode is None:
+                return [0]
+            return [(self.idcode >> bit) & 1 for bit in range(32)]
+        elif self.ir == (1 << self.ir_length) - 1:
+            return [0]
+        else:
+            return [0] * self.dr_lengths.get(self.ir, 1)
+
+
+class _MockJTAGChain:
+    """
+    A model of a JTAG scan chain that accepts the same commands as :class:`JTAGSubtarget`.
+    ``taps[0]`` is the TAP closest to TDO. Counts the number of commands, and the number of
+    reads, i.e. round trips, and records the most TDO data that was ever pending. TAPs that have
+    an ``update_dr`` method receive the bits shifted into their DR on Update-DR.
+    If TCK frequency (set through registers 0 and 1) exceeds ``max_frequency``, TDO is inverted.
+    """
+    def __init__(self, taps, max_frequency=None):
+        self.taps   = taps
+        self.commands = 0
+        self.reads  = 0
+        self.max_tdo = 0
+        self.device = self
+        self.registers = {}
+        self._max_frequency = max_frequency
+        self._state = "RESET"
+        self._chain = []
+        self._dr_lengths = []
+        self._cmds  = bytearray()
+        self._tdo   = bytearray()
+
+    async def write(self, data):
+        self._cmds += data
+        while self._cmds:
+            cmd = self._cmds[0]
+            if cmd & CMD_MASK in (CMD_RESET, CMD_TRST):
+                if cmd & CMD_MASK == CMD_RESET:
+                    self._state = "RESET"
+                    for tap in self.taps:
+                        tap.ir = None
+                del self._cmds[:1]
+                self.commands += 1
+                continue
+
+            header = 6 if cmd & CMD_MASK == CMD_SCAN else 3
+            if len(self._cmds) < header:
+                break
+            count, = struct.unpack("<H", self._cmds[header - 2:header])
+            size = header + ((count + 7) // 8 if cmd & BIT_DATA_OUT else 0)
+            if len(self._cmds) < size:
+                break
+
+            if cmd & BIT_DATA_OUT:
+                bits = bitarray(endian="little")
+                bits.frombytes(bytes(self._cmds[header:size]))
+                bits = bits[:count]
+            else:
+                bits = bitarray("1", endian="little") * count
+            if cmd & CMD_MASK == CMD_SCAN:
+                for index in range(self._cmds[1] & 0xf):
+                    self._clock(tms=(self._cmds[2] >> index) & 1, tdi=0)
+            tdo_bits = bitarray(endian="little")
+            for index, bit in enumerate(bits):
+                if cmd & CMD_MASK == CMD_SHIFT_TMS:
+                    tdo_bits.append(self._clock(tms=bit, tdi=0))
+                else:
+                    tms = ((cmd & CMD_MASK == CMD_SCAN or bool(cmd & BIT_LAST)) and
+                           index == count - 1)
+                    tdo_bits.append(self._clock(tms=tms, tdi=bit))
+            if cmd & CMD_MASK == CMD_SCAN:
+                for index in range(self._cmds[1] >> 4):
+                    self._clock(tms=(self._cmds[3] >> index) & 1, tdi=0)
+            if cmd & BIT_DATA_IN:
+                self._tdo += tdo_bits.tobytes()
+                self.max_tdo = max(self.max_tdo, len(self._tdo))
+            del self._cmds[:size]
+            self.commands += 1
+
+    async def write_register(self, addr, value):
+        self.registers[addr] = value
+
+    async def read(self, length):
+        assert len(self._tdo) >= length
+        self.reads += 1
+        data, self._tdo = self._tdo[:length], self._tdo[length:]
+        return data
+
+    def _clock(self, tms, tdi):
+        tdo = 1
+        if self._state == "IRCAPTURE":
+            self._chain = sum((tap.capture_ir() for tap in self.taps), [])
+        elif self._state == "DRCAPTURE":
+            captures = [tap.capture_dr() for tap in self.taps]
+            self._dr_lengths = [len(capture) for capture in captures]
+            self._chain = sum(captures, [])
+        elif self._state in ("IRSHIFT", "DRSHIFT"):
+            tdo = self._chain[0]
+            self._chain = self._chain[1:] + [int(tdi)]
+            if self._max_frequency is not None:
+                half_cyc = self.registers[0] | (self.registers[1] << 8)
+                if 30e6 / (2 * half_cyc) > self._max_frequency:
+                    tdo ^= 1
+
+        self._state = TAP_STATES[self._state][tms]
+        if self._state == "RESET":
+            for tap in self.taps:
+                tap.ir = None
+        elif self._state == "IRUPDATE":
+            offset = 0
+            for tap in self.taps:
+                tap.ir = sum(bit << n for n, bit in
+                             enumerate(self._chain[offset:offset + tap.ir_length]))
+                offset += tap.ir_length
+        elif self._state == "DRUPDATE":
+            offset = 0
+            for tap, dr_length in zip(self.taps, self._dr_lengths):
+                if hasattr(tap, "update_dr"):
+                    tap.update_dr(self._chain[offset:offset + dr_length])
+                offset += dr_length
+        return tdo
+
+
 class JTAGAppletTestCase(GlasgowAppletTestCase, applet=JTAGApplet):
     @synthesis_test
     def test_build(self):
         self.assertBuilds()
+
+    def setup_loopback(self):
+        self.build_simulated_applet()
+        mux_iface = self.applet.mux_interface
+        mux_iface.comb += mux_iface.pads.tdo_t.i.eq(mux_iface.pads.tdi_t.o)
+
+    @applet_simulation_test("setup_loopback", ["--frequency", "3000"])
+    async def test_batch(self):
+        jtag_iface = await self.run_simulated_applet()
+        await jtag_iface.test_reset()
+        async with jtag_iface.batch():
+            result_1 = await jtag_iface.exchange_dr(bitarray("10110", endian="little"))
+            result_2 = await jtag_iface.read_dr(12)
+            self.assertFalse(result_1.done())
+        self.assertEqual(result_1.result(), bitarray("10110", endian="little"))
+        self.assertEqual(await result_2, bitarray("1" * 12, endian="little"))
+
+    @applet_simulation_test("setup_loopback", ["--frequency", "3000"])
+    async def test_scan_idcode(self):
+        jtag_iface = await self.run_simulated_applet()
+        self.assertEqual(await jtag_iface.scan_idcode(), [])
+
+    def test_parse_idcodes(self):
+        jtag_iface = JTAGInterface(None, self.applet.logger)
+        def idcode(value):
+            bits = bitarray(endian="little")
+            bits.frombytes(struct.pack("<L", value))
+            return bits
+        zero = bitarray("0", endian="little")
+        self.assertEqual(
+            jtag_iface._parse_idcodes(idcode(0x1234567f) + zero + idcode(0x0badc0df) +
+                                      idcode(0xffffffff), max_idcodes=8),
+            [0x1234567f, None, 0x0badc0df])
+        self.assertEqual(
+            jtag_iface._parse_idcodes(zero * 8, max_idcodes=8),
+            None)
+
+    def run_mock_chain(self, taps, case, **kwargs):
+        chain = _MockJTAGChain(taps, **kwargs)
+        jtag_iface = JTAGInterface(chain, self.applet.logger,
+                                   sys_clk_freq=30e6, addr_half_cyc=(0, 1))
+        asyncio.get_event_loop().run_until_complete(case(jtag_iface))
+        return chain
+
+    def test_scan_chain(self):
+        async def case(jtag_iface):
+            await jtag_iface.pulse_trst()
+            self.assertEqual(await jtag_iface.scan_idcode(),
+                             [0x4ba00477, None, 0x06413041])
+            self.assertEqual(await jtag_iface.scan_ir(),
+                             [(0, 4), (4, 5), (9, 6)])
+            tap_iface = await jtag_iface.select_tap(2)
+            await tap_iface.write_ir(bitarray("010000", endian="little"))
+            self.assertEqual(await tap_iface.scan_dr_length(max_length=64), 13)
+        chain = self.run_mock_chain([
+            _MockTAP(4, idcode=0x4ba00477),
+            _MockTAP(5),
+            _MockTAP(6, idcode=0x06413041, dr_lengths={0b000010: 13}),
+        ], case)
+        self.assertEqual(chain.reads, 5)
+
+    def test_batch_auto_commit(self):
+        async def case(jtag_iface):
+            await jtag_iface.pulse_trst()
+            await jtag_iface.scan_idcode()
+            jtag_iface.lower.reads = 0
+            jtag_iface.lower.max_tdo = 0
+            async with jtag_iface.batch():
+                results = [await jtag_iface.read_dr(32) for _ in range(1000)]
+            self.assertEqual({result.result().tobytes() for result in results},
+                             {struct.pack("<L", 0x4ba00477)})
+        chain = self.run_mock_chain([_MockTAP(4, idcode=0x4ba00477)], case)
+        self.assertEqual(chain.reads, (1000 * 4 + _MAX_BATCH_TDO_BYTES - 1) //
+                                      _MAX_BATCH_TDO_BYTES)
+        self.assertLessEqual(chain.max_tdo, _MAX_BATCH_TDO_BYTES)
+
+    def test_scan_ir_long(self):
+        async def case(jtag_iface):
+            self.assertEqual(await jtag_iface.scan_ir(),
+                             [(0, 100), (100, 120), (220, 2)])
+            self.assertEqual(await jtag_iface.scan_ir(count=2),
+                             [(0, 100), (100, 120)])
+            self.assertEqual(await jtag_iface.scan_ir(max_length=110), None)
+        self.run_mock_chain([_MockTAP(100), _MockTAP(120), _MockTAP(2)], case)
+
+    def test_enumerate_ir(self):
+        async def case(jtag_iface):
+            await jtag_iface.pulse_trst()
+            tap_iface = await jtag_iface.select_tap(1)
+            jtag_iface.lower.reads = 0
+            async for ir_value, dr_length in tap_iface.enumerate_ir(3, range(8),
+                    max_dr_length=max_dr_length, batch_size=batch_size):
+                dr_lengths.append(dr_length)
+        for batch_size, max_dr_length, reads in ((1, 40, 8), (4, 40, 2), (None, 40, 1),
+                                                 (None, 1024, 3), (8, 1024, 3)):
+            dr_lengths = []
+            chain = self.run_mock_chain([
+                _MockTAP(4, idcode=0x4ba00477),
+                _MockTAP(3, idcode=0x06413041, dr_lengths={0b001: 32, 0b010: 13, 0b110: 7}),
+            ], case)
+            self.assertEqual(dr_lengths, [1, 32, 13, 1, 1, 1, 7, 1])
+            self.assertEqual(chain.reads, reads)
+            self.assertLessEqual(chain.max_tdo, _MAX_BATCH_TDO_BYTES)
+
+    def test_ir_cache(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            cache = JTAGIRCache(directory, 0x4ba00477, ir_length=4, max_dr_length=64)
+            self.assertEqual(len(cache), 0)
+            cache[0b0000] = 32
+            cache[0b0001] = None
+            cache.save()
+
+            cache = JTAGIRCache(directory, 0x4ba00477, ir_length=4, max_dr_length=16)
+            self.assertEqual((cache[0b0000], cache[0b0001]), (None, None))
+            cache = JTAGIRCache(directory, 0x4ba00477, ir_length=4, max_dr_length=128)
+            self.assertEqual((cache[0b0000], 0b0001 in cache), (32, False))
+            cache = JTAGIRCache(directory, 0x4ba00477, ir_length=5, max_dr_length=64)
+            self.assertEqual(len(cache), 0)
+
+            # Overlong DRs probed again at a larger maximum are saved at that maximum.
+            cache = JTAGIRCache(directory, 0x4ba00477, ir_length=4, max_dr_length=1024)
+            cache[0b0001] = None
+            cache.save()
+            cache = JTAGIRCache(directory, 0x4ba00477, ir_length=4, max_dr_length=1024)
+            self.assertEqual((cache[0b0000], cache[0b0001]), (32, None))
+
+            for contents in ("{", "[]", "{}", '{"ir_length": 4}',
+                             '{"ir_length": 4, "max_dr_length": 64, "dr_lengths": []}'):
+                with open(cache.path, "w") as f:
+                    f.write(contents)
+                cache = JTAGIRCache(directory, 0x4ba00477, ir_length=4, max_dr_length=64)
+                self.assertEqual(len(cache), 0)
+
+    def test_enter_state(self):
+        self.assertEqual(TAP_PATHS["RESET", "IRSHIFT"], "01100")
+        self.assertEqual(TAP_PATHS["DRPAUSE", "IRSHIFT"], "111100")
+        self.assertEqual(TAP_PATHS["IREXIT1", "IDLE"], "10")
+        self.assertEqual(tap_path_tms("IRPAUSE", ["IREXIT2", "IRSHIFT"]), "10")
+        with self.assertRaises(ValueError):
+            tap_path_tms("IDLE", ["IRSELECT"])
+
+        async def case(jtag_iface):
+            for state in TAP_STATES:
+                await jtag_iface.enter_state(state)
+                self.assertEqual(jtag_iface.lower._state, state)
+            await jtag_iface.enter_state("IDLE",
+                path=["DRSELECT", "DRCAPTURE", "DREXIT1", "DRPAUSE", "DREXIT2", "DRUPDATE"])
+            self.assertEqual(jtag_iface.lower._state, "IDLE")
+            with self.assertRaises(ValueError):
+                await jtag_iface.enter_state("IDLE", path=["IRSHIFT"])
+
+            jtag_iface.lower.commands = 0
+            async with jtag_iface.batch():
+                await jtag_iface.test_reset()
+                await jtag_iface.write_ir(bitarray("01", endian="little"))
+                await jtag_iface.write_dr(bitarray("1", endian="little"))
+                await jtag_iface.enter_pause_dr()
+            self.assertEqual(jtag_iface.lower._state, "DRPAUSE")
+            # Test-Logic-Reset → Run-Test/Idle, write IR, write DR, Run-Test/Idle → Pause-DR.
+            self.assertEqual(jtag_iface.lower.commands, 4)
+        self.run_mock_chain([_MockTAP(2)], case)
+
+    def test_iter_bit_chunks(self):
+        import io
+        bits = bitarray("1101", endian="little") * 3000
+        self.assertEqual([len(chunk) for chunk in _iter_bit_chunks(bits)], [4096, 4096, 3808])
+        self.assertEqual(sum(_iter_bit_chunks(iter(bits), count=5000),
+                             bitarray(endian="little")), bits[:5000])
+        self.assertEqual([chunk.to01() for chunk in _iter_bit_chunks(["10", [1, 1], 0])],
+                         ["10110"])
+        self.assertEqual([chunk.to01() for chunk in
+                          _iter_bit_chunks(io.BytesIO(b"\x01\x80"), count=12)],
+                         ["100000000000"])
+        with self.assertRaises(ValueError):
+            list(_iter_bit_chunks([1, 0], count=3))
+
+    def test_shift_stream(self):
+        import io
+        tdi_bits = bitarray(endian="little")
+        tdi_bits.frombytes(bytes(range(256)) * 34)
+        async def case(jtag_iface):
+            await jtag_iface.pulse_trst()
+            await jtag_iface.test_reset()
+            await jtag_iface.enter_shift_dr()
+            tdo_bits = bitarray(endian="little")
+            async for tdo_chunk in jtag_iface.shift_tdio_stream(io.BytesIO(tdi_bits.tobytes())):
+                tdo_bits += tdo_chunk
+            await jtag_iface.enter_run_test_idle()
+            # The single TAP is in BYPASS, which captures a 0.
+            self.assertEqual(tdo_bits, bitarray("0", endian="little") + tdi_bits[:-1])
+            await jtag_iface.enter_shift_dr()
+            tdo_bits = await jtag_iface.shift_tdo(len(tdi_bits))
+            self.assertEqual(tdo_bits, bitarray("0", endian="little") +
+                                       bitarray("1", endian="little") * (len(tdi_bits) - 1))
+            await jtag_iface.enter_run_test_idle()
+            await jtag_iface.write_dr(tdi_bits)
+        chain = self.run_mock_chain([_MockTAP(2)], case)
+        self.assertEqual(chain.reads, 2 * ((len(tdi_bits) + 4095) // 4096))
+        self.assertEqual(chain._cmds, b"")
+        self.assertEqual(chain._state, "IDLE")
+
+    def test_set_frequency(self):
+        async def case(jtag_iface):
+            self.assertEqual(await jtag_iface.set_frequency(1e6), 1e6)
+            self.assertEqual(jtag_iface.lower.registers, {0: 15, 1: 0})
+            self.assertEqual(await jtag_iface.set_frequency(700e3), 30e6 / 44)
+            self.assertEqual(await jtag_iface.set_frequency(1e3), 1e3)
+            self.assertEqual(jtag_iface.lower.registers, {0: 15000 & 0xff, 1: 15000 >> 8})
+            with self.assertRaises(GlasgowAppletError):
+                await jtag_iface.set_frequency(100)
+        self.run_mock_chain([], case)
+
+    def test_tune_frequency(self):
+        async def case(jtag_iface):
+            await jtag_iface.set_frequency(100e3)
+            self.assertEqual(await jtag_iface.tune_frequency(max_frequency=10e6), 30e6 / 14)
+            self.assertEqual(jtag_iface.lower.registers, {0: 7, 1: 0})
+            self.assertEqual(await jtag_iface.scan_idcode(), [0x4ba00477, None])
+        self.run_mock_chain([_MockTAP(4, idcode=0x4ba00477), _MockTAP(5)], case,
+                            max_frequency=2.5e6)
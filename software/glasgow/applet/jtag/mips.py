@@ -4,9 +4,10 @@
 import struct
 import logging
 import asyncio
+import argparse
 from bitarray import bitarray
 
-from . import JTAGApplet
+from . import JTAGApplet, _MAX_BATCH_TDO_BYTES
 from .. import *
 from ...support.aobject import *
 from ...support.endpoint import *
@@ -15,17 +16,221 @@ from ...arch.mips import *
 from ...protocol.gdb_remote import *
 
 
+# Memory is copied in chunks of at most this many words, both via PrAcc and via FASTDATA.
+_COPY_CHUNK_WORDS   = 0x400
+# Below this many words, copying memory via PrAcc is faster than loading the FASTDATA handler.
+_FASTDATA_MIN_WORDS = 16
+
+
+def _parse_region(arg):
+    try:
+        address, length = map(lambda value: int(value, 0), arg.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError("{} is not a valid ADDRESS,LENGTH pair".format(arg))
+    return address, length
+
+
+# Marks a branch target that cannot be predicted.
+_UNKNOWN = object()
+
+
+class _PrAccPredictor:
+    """
+    A model of a CPU executing code via PrAcc, used to predict which dmseg accesses it is going
+    to make. The model tracks the register values that follow from the code and from the data
+    provided to the CPU, and predicts an access only if the CPU cannot possibly make a different
+    one; in particular, it stops at every instruction that may cause an exception, at every
+    branch with an unknown target, and after the delay slot of every taken branch.
+    """
+    def __init__(self, areas, mask):
+        self._areas   = areas
+        self._mask    = mask
+        self._regs    = {0: 0}
+        # The instruction fetch that follows, once any data access has been made.
+        self._fetch   = areas[0][0]
+        # The branch target, fetched after the delay slot.
+        self._delay   = None
+        # The data access made by the instruction fetched last, as (address, is_write, register).
+        self._data    = None
+        # The base register, offset and the kind of a data access with an unknown address.
+        self._base    = None
+        self._unsure  = False
+        self._written = set()
+
+    def _in_areas(self, address):
+        return any(address in range(area_beg, area_beg + len(area) * 4)
+                   for area_beg, area, _, _ in self._areas)
+
+    def _sext32(self, value):
+        value &= 0xffffffff
+        if value & 0x80000000:
+            value -= 1 << 32
+        return value & self._mask
+
+    def _set(self, reg, value):
+        if reg == 0:
+            pass
+        elif value is None:
+            self._regs.pop(reg, None)
+        else:
+            self._regs[reg] = value & self._mask
+
+    def _expected(self):
+        if self._data is not None:
+            return self._data[:2]
+        elif self._fetch is not None:
+            return self._fetch, False
+
+    def observe(self, address, is_write):
+        """
+        Update the model with an access that the CPU is waiting for.
+        """
+        # Data written by the CPU is only known once the access is completed.
+        self._written.clear()
+        self._unsure = False
+
+        if self._base is not None:
+            base_reg, offset, base_is_write, reg = self._base
+            self._base = None
+            if (address, is_write) != (self._fetch, False) and is_write == base_is_write:
+                # The address of the access reveals the value of the base register.
+                self._set(base_reg, address - offset)
+                self._data = (address, is_write, reg)
+                return
+
+        expected = self._expected()
+        if expected == (address, is_write):
+            return
+        if expected is not None or self._delay is not None:
+            # The CPU did not do what the code says, e.g. because it took an exception, or
+            # executed code outside of dmseg, so its registers can no longer be relied upon.
+            self._regs  = {0: 0}
+            self._delay = None
+        code_beg, code, _, _ = self._areas[0]
+        if not is_write and address in range(code_beg, code_beg + len(code) * 4):
+            self._data, self._fetch = None, address
+        else:
+            self._data, self._fetch = (address, is_write, None), None
+
+    def next_access(self):
+        """
+        Return the next access as ``(address, is_write)``, or ``None`` if it is not certain.
+        """
+        if self._unsure or self._base is not None:
+            return None
+        access = self._expected()
+        if access is None or not self._in_areas(access[0]):
+            return None
+        if not access[1] and access[0] in self._written:
+            return None
+        return access
+
+    def complete(self, address, is_write, word):
+        """
+        Update the model with an access that is completed, with ``word`` being the instruction or
+        data provided to the CPU.
+        """
+        if self._data is not None:
+            _, _, reg = self._data
+            self._data = None
+            if is_write:
+                self._written.add(address)
+            elif reg is not None:
+                self._set(reg, self._sext32(word))
+        else:
+            self._execute(address, word)
+
+    def _execute(self, address, instr):
+        self._unsure = False
+        if self._delay is None:
+            self._fetch = (address + 4) & self._mask
+        elif self._delay is _UNKNOWN:
+            self._fetch = None
+        else:
+            # The CPU may fetch the instructions that follow the delay slot before it fetches
+            # the branch target, so nothing is predicted past a taken branch.
+            self._fetch  = self._delay
+            self._unsure = True
+        self._delay = None
+
+        regs = self._regs
+        op, rs, rt, rd, sa, fn = ((instr >> 26) & 0x3f, (instr >> 21) & 0x1f, (instr >> 16) & 0x1f,
+                                  (instr >> 11) & 0x1f, (instr >>  6) & 0x1f, (instr >>  0) & 0x3f)
+        imm  = instr & 0xffff
+        simm = imm - 0x10000 if imm & 0x8000 else imm
+        def known(*regs_used):
+            return all(reg in regs for reg in regs_used)
+
+        if op == 0x00 and fn == 0x00:               # SLL
+            self._set(rd, self._sext32(regs[rt] << sa) if known(rt) else None)
+        elif op == 0x00 and fn == 0x25:             # OR
+            self._set(rd, regs[rs] | regs[rt] if known(rs, rt) else None)
+        elif op == 0x00 and fn == 0x08:             # JR
+            self._delay = regs[rs] if known(rs) else _UNKNOWN
+        elif op == 0x00 and fn in (0x10, 0x12):     # MFHI, MFLO
+            self._set(rd, None)
+        elif op == 0x00 and fn in (0x0f, 0x11, 0x13): # SYNC, MTHI, MTLO
+            pass
+        elif op in (0x04, 0x05, 0x07):              # BEQ, BNE, BGTZ
+            if known(rs, rt):
+                if op == 0x04:
+                    taken = regs[rs] == regs[rt]
+                elif op == 0x05:
+                    taken = regs[rs] != regs[rt]
+                elif op == 0x07:
+                    taken = 0 < regs[rs] <= (self._mask >> 1)
+                if taken:
+                    self._delay = (address + 4 + simm * 4) & self._mask
+            else:
+                self._delay = _UNKNOWN
+        elif op == 0x09:                            # ADDIU
+            self._set(rt, self._sext32(regs[rs] + simm) if known(rs) else None)
+        elif op == 0x0d:                            # ORI
+            self._set(rt, regs[rs] | imm if known(rs) else None)
+        elif op == 0x0e:                            # XORI
+            self._set(rt, regs[rs] ^ imm if known(rs) else None)
+        elif op == 0x0f:                            # LUI
+            self._set(rt, self._sext32(imm << 16))
+        elif op in (0x23, 0x2b):                    # LW, SW
+            is_write = (op == 0x2b)
+            reg = None if is_write else rt
+            if not known(rs):
+                self._base = (rs, simm, is_write, reg)
+                self._set(reg, None)
+            elif self._in_areas((regs[rs] + simm) & self._mask):
+                self._data = ((regs[rs] + simm) & self._mask, is_write, reg)
+            else:
+                # Accesses outside of dmseg may cause an exception.
+                self._unsure = True
+                self._set(reg, None)
+        elif op == 0x10 and rs == 0x00:             # MFC0
+            self._set(rt, None)
+        elif op == 0x10 and rs == 0x04:             # MTC0
+            pass
+        else:
+            # DERET, cache operations, and anything else that might affect control flow in ways
+            # not described by the model.
+            self._regs   = {0: 0}
+            self._unsure = True
+
+
 class EJTAGInterface(aobject, GDBRemote):
-    async def __init__(self, interface, logger):
+    async def __init__(self, interface, logger, work_area=None, ram=()):
         self.lower   = interface
         self._logger = logger
         self._level  = logging.DEBUG if self._logger.name == __name__ else logging.TRACE
 
+        self._work_area = work_area
+        self._ram       = list(ram)
+
         self._control = DR_CONTROL()
         self._state   = "Probe"
         await self._probe()
 
         self._pracc_probed = False
+        # Cleared once the CPU makes an access other than the predicted one; see
+        # _exec_pracc_pipelined.
+        self._pracc_pipelined = True
         self._cp0_config   = None
         self._cp0_config1  = None
         self._cp0_debug    = None
@@ -122,6 +327,33 @@ class EJTAGInterface(aobject, GDBRemote):
             data_bits.frombytes(struct.pack("<Q", data))
         await self.lower.write_dr(data_bits)
 
+    async def _exchange_fastdata(self, words):
+        # Every FASTDATA scan shifts in SPrAcc=0, which completes a pending access to
+        # the FASTDATA area, and shifts out SPrAcc=1 if there was one. The scans are queued
+        # without waiting for the CPU; this only works if the CPU makes every access before
+        # the probe gets to it, so each scan is checked afterwards. The scans are committed in
+        # batches whose TDO data fits in the device FIFOs.
+        await self.lower.write_ir(IR_FASTDATA)
+        batch_words = _MAX_BATCH_TDO_BYTES // ((1 + self.bits + 7) // 8)
+        results = []
+        for batch_offset in range(0, len(words), batch_words):
+            async with self.lower.batch():
+                for word in words[batch_offset:batch_offset + batch_words]:
+                    fastdata_bits = bitarray("0", endian="little")
+                    fastdata_bits.frombytes(struct.pack("<Q", word))
+                    results.append(await self.lower.exchange_dr(fastdata_bits[:1 + self.bits]))
+
+        words = []
+        for index, result in enumerate(results):
+            fastdata_bits = result.result()
+            if not fastdata_bits[0]:
+                raise GlasgowAppletError("FASTDATA: no pending access at word %d; "
+                                         "try lowering TCK frequency" % index)
+            word, = struct.unpack("<Q", fastdata_bits[1:].tobytes().ljust(8, b"\x00"))
+            words.append(word & 0xffffffff)
+        self._log("FASTDATA: exchanged %d words", len(words))
+        return words
+
     # DMAAcc memory read/write
 
     async def _dmaacc_read(self, address, size):
@@ -226,21 +458,48 @@ class EJTAGInterface(aobject, GDBRemote):
             self._change_state("Interrupted")
         return control.DM
 
+    def _pracc_area(self, areas, address, is_write):
+        for area_beg, area, area_wr, area_name in areas:
+            if address in range(area_beg, area_beg + len(area) * 4):
+                break
+        else:
+            raise GlasgowAppletError("Exec_PrAcc: address %#0.*x out of range" %
+                                     (self._prec, address))
+        if is_write and not area_wr:
+            raise GlasgowAppletError("Exec_PrAcc: write access to %s at %#0.*x" %
+                                     (area_name, self._prec, address))
+        return area, (address - area_beg) // 4, area_name
+
     async def _exec_pracc_bare(self, code, data=[], max_steps=1024,
-                               entry_state="Stopped", suspend_state="Stopped"):
+                               entry_state="Stopped", suspend_state="Stopped", fastdata=None):
         self._check_state("execute PrAcc", entry_state)
         self._change_state("PrAcc")
 
         temp     = [0] * 0x80
 
         code_beg = (DMSEG_addr + 0x0200)  & self._mask
-        code_end = code_beg   + len(code) * 4
         temp_beg = (DMSEG_addr + 0x1000)  & self._mask
-        temp_end = temp_beg   + len(temp) * 4
         data_beg = (DMSEG_addr + 0x1200)  & self._mask
-        data_end = data_beg   + len(data) * 4
+        areas = [
+            (code_beg, code, False, "code"),
+            (temp_beg, temp, True,  "temp"),
+            (data_beg, data, True,  "data"),
+        ]
+
+        # The ALL instruction, which pipelined execution relies on, might not be available on
+        # EJTAG 1.x/2.0 CPUs.
+        if self._impcode.EJTAGver == 0 or not self._pracc_pipelined:
+            await self._exec_pracc_steps(areas, max_steps, suspend_state, fastdata)
+        else:
+            await self._exec_pracc_pipelined(areas, max_steps, suspend_state, fastdata)
+        return data
 
-        for step in range(max_steps):
+    async def _exec_pracc_steps(self, areas, max_steps, suspend_state, fastdata, first_step=0):
+        code_beg = areas[0][0]
+        fast_beg = (DMSEG_addr + 0x0000)  & self._mask
+        fast_end = fast_beg   + 0x10
+
+        for step in range(first_step, max_steps):
             for _ in range(3):
                 control = await self._exchange_control()
                 if step == 0 and not control.DM:
@@ -258,24 +517,20 @@ class EJTAGInterface(aobject, GDBRemote):
             if step > 0 and address == code_beg:
                 self._log("Exec_PrAcc: debug suspend")
                 self._change_state(suspend_state)
-                break
-
-            if address in range(code_beg, code_end):
-                area, area_beg, area_wr, area_name = code, code_beg, False, "code"
-            elif address in range(temp_beg, temp_end):
-                area, area_beg, area_wr, area_name = temp, temp_beg, True,  "temp"
-            elif address in range(data_beg, data_end):
-                area, area_beg, area_wr, area_name = data, data_beg, True,  "data"
-            else:
-                raise GlasgowAppletError("Exec_PrAcc: address %#0.*x out of range" %
-                                         (self._prec, address))
-
-            area_off = (address - area_beg) // 4
+                return
+
+            if address in range(fast_beg, fast_end):
+                # The code accesses the FASTDATA area; `fastdata` completes every such access
+                # it is going to make in one go, after which the code must return to dmseg.
+                if fastdata is None:
+                    raise GlasgowAppletError("Exec_PrAcc: unexpected FASTDATA access at %#0.*x" %
+                                             (self._prec, address))
+                await fastdata()
+                fastdata = None
+                continue
+
+            area, area_off, area_name = self._pracc_area(areas, address, control.PRnW)
             if control.PRnW:
-                if not area_wr:
-                    raise GlasgowAppletError("Exec_PrAcc: write access to %s at %#0.*x" %
-                                             (area_name, self._prec, address))
-
                 word = await self._read_data()
                 self._log("Exec_PrAcc: write %s [%#06x] = %#0.*x",
                           area_name, address & 0xffff, self._prec, word)
@@ -290,7 +545,142 @@ class EJTAGInterface(aobject, GDBRemote):
         else:
             raise GlasgowAppletError("Exec_PrAcc: step limit exceeded")
 
-        return data
+    async def _exchange_all(self, address=0, data=0, **fields):
+        # ALL selects ADDRESS, DATA and CONTROL at once, with ADDRESS closest to TDO; a single
+        # scan both captures the access the CPU is waiting for and, with PrAcc=0, completes it.
+        control = self._control.copy()
+        control.Rocc  = 1
+        control.PrAcc = 1
+        for field, value in fields.items():
+            setattr(control, field, value)
+        address_bits = bitarray(endian="little")
+        address_bits.frombytes(struct.pack("<Q", address))
+        data_bits = bitarray(endian="little")
+        data_bits.frombytes(struct.pack("<Q", data))
+        await self.lower.write_ir(IR_ALL)
+        return await self.lower.exchange_dr(address_bits[:self._address_length] +
+                                            data_bits[:self.bits] + control.to_bitarray())
+
+    def _parse_all(self, all_bits):
+        address_bits = all_bits[:self._address_length]
+        address_bits.extend(address_bits[-1:] * (64 - self._address_length))
+        address, = struct.unpack("<q", address_bits.tobytes())
+        data_bits = all_bits[self._address_length:self._address_length + self.bits]
+        data = int.from_bytes(data_bits.tobytes(), "little")
+        control = DR_CONTROL.from_bitarray(all_bits[self._address_length + self.bits:])
+        return address & self._mask, data, control
+
+    async def _exec_pracc_pipelined(self, areas, max_steps, suspend_state, fastdata):
+        # Every access that the CPU makes is captured first, and completed only once it is known
+        # to be the expected one. However, the accesses that follow it can often be predicted
+        # from the code, and those are completed without waiting, all in one batch. The batch
+        # ends where the prediction stops being certain, e.g. at a taken branch, or once its TDO
+        # data would no longer fit in the device FIFOs, and the access after it is captured again.
+        #
+        # Within a batch, the scans are not checked until it is committed. If the CPU deviates
+        # from the prediction, e.g. because it is slow to make an access, and none of the scans
+        # after that completed an access, the code is continued step by step; otherwise, the CPU
+        # got a word meant for a different access, and there is no way to recover. Either way,
+        # PrAcc code is executed step by step from then on.
+        code_beg = areas[0][0]
+        fast_beg = (DMSEG_addr + 0x0000)  & self._mask
+        fast_end = fast_beg   + 0x10
+
+        all_bits = self._address_length + self.bits + len(self._control.to_bitarray())
+        max_accesses = _MAX_BATCH_TDO_BYTES // ((all_bits + 7) // 8) - 1
+
+        predictor = _PrAccPredictor(areas, self._mask)
+        capture   = None
+        step      = 0
+        while step < max_steps:
+            for _ in range(3):
+                if capture is None:
+                    capture = self._parse_all(await self._exchange_all())
+                address, _, control = capture
+                capture = None
+                if step == 0 and not control.DM:
+                    raise GlasgowAppletError("Exec_PrAcc: DM low on entry")
+                elif not control.DM:
+                    self._log("Exec_PrAcc: debug return")
+                    self._change_state("Running")
+                    return
+                elif control.PrAcc:
+                    break
+            else:
+                raise GlasgowAppletError("Exec_PrAcc: PrAcc stuck low")
+
+            if step > 0 and address == code_beg:
+                self._log("Exec_PrAcc: debug suspend")
+                self._change_state(suspend_state)
+                return
+
+            if address in range(fast_beg, fast_end):
+                # See _exec_pracc_steps.
+                if fastdata is None:
+                    raise GlasgowAppletError("Exec_PrAcc: unexpected FASTDATA access at %#0.*x" %
+                                             (self._prec, address))
+                await fastdata()
+                fastdata = None
+                continue
+
+            predictor.observe(address, bool(control.PRnW))
+            accesses = []
+            access   = (address, bool(control.PRnW))
+            while (access is not None and step + len(accesses) < max_steps and
+                    len(accesses) < max_accesses):
+                address, is_write = access
+                if step + len(accesses) > 0 and address == code_beg:
+                    break
+                area, area_off, area_name = self._pracc_area(areas, address, is_write)
+                word = 0 if is_write else area[area_off]
+                accesses.append((address, is_write, area, area_off, area_name, word))
+                predictor.complete(address, is_write, word)
+                access = predictor.next_access()
+
+            self._log("Exec_PrAcc: pipeline %d accesses", len(accesses))
+            async with self.lower.batch():
+                results = []
+                for address, is_write, area, area_off, area_name, word in accesses:
+                    results.append(await self._exchange_all(address, word, PrAcc=0))
+                capture = await self._exchange_all()
+
+            for index, ((address, is_write, area, area_off, area_name, word), result) in \
+                    enumerate(zip(accesses, results)):
+                actual_address, actual_word, actual_control = self._parse_all(result.result())
+                if not (actual_control.DM and actual_control.PrAcc and
+                        actual_address == address and actual_control.PRnW == is_write):
+                    break
+                if is_write:
+                    self._log("Exec_PrAcc: write %s [%#06x] = %#0.*x",
+                              area_name, address & 0xffff, self._prec, actual_word)
+                    area[area_off] = actual_word
+                else:
+                    self._log("Exec_PrAcc: read %s [%#06x] = %#0.*x",
+                              area_name, address & 0xffff, self._prec, word)
+            else:
+                capture = self._parse_all(capture.result())
+                step += len(accesses)
+                continue
+
+            if actual_control.PrAcc:
+                deviation = "expected %s access to %#0.*x, CPU made %s access to %#0.*x" % \
+                    ("write" if is_write else "read", self._prec, address,
+                     "write" if actual_control.PRnW else "read", self._prec, actual_address)
+            else:
+                deviation = "expected %s access to %#0.*x, CPU made none" % \
+                    ("write" if is_write else "read", self._prec, address)
+            self._logger.warning("Exec_PrAcc: %s; executing PrAcc code step by step from now on",
+                                 deviation)
+            self._pracc_pipelined = False
+            if any(self._parse_all(result.result())[2].PrAcc for result in results[index:]):
+                raise GlasgowAppletError("Exec_PrAcc: %s, and later accesses were completed "
+                                         "out of order" % deviation)
+            await self._exec_pracc_steps(areas, max_steps, suspend_state, fastdata,
+                                         first_step=step + index)
+            return
+
+        else:
+            raise GlasgowAppletError("Exec_PrAcc: step limit exceeded")
 
     async def _exec_pracc(self, code, *args, **kwargs):
         code = [
@@ -540,13 +930,7 @@ class EJTAGInterface(aobject, GDBRemote):
         self._log("PrAcc: write [%#.*x] = %#.*x", self._prec, address, self._prec, value)
         await self._pracc_copy_word(address, value, is_read=False)
 
-    async def _pracc_copy_memory(self, address, length, data, is_read):
-        assert length <= 0x200
-
-        # This really isn't efficient at all, but unaligned accesses to dmseg are currently
-        # not handled correctly, and endianness is a nightmare. This should instead use
-        # word-size transfers, and ideally also the FASTDATA channel, but the implementation
-        # below works as a proof of concept.
+    async def _pracc_copy_words(self, address, count, words, is_read):
         Rdata, Rdst, Rsrc, Rlen, Racc, *_ = range(1, 32)
         return await self._exec_pracc(code=[
             SW   (Rdst, self._ws * -1, Rdata),
@@ -557,12 +941,12 @@ class EJTAGInterface(aobject, GDBRemote):
             ORI  (Racc, Racc, address),
             OR   (Rdst, 0, Rdata if is_read else Racc),
             OR   (Rsrc, 0, Racc  if is_read else Rdata),
-            ORI  (Rlen, 0, length),
-            LBU  (Racc, 0, Rsrc) if is_read else LW   (Racc, 0, Rsrc),
-            ADDI (Rsrc, Rsrc,  1 if is_read else 4),
-            SW   (Racc, 0, Rdst) if is_read else SB   (Racc, 0, Rdst),
-            ADDI (Rdst, Rdst,  4 if is_read else 1),
-            ADDI (Rlen, Rlen, -1),
+            ORI  (Rlen, 0, count),
+            LW   (Racc, 0, Rsrc),
+            ADDIU(Rsrc, Rsrc,  4),
+            SW   (Racc, 0, Rdst),
+            ADDIU(Rdst, Rdst,  4),
+            ADDIU(Rlen, Rlen, -1),
             BGTZ (Rlen, -6),
             NOP  (),
             LW   (Racc, self._ws * -4, Rdata),
@@ -570,14 +954,104 @@ class EJTAGInterface(aobject, GDBRemote):
             LW   (Rsrc, self._ws * -2, Rdata),
             LW   (Rdst, self._ws * -1, Rdata),
             NOP  (),
-        ], data=data)
+        ], data=words, max_steps=64 + count * 8)
+
+    def _fastdata_handler(self, is_read):
+        # The handler runs from the work area, and copies words between memory and
+        # the FASTDATA area. It receives the start and end addresses through the FASTDATA area
+        # as well, and returns to the dmseg code that invoked it.
+        Rdata, Raddr, Rend, Racc, Rfast, *_ = range(1, 32)
+        return [
+            LUI  (Rfast, DMSEG_addr >> 16),
+            LW   (Raddr, 0, Rfast),
+            LW   (Rend,  0, Rfast),
+            LW   (Racc,  0, Raddr if is_read else Rfast),
+            SW   (Racc,  0, Rfast if is_read else Raddr),
+            BNE  (Raddr, Rend, -3),
+            ADDIU(Raddr, Raddr, 4),
+            LUI  (Racc, DMSEG_addr >> 16),
+            ORI  (Racc, Racc, 0x0220),
+            JR   (Racc),
+            NOP  (),
+        ]
 
-    async def _pracc_read_memory(self, address, length):
-        data = await self._pracc_copy_memory(address, length, data=[0] * length, is_read=True)
-        return bytes(data)
+    async def _fastdata_copy_words(self, address, count, words, is_read):
+        handler = self._fastdata_handler(is_read)
+        await self._pracc_copy_words(self._work_area, len(handler), handler, is_read=False)
+        for offset in range(0, len(handler) * 4, 16):
+            await self._pracc_sync_icache(self._work_area + offset)
 
-    async def _pracc_write_memory(self, address, data):
-        await self._pracc_copy_memory(address, len(data), [*data], is_read=False)
+        result = []
+        async def fastdata():
+            addresses = [address & 0xffffffff, (address + (count - 1) * 4) & 0xffffffff]
+            result.extend((await self._exchange_fastdata(addresses + words))[2:])
+
+        Rdata, Raddr, Rend, Racc, Rfast, *_ = range(1, 32)
+        await self._exec_pracc(code=[
+            SW   (Raddr, self._ws * -1, Rdata),
+            SW   (Rend,  self._ws * -2, Rdata),
+            SW   (Racc,  self._ws * -3, Rdata),
+            SW   (Rfast, self._ws * -4, Rdata),
+            LUI  (Racc, self._work_area >> 16),
+            ORI  (Racc, Racc, self._work_area),
+            JR   (Racc),
+            NOP  (),
+            # The handler returns here, at dmseg offset 0x220.
+            LW   (Rfast, self._ws * -4, Rdata),
+            LW   (Racc,  self._ws * -3, Rdata),
+            LW   (Rend,  self._ws * -2, Rdata),
+            LW   (Raddr, self._ws * -1, Rdata),
+            NOP  (),
+        ], fastdata=fastdata)
+        return result
+
+    async def _copy_words(self, address, count, words, is_read):
+        if count == 1 and is_read:
+            return [await self._pracc_read_word(address)]
+        elif count == 1:
+            await self._pracc_write_word(address, words[0])
+            return words
+        elif self._work_area is not None and count >= _FASTDATA_MIN_WORDS:
+            self._log("FASTDATA: %s address=%#0.*x count=%d",
+                      "read" if is_read else "write", self._prec, address, count)
+            return await self._fastdata_copy_words(address, count, words, is_read)
+        else:
+            self._log("PrAcc: %s address=%#0.*x count=%d",
+                      "read" if is_read else "write", self._prec, address, count)
+            return await self._pracc_copy_words(address, count, words, is_read)
+
+    def _word_format(self, count):
+        return "{}{}L".format(">" if self._cp0_config.BE else "<", count)
+
+    async def _read_memory(self, address, length):
+        # Only whole aligned words are read; the bytes outside of the requested range
+        # are discarded.
+        aligned_beg = address & ~3
+        aligned_end = (address + length + 3) & ~3
+        data = bytearray()
+        for chunk_beg in range(aligned_beg, aligned_end, _COPY_CHUNK_WORDS * 4):
+            count = min(_COPY_CHUNK_WORDS, (aligned_end - chunk_beg) // 4)
+            words = await self._copy_words(chunk_beg, count, [0] * count, is_read=True)
+            data += struct.pack(self._word_format(count), *words)
+        return bytes(data[address - aligned_beg:address - aligned_beg + length])
+
+    async def _write_memory(self, address, data):
+        # Only whole aligned words are written; the partial words at the start and the end
+        # of the requested range are read first, and merged with the new data.
+        aligned_beg = address & ~3
+        aligned_end = (address + len(data) + 3) & ~3
+        aligned_data = bytearray(aligned_end - aligned_beg)
+        if address != aligned_beg:
+            aligned_data[:4]  = await self._read_memory(aligned_beg, 4)
+        if address + len(data) != aligned_end:
+            aligned_data[-4:] = await self._read_memory(aligned_end - 4, 4)
+        aligned_data[address - aligned_beg:address - aligned_beg + len(data)] = data
+        for chunk_beg in range(aligned_beg, aligned_end, _COPY_CHUNK_WORDS * 4):
+            count = min(_COPY_CHUNK_WORDS, (aligned_end - chunk_beg) // 4)
+            chunk_off = chunk_beg - aligned_beg
+            words = struct.unpack(self._word_format(count),
+                                  aligned_data[chunk_off:chunk_off + count * 4])
+            await self._copy_words(chunk_beg, count, [*words], is_read=False)
 
     # PrAcc cache operations
 
@@ -660,6 +1134,10 @@ class EJTAGInterface(aobject, GDBRemote):
     def target_running(self):
         return self._state == "Running"
 
+    def target_memory_map(self):
+        if self._ram:
+            return [("ram", address, length, None) for address, length in self._ram]
+
     def target_attached(self):
         return not self.target_running() or any(self._instr_brkpts) or self._softw_brkpts
 
@@ -774,17 +1252,11 @@ class EJTAGInterface(aobject, GDBRemote):
 
     async def target_read_memory(self, address, length):
         self._check_state("read memory", "Stopped")
-        if address % self._ws == 0 and length == self._ws:
-            return struct.pack("<L", await self._pracc_read_word(address))
-        else:
-            return await self._pracc_read_memory(address, length)
+        return await self._read_memory(address, length)
 
     async def target_write_memory(self, address, data):
         self._check_state("write memory", "Stopped")
-        if address % self._ws == 0 and len(data) == self._ws:
-            await self._pracc_write_word(address, *struct.unpack("<L", data))
-        else:
-            await self._pracc_write_memory(address, data)
+        await self._write_memory(address, data)
 
 
 class JTAGMIPSApplet(JTAGApplet, name="jtag-mips"):
@@ -802,6 +1274,17 @@ class JTAGMIPSApplet(JTAGApplet, name="jtag-mips"):
         * Hardware and software breakpoints.
         * Register and memory reads and writes.
 
+    Memory is transferred word by word via PrAcc, which takes many JTAG transactions per word.
+    If the address of 64 bytes of otherwise unused target RAM is provided with --work-area,
+    a handler is placed there and memory is transferred via the FASTDATA channel instead, which
+    takes a single JTAG transaction per word and is much faster. The work area should be in
+    an uncached segment, e.g. KSEG1.
+
+    While the target is stopped, the GDB server caches register values, and, if the regions of
+    target RAM are provided with --ram, their contents. The regions are also reported to
+    the debugger as the memory map, after which it does not access memory outside of them unless
+    `set mem inaccessible-by-default off` is used.
+
     Notable omissions include:
 
         * Floating point.
@@ -820,6 +1303,13 @@ class JTAGMIPSApplet(JTAGApplet, name="jtag-mips"):
         parser.add_argument(
             "--tap-index", metavar="INDEX", type=int, default=0,
             help="select TAP #INDEX for communication (default: %(default)s)")
+        parser.add_argument(
+            "--work-area", metavar="ADDRESS", type=lambda arg: int(arg, 0), default=None,
+            help="use 64 bytes of RAM at ADDRESS for FASTDATA transfers (default: none)")
+        parser.add_argument(
+            "--ram", metavar="ADDRESS,LENGTH", type=_parse_region, action="append", default=[],
+            help="report LENGTH bytes at ADDRESS as RAM to the debugger; may be repeated "
+                 "(default: none)")
 
     async def run(self, device, args):
         jtag_iface = await super().run(device, args)
@@ -829,7 +1319,8 @@ class JTAGMIPSApplet(JTAGApplet, name="jtag-mips"):
         if not tap_iface:
             raise GlasgowAppletError("cannot select TAP #%d" % args.tap_index)
 
-        return await EJTAGInterface(tap_iface, self.logger)
+        return await EJTAGInterface(tap_iface, self.logger, work_area=args.work_area,
+                                    ram=args.ram)
 
     @classmethod
     def add_interact_arguments(cls, parser):
@@ -838,11 +1329,27 @@ class JTAGMIPSApplet(JTAGApplet, name="jtag-mips"):
         p_dump_state = p_operation.add_parser(
             "dump-state", help="dump CPU state")
 
+        p_dump_memory = p_operation.add_parser(
+            "dump-memory", help="dump a range of memory to a file")
+        p_dump_memory.add_argument(
+            "address", metavar="ADDRESS", type=lambda arg: int(arg, 0),
+            help="dump memory starting at ADDRESS")
+        p_dump_memory.add_argument(
+            "length", metavar="LENGTH", type=lambda arg: int(arg, 0),
+            help="dump LENGTH bytes")
+        p_dump_memory.add_argument(
+            "file", metavar="FILE", type=argparse.FileType("wb"),
+            help="write memory contents to FILE")
+
         p_gdb = p_operation.add_parser(
             "gdb", help="start a GDB remote protocol server")
         p_gdb.add_argument(
             "-1", "--once", default=False, action="store_true",
             help="exit when the remote client disconnects")
+        p_gdb.add_argument(
+            "--cache-page-size", metavar="SIZE", type=int, default=64,
+            help="cache target RAM given with --ram in SIZE byte pages while it is stopped; "
+                 "0 disables the cache (default: %(default)s)")
         ServerEndpoint.add_argument(p_gdb, "gdb_endpoint", default="tcp::1234")
 
         p_repl = p_operation.add_parser(
@@ -858,10 +1365,24 @@ class JTAGMIPSApplet(JTAGApplet, name="jtag-mips"):
             for name, value in zip(reg_names, reg_values):
                 print("{:<3} = {:08x}".format(name, value))
 
+        if args.operation == "dump-memory":
+            await ejtag_iface.target_stop()
+            # Memory is written to the file as it is read, so that a partial dump is available
+            # even if it is interrupted.
+            address, end = args.address, args.address + args.length
+            while address < end:
+                chunk = await ejtag_iface.target_read_memory(
+                    address, min(end - address, _COPY_CHUNK_WORDS * 4))
+                args.file.write(chunk)
+                address += len(chunk)
+                self.logger.info("dumped %#x of %#x bytes", address - args.address, args.length)
+            args.file.close()
+            await ejtag_iface.target_detach()
+
         if args.operation == "gdb":
             endpoint = await ServerEndpoint("GDB socket", self.logger, args.gdb_endpoint)
             while not args.once:
-                await ejtag_iface.gdb_run(endpoint)
+                await ejtag_iface.gdb_run(endpoint, cache_page_size=args.cache_page_size)
 
                 # Unless we detach from the target here, we might not be able to re-enter
                 # the debug mode, because EJTAG TAP reset appears to irreversibly destroy
@@ -875,3 +1396,412 @@ class JTAGMIPSApplet(JTAGApplet, name="jtag-mips"):
             # Same as above.
             if ejtag_iface.target_attached():
                 await ejtag_iface.target_detach()
+
+# -------------------------------------------------------------------------------------------------
+
+import unittest
+
+from . import JTAGInterface, _MockJTAGChain
+from ...protocol.gdb_remote import _MockEndpoint
+
+
+class PrAccPredictorTestCase(unittest.TestCase):
+    code_beg = (DMSEG_addr + 0x0200) & 0xffffffff
+    temp_beg = (DMSEG_addr + 0x1000) & 0xffffffff
+    data_beg = (DMSEG_addr + 0x1200) & 0xffffffff
+
+    def fetch(self, index):
+        return (self.code_beg + index * 4, False)
+
+    def run_trace(self, code, data, trace):
+        # Predict accesses in the same way as EJTAGInterface._exec_pracc_pipelined, checking
+        # them against `trace`, the accesses the CPU actually makes; return the batch sizes.
+        code  = [*code, B(-len(code)-1), NOP(), NOP()]
+        areas = [
+            (self.code_beg, code,         False, "code"),
+            (self.temp_beg, [0] * 0x80,   True,  "temp"),
+            (self.data_beg, data,         True,  "data"),
+        ]
+        predictor = _PrAccPredictor(areas, 0xffffffff)
+        batches = []
+        index   = 0
+        while index < len(trace):
+            predictor.observe(*trace[index])
+            batch  = []
+            access = trace[index]
+            while access is not None:
+                address, is_write = access
+                if index + len(batch) > 0 and address == self.code_beg:
+                    break
+                for area_beg, area, _, _ in areas:
+                    if address in range(area_beg, area_beg + len(area) * 4):
+                        word = 0 if is_write else area[(address - area_beg) // 4]
+                batch.append(access)
+                predictor.complete(address, is_write, word)
+                access = predictor.next_access()
+            self.assertEqual(batch, trace[index:index + len(batch)])
+            batches.append(len(batch))
+            index += len(batch)
+        return batches
+
+    def test_read_register(self):
+        Rdata, Racc, *_ = range(1, 32)
+        code = [
+            SW   (Racc, -4, Rdata),
+            MFC0 (Racc, *CP0_Config_addr),
+            SW   (Racc, 0, Rdata),
+            LW   (Racc, -4, Rdata),
+            NOP  (),
+        ]
+        trace = [
+            self.fetch(0), (self.data_beg - 4, True),
+            self.fetch(1),
+            self.fetch(2), (self.data_beg, True),
+            self.fetch(3), (self.data_beg - 4, False),
+            self.fetch(4),
+            self.fetch(5),
+            self.fetch(6),
+        ]
+        # The address of the first store reveals Rdata; the load of a word that was just
+        # stored waits for its value, and nothing is predicted past the branch.
+        self.assertEqual(self.run_trace(code, [0], trace), [1, 5, 4])
+
+    def test_copy_loop(self):
+        Rdata, Rdst, Rsrc, Rlen, Racc, *_ = range(1, 32)
+        code = [
+            SW   (Rdst, -4,  Rdata),
+            SW   (Rsrc, -8,  Rdata),
+            SW   (Rlen, -12, Rdata),
+            SW   (Racc, -16, Rdata),
+            LUI  (Racc, 0x8000),
+            ORI  (Racc, Racc, 0x0000),
+            OR   (Rdst, 0, Rdata),
+            OR   (Rsrc, 0, Racc),
+            ORI  (Rlen, 0, 2),
+            LW   (Racc, 0, Rsrc),
+            ADDIU(Rsrc, Rsrc,  4),
+            SW   (Racc, 0, Rdst),
+            ADDIU(Rdst, Rdst,  4),
+            ADDIU(Rlen, Rlen, -1),
+            BGTZ (Rlen, -6),
+            NOP  (),
+            LW   (Racc, -16, Rdata),
+            LW   (Rlen, -12, Rdata),
+            LW   (Rsrc, -8,  Rdata),
+            LW   (Rdst, -4,  Rdata),
+            NOP  (),
+        ]
+        trace = []
+        for index in range(4):
+            trace += [self.fetch(index), (self.data_beg - 4 * (index + 1), True)]
+        trace += [self.fetch(index) for index in range(4, 9)]
+        for word in range(2):
+            # The load from target memory is not a PrAcc access.
+            trace += [self.fetch(9), self.fetch(10),
+                      self.fetch(11), (self.data_beg + word * 4, True),
+                      *[self.fetch(index) for index in range(12, 16)]]
+        for index in range(4):
+            trace += [self.fetch(16 + index), (self.data_beg - 16 + index * 4, False)]
+        trace += [self.fetch(index) for index in range(20, 23)]
+        # Loads from outside of dmseg and taken branches end a batch.
+        self.assertEqual(self.run_trace(code, [0, 0], trace), [1, 13, 7, 1, 18])
+
+    def test_deviation(self):
+        Rdata, Racc, *_ = range(1, 32)
+        code = [
+            SW   (Racc, -4, Rdata),
+            LW   (Racc, -4, Rdata),
+            NOP  (),
+        ]
+        areas = [
+            (self.code_beg, [*code, B(-4), NOP(), NOP()], False, "code"),
+            (self.temp_beg, [0] * 0x80,                   True,  "temp"),
+        ]
+        predictor = _PrAccPredictor(areas, 0xffffffff)
+        predictor.observe(*self.fetch(0))
+        predictor.complete(*self.fetch(0), code[0])
+        predictor.observe(self.data_beg - 4, True)
+        predictor.complete(self.data_beg - 4, True, 0)
+        self.assertEqual(predictor.next_access(), self.fetch(1))
+        # The CPU took an exception instead, and returned to the start of the code; nothing
+        # is known about Rdata anymore.
+        predictor.observe(*self.fetch(0))
+        predictor.complete(*self.fetch(0), code[0])
+        self.assertEqual(predictor.next_access(), None)
+
+
+class _MockEJTAGCPU:
+    """
+    A model of a MIPS32 CPU with an EJTAG 2.6 TAP, to be used with :class:`_MockJTAGChain`.
+    Only the instructions that EJTAGInterface uses are implemented, and caches, exceptions and
+    running outside of debug mode are not modelled. Memory outside of dmseg and drseg is
+    ``memory``, a dict of words, and ``memory_reads`` counts the loads from it.
+
+    Once ``slow_at`` PrAcc accesses have been completed, the CPU is slow to make the next one,
+    which does not become visible to the probe for ``slow_for`` captures of CONTROL.
+    """
+    ir_length = 5
+    idcode    = 0x00000001
+
+    def __init__(self, memory={}):
+        self.ir       = None
+        self.memory   = dict(memory)
+        self.memory_reads = 0
+        self.accesses = 0
+        self.slow_at  = None
+        self.slow_for = 0
+
+        self._debug   = False
+        self._pc      = 0x8000_1000
+        self._npc     = self._pc + 4
+        self._regs    = [0] * 32
+        self._hi      = 0
+        self._lo      = 0
+        self._cp0     = {
+            CP0_Config_addr:  CP0_Config(K0=2, MT=1, BE=1, M=1).to_int(),
+            CP0_Config1_addr: 0,
+            CP0_Debug_addr:   0,
+            CP0_DEPC_addr:    0,
+            CP0_DESAVE_addr:  0,
+        }
+        self._drseg   = {DRSEG_IBS_addr & 0xffffffff: DRSEG_IBS(BCN=2).to_int()}
+        self._control = DR_CONTROL()
+        self._data    = 0
+        self._pending = None
+        self._hidden  = 0
+        self._visible = False
+
+    def _bits(self, value, width=32):
+        return [(value >> bit) & 1 for bit in range(width)]
+
+    def _value(self, bits):
+        return sum(bit << index for index, bit in enumerate(bits))
+
+    def _ir_is(self, ir):
+        return self.ir is not None and self._bits(self.ir, self.ir_length) == ir.tolist()
+
+    # TAP
+
+    def capture_ir(self):
+        return [1] + [0] * (self.ir_length - 1)
+
+    def capture_dr(self):
+        if self.ir is None:
+            return self._bits(self.idcode)
+        elif self._ir_is(IR_IMPCODE):
+            return self._bits(DR_IMPCODE(EJTAGver=2, DINT_sup=1).to_int())
+        elif self._ir_is(IR_ADDRESS):
+            return self._bits(self._pending[0] if self._pending else 0)
+        elif self._ir_is(IR_DATA):
+            return self._bits(self._data)
+        elif self._ir_is(IR_CONTROL):
+            return self._capture_control()
+        elif self._ir_is(IR_ALL):
+            return (self._bits(self._pending[0] if self._pending else 0) +
+                    self._bits(self._data) + self._capture_control())
+        else:
+            return [0]
+
+    def update_dr(self, bits):
+        if self._ir_is(IR_DATA):
+            self._data = self._value(bits)
+        elif self._ir_is(IR_CONTROL):
+            self._update_control(bits)
+        elif self._ir_is(IR_ALL):
+            self._data = self._value(bits[32:64])
+            self._update_control(bits[64:])
+
+    def _capture_control(self):
+        control = self._control.copy()
+        control.DM = self._debug
+        if self._pending and self._hidden:
+            self._hidden -= 1
+            self._visible = False
+        else:
+            self._visible = self._pending is not None
+        control.PrAcc = self._visible
+        control.PRnW  = self._visible and self._pending[1]
+        return self._bits(control.to_int())
+
+    def _update_control(self, bits):
+        control = DR_CONTROL.from_int(self._value(bits))
+        self._control.ProbEn   = control.ProbEn
+        self._control.ProbTrap = control.ProbTrap
+        if control.EjtagBrk and not self._debug:
+            self._debug = True
+            self._cp0[CP0_DEPC_addr] = self._pc
+            self._pc, self._npc = DMSEG_TRAP_addr & 0xffffffff, (DMSEG_TRAP_addr + 4) & 0xffffffff
+            self._run()
+        elif not control.PrAcc and self._visible:
+            _, _, complete = self._pending
+            self._pending = None
+            self._visible = False
+            self.accesses += 1
+            complete(self._data)
+            self._run()
+
+    # CPU
+
+    def _in_dmseg(self, address):
+        return address & 0xfff0_0000 == DMSEG_addr & 0xfff0_0000
+
+    def _in_drseg(self, address):
+        return address & 0xfff0_0000 == DRSEG_addr & 0xfff0_0000
+
+    def _access(self, address, is_write, complete):
+        self._pending = (address, is_write, complete)
+        if self.accesses == self.slow_at:
+            self._hidden = self.slow_for
+
+    def _set(self, reg, value):
+        if reg != 0:
+            self._regs[reg] = value & 0xffffffff
+
+    def _run(self):
+        while self._debug and self._pending is None:
+            if self._in_dmseg(self._pc):
+                self._access(self._pc, False, self._execute)
+            else:
+                self._execute(self.memory.get(self._pc, 0))
+
+    def _execute(self, instr):
+        op, rs, rt, rd, fn = \
+            instr >> 26, (instr >> 21) & 0x1f, (instr >> 16) & 0x1f, (instr >> 11) & 0x1f, instr & 0x3f
+        imm  = instr & 0xffff
+        simm = imm - 0x10000 if imm & 0x8000 else imm
+        pc, self._pc, self._npc = self._pc, self._npc, (self._npc + 4) & 0xffffffff
+        target  = (pc + 4 + (simm << 2)) & 0xffffffff
+        address = (self._regs[rs] + simm) & 0xffffffff
+        if op == 0x00 and fn == 0x00:                   # SLL
+            self._set(rd, self._regs[rt] << ((instr >> 6) & 0x1f))
+        elif op == 0x00 and fn == 0x08:                 # JR
+            self._npc = self._regs[rs]
+        elif op == 0x00 and fn == 0x0f:                 # SYNC
+            pass
+        elif op == 0x00 and fn in (0x10, 0x12):         # MFHI, MFLO
+            self._set(rd, self._hi if fn == 0x10 else self._lo)
+        elif op == 0x00 and fn in (0x11, 0x13):         # MTHI, MTLO
+            pass
+        elif op == 0x00 and fn == 0x25:                 # OR
+            self._set(rd, self._regs[rs] | self._regs[rt])
+        elif op == 0x04:                                # BEQ
+            if self._regs[rs] == self._regs[rt]: self._npc = target
+        elif op == 0x05:                                # BNE
+            if self._regs[rs] != self._regs[rt]: self._npc = target
+        elif op == 0x07:                                # BGTZ
+            if 0 < self._regs[rs] < 0x8000_0000: self._npc = target
+        elif op == 0x09:                                # ADDIU
+            self._set(rt, self._regs[rs] + simm)
+        elif op == 0x0d:                                # ORI
+            self._set(rt, self._regs[rs] | imm)
+        elif op == 0x0e:                                # XORI
+            self._set(rt, self._regs[rs] ^ imm)
+        elif op == 0x0f:                                # LUI
+            self._set(rt, imm << 16)
+        elif op == 0x10 and rs == 0x00:                 # MFC0
+            self._set(rt, self._cp0[rd, fn & 0b111])
+        elif op == 0x10 and rs == 0x04:                 # MTC0
+            self._cp0[rd, fn & 0b111] = self._regs[rt]
+        elif op == 0x10 and rs == 0x10 and fn == 0x1f:  # DERET
+            self._debug = False
+            self._pc, self._npc = self._cp0[CP0_DEPC_addr], self._cp0[CP0_DEPC_addr] + 4
+        elif op == 0x23 and self._in_dmseg(address):    # LW
+            self._access(address, False, lambda word: self._set(rt, word))
+        elif op == 0x23 and self._in_drseg(address):
+            self._set(rt, self._drseg.get(address, 0))
+        elif op == 0x23:
+            self.memory_reads += 1
+            self._set(rt, self.memory.get(address, 0))
+        elif op == 0x2b and self._in_dmseg(address):    # SW
+            self._data = self._regs[rt]
+            self._access(address, True, lambda word: None)
+        elif op == 0x2b and self._in_drseg(address):
+            self._drseg[address] = self._regs[rt]
+        elif op == 0x2b:
+            self.memory[address] = self._regs[rt]
+        else:
+            raise NotImplementedError("instruction %#010x at %#010x" % (instr, pc))
+
+
+class EJTAGInterfaceTestCase(unittest.TestCase):
+    def run_ejtag(self, cpu, case, **kwargs):
+        async def run():
+            jtag_iface = JTAGInterface(_MockJTAGChain([cpu]), logging.getLogger(__name__),
+                                       sys_clk_freq=30e6, addr_half_cyc=(0, 1))
+            tap_iface  = await jtag_iface.select_tap(0)
+            ejtag_iface = await EJTAGInterface(tap_iface, logging.getLogger(__name__), **kwargs)
+            await ejtag_iface.target_stop()
+            await case(ejtag_iface)
+        asyncio.get_event_loop().run_until_complete(run())
+
+    def test_read_memory(self):
+        cpu = _MockEJTAGCPU(memory={0x8000_0000 + offset: 0x1000 + offset
+                                    for offset in range(0, 0x40, 4)})
+        async def case(ejtag_iface):
+            self.assertTrue(ejtag_iface._pracc_pipelined)
+            self.assertEqual(await ejtag_iface.target_read_memory(0x8000_0004, 8),
+                             bytes.fromhex("00001004 00001008"))
+            self.assertEqual(await ejtag_iface.target_read_memory(0x8000_0020, 4),
+                             bytes.fromhex("00001020"))
+            self.assertTrue(ejtag_iface._pracc_pipelined)
+        self.run_ejtag(cpu, case)
+
+    def test_slow_cpu(self):
+        # The CPU is slow to fetch the LUI instruction of _pracc_copy_word, which is in the middle
+        # of a batch, and makes no access for the rest of the batch, nor on the first poll after.
+        cpu = _MockEJTAGCPU(memory={0x8000_0000: 0x12345678})
+        async def case(ejtag_iface):
+            cpu.slow_at, cpu.slow_for = cpu.accesses + 4, 5
+            self.assertEqual(await ejtag_iface.target_read_memory(0x8000_0000, 4),
+                             bytes.fromhex("12345678"))
+            self.assertFalse(ejtag_iface._pracc_pipelined)
+            self.assertEqual(await ejtag_iface.target_read_memory(0x8000_0000, 4),
+                             bytes.fromhex("12345678"))
+        with self.assertLogs(__name__, logging.WARNING) as logs:
+            self.run_ejtag(cpu, case)
+        self.assertIn("CPU made none", logs.output[0])
+
+    def test_deviating_cpu(self):
+        # The CPU is slow to fetch the LUI instruction as above, but makes the access in time for
+        # the next scan, which completes it with the wrong instruction.
+        cpu = _MockEJTAGCPU(memory={0x8000_0000: 0x12345678})
+        async def case(ejtag_iface):
+            cpu.slow_at, cpu.slow_for = cpu.accesses + 4, 1
+            with self.assertRaisesRegex(GlasgowAppletError, r"CPU made none, and later"):
+                await ejtag_iface.target_read_memory(0x8000_0000, 4)
+            self.assertFalse(ejtag_iface._pracc_pipelined)
+        with self.assertLogs(__name__, logging.WARNING):
+            self.run_ejtag(cpu, case)
+
+    def test_gdb_memory_cache(self):
+        memory = {
+            **{0x8000_0000 + offset: 0x1000 + offset for offset in range(0, 0x40, 4)},
+            0xa000_0000: 0x55aa55aa,
+        }
+        commands = [b"m80000004,4", b"m80000008,4", b"ma0000000,4", b"ma0000000,4"]
+        responses = [b"00001004", b"00001008", b"55aa55aa", b"55aa55aa"]
+
+        async def case(ejtag_iface):
+            endpoint = _MockEndpoint(commands)
+            memory_reads = cpu.memory_reads
+            await ejtag_iface.gdb_run(endpoint)
+            self.assertEqual(endpoint.responses[1:], responses)
+            # One page of RAM, and then each word outside of it.
+            self.assertEqual(cpu.memory_reads - memory_reads, 16 + 2)
+        cpu = _MockEJTAGCPU(memory)
+        self.run_ejtag(cpu, case, ram=[(0x8000_0000, 0x1000)])
+
+        async def case(ejtag_iface):
+            self.assertIsNone(ejtag_iface.target_memory_map())
+            endpoint = _MockEndpoint(commands)
+            memory_reads = cpu.memory_reads
+            await ejtag_iface.gdb_run(endpoint)
+            self.assertEqual(endpoint.responses[1:], responses)
+            self.assertEqual(cpu.memory_reads - memory_reads, 4)
+        cpu = _MockEJTAGCPU(memory)
+        self.run_ejtag(cpu, case)
+
+    def test_parse_region(self):
+        self.assertEqual(_parse_region("0x80000000,4096"), (0x8000_0000, 0x1000))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            _parse_region("0x80000000")
@@ -1,12 +1,24 @@
+import os
+import math
+import mmap
 import struct
+import hashlib
 import logging
 import argparse
 from bitarray import bitarray
 
-from . import JTAGApplet
+from . import JTAGApplet, JTAGDeferred, _half_cyc, _default_cache_dir
 from .. import *
 from ...arch.jtag import *
 from ...protocol.jtag_svf import *
+from ...target.hardware import GlasgowHardwareTarget
+
+
+# TDO data of SIR and SDR commands is checked once this many bits of it are pending. Until then,
+# commands are sent to the device without waiting for it. This is also the most TDO data that
+# is buffered in the device when it is not being read, so TDO checks of longer commands use
+# a streaming shift instead.
+_MAX_PENDING_TDO_BITS = 4096
 
 
 class SVFOperation:
@@ -38,39 +50,114 @@ class JTAGSVFInterface(SVFEventHandler):
         self.lower   = interface
         self._logger = logger
         self._level  = logging.DEBUG if self._logger.name == __name__ else logging.TRACE
-        self._frequency = frequency
+        self._frequency     = frequency
+        self._tck_frequency = frequency
 
         self._endir  = "IDLE"
         self._enddr  = "IDLE"
 
-        self._hir    = SVFOperation(bitarray(), bitarray(), None, bitarray())
-        self._tir    = SVFOperation(bitarray(), bitarray(), None, bitarray())
-        self._hdr    = SVFOperation(bitarray(), bitarray(), None, bitarray())
-        self._tdr    = SVFOperation(bitarray(), bitarray(), None, bitarray())
+        empty        = bitarray(endian="little")
+        self._hir    = SVFOperation(empty, empty, None, empty)
+        self._tir    = SVFOperation(empty, empty, None, empty)
+        self._hdr    = SVFOperation(empty, empty, None, empty)
+        self._tdr    = SVFOperation(empty, empty, None, empty)
+
+        # The line of the command being executed, used when reporting failed TDO checks.
+        self.line    = None
+        self._pending_checks = []
+        self._pending_bits   = 0
+
+    @property
+    def frequency(self):
+        """
+        The highest TCK frequency, in Hz, that SVF files are played at.
+        """
+        return self._frequency
 
     def _log(self, message, *args):
         self._logger.log(self._level, "SVF: " + message, *args)
 
-    async def _enter_state(self, state, path=[]):
-        if path:
-            raise GlasgowAppletError("explicitly providing TAP state path is not supported")
-
-        if state == "RESET":
-            await self.lower.enter_test_logic_reset(force=False)
-        elif state == "IDLE":
-            await self.lower.enter_run_test_idle()
-        elif state == "IRPAUSE":
-            await self.lower.enter_pause_ir()
-        elif state == "DRPAUSE":
-            await self.lower.enter_pause_dr()
+    def _check_tdo(self, line, command, op, tdo):
+        if isinstance(tdo, JTAGDeferred):
+            tdo = tdo.result()
+        if tdo & op.mask != op.tdo & op.mask:
+            raise GlasgowAppletError("%s command%s failed: TDO <%s> & <%s> != <%s>"
+                                     % (command, "" if line is None else " at line %d" % line,
+                                        tdo.to01(), op.mask.to01(), op.tdo.to01()))
+
+    async def flush(self):
+        """
+        Wait until every command has been executed, and check TDO data of every SIR and SDR
+        command.
+        """
+        await self.lower.commit()
+        pending_checks, self._pending_checks = self._pending_checks, []
+        self._pending_bits = 0
+        for check in pending_checks:
+            self._check_tdo(*check)
+
+    async def _shift(self, command, shift_state, op, end_state):
+        await self.lower.enter_state(shift_state)
+        if op.tdo is None:
+            await self.lower.shift_tdi(op.tdi)
+        elif len(op.tdi) > _MAX_PENDING_TDO_BITS:
+            tdo = bitarray(endian="little")
+            async for tdo_chunk in self.lower.shift_tdio_stream(op.tdi):
+                tdo += tdo_chunk
+            self._check_tdo(self.line, command, op, tdo)
         else:
-            assert False
+            tdo = await self.lower.shift_tdio(op.tdi)
+            self._pending_checks.append((self.line, command, op, tdo))
+            self._pending_bits += len(op.tdi)
+        await self._enter_state(end_state)
+
+        if self._pending_bits >= _MAX_PENDING_TDO_BITS:
+            await self.flush()
+
+    async def _enter_state(self, state, path=[]):
+        try:
+            await self.lower.enter_state(state, path)
+        except ValueError as e:
+            raise GlasgowAppletError("invalid TAP state path: {}".format(e))
+
+    async def _set_frequency(self, frequency):
+        return await self.lower.set_frequency(frequency)
+
+    async def _run_test(self, run_state, run_count, end_state):
+        await self._enter_state(run_state)
+        await self.lower.pulse_tck(run_count)
+        await self._enter_state(end_state)
+
+    async def play_program(self, program):
+        """
+        Execute an :class:`SVFProgram`.
+        """
+        if program.frequency != self._frequency:
+            raise GlasgowAppletError("SVF program was compiled for TCK frequency %.3f kHz, "
+                                     "not %.3f kHz"
+                                     % (program.frequency / 1e3, self._frequency / 1e3))
+        for op, *args in program:
+            if op == "state":
+                await self._enter_state(*args)
+            elif op == "shift":
+                command, shift_state, svf_op, end_state, self.line = args
+                await self._shift(command, shift_state, svf_op, end_state)
+            elif op == "runtest":
+                await self._run_test(*args)
+            elif op == "trst":
+                await self.svf_trst(*args)
+            elif op == "frequency":
+                self._tck_frequency = await self._set_frequency(*args)
+            else:
+                assert False
 
     async def svf_frequency(self, frequency):
-        if frequency is not None and frequency < self._frequency:
-            raise GlasgowAppletError("FREQUENCY command requires a lower frequency (%.3f kHz) "
-                                     "than the applet is configured for (%.3f kHz)"
-                                     % (frequency / 1e3, args.frequency / 1e3))
+        # The frequency the applet is configured for is used as the upper limit; FREQUENCY
+        # without an argument restores it.
+        if frequency is None or frequency > self._frequency:
+            frequency = self._frequency
+        self._tck_frequency = await self._set_frequency(frequency)
+        self._log("TCK frequency %.3f kHz", self._tck_frequency / 1e3)
 
     async def svf_trst(self, mode):
         if mode == "ABSENT":
@@ -107,40 +194,23 @@ class JTAGSVFInterface(SVFEventHandler):
 
     async def svf_sir(self, tdi, smask, tdo, mask):
         op = self._hir + SVFOperation(tdi, smask, tdo, mask) + self._tir
-        await self.lower.enter_shift_ir()
-        if op.tdo is None:
-            await self.lower.shift_tdi(op.tdi)
-        else:
-            tdo = await self.lower.shift_tdio(op.tdi)
-            if tdo & op.mask != op.tdo & op.mask:
-                raise GlasgowAppletError("SIR command failed: TDO <%s> & <%s> != <%s>"
-                                         % (tdo.to01(), op.mask.to01(), op.tdo.to01()))
-        await self._enter_state(self._endir)
+        await self._shift("SIR", "IRSHIFT", op, self._endir)
 
     async def svf_sdr(self, tdi, smask, tdo, mask):
         op = self._hdr + SVFOperation(tdi, smask, tdo, mask) + self._tdr
-        await self.lower.enter_shift_dr()
-        if op.tdo is None:
-            await self.lower.shift_tdi(op.tdi)
-        else:
-            tdo = await self.lower.shift_tdio(op.tdi)
-            if tdo & op.mask != op.tdo & op.mask:
-                raise GlasgowAppletError("SDR command failed: TDO <%s> & <%s> != <%s>"
-                                         % (tdo.to01(), op.mask.to01(), op.tdo.to01()))
-        await self._enter_state(self._enddr)
+        await self._shift("SDR", "DRSHIFT", op, self._enddr)
 
     async def svf_runtest(self, run_state, run_count, run_clock, min_time, max_time, end_state):
         if run_clock != "TCK":
-            raise GlasgowAppletError("RUNTEST clock %s is not supported" % run_count)
-        if run_count is None or min_time is not None and run_count / self._frequency < min_time:
-            run_count = self._frequency * min_time
-        if max_time is not None and run_count / self._frequency > max_time:
+            raise GlasgowAppletError("RUNTEST clock %s is not supported" % run_clock)
+        frequency = self._tck_frequency
+        if run_count is None or min_time is not None and run_count / frequency < min_time:
+            run_count = math.ceil(frequency * min_time)
+        if max_time is not None and run_count / frequency > max_time:
             self._logger.warning("RUNTEST exceeds maximum time: %d cycles (%.3f s) > %.3f s"
-                                 % (run_count, run_count / self._frequency, max_time))
+                                 % (run_count, run_count / frequency, max_time))
 
-        await self._enter_state(run_state)
-        await self.lower.pulse_tck(run_count)
-        await self._enter_state(end_state)
+        await self._run_test(run_state, run_count, end_state)
 
     async def svf_piomap(self, mapping):
         raise GlasgowAppletError("the PIOMAP command is not supported")
@@ -149,15 +219,181 @@ class JTAGSVFInterface(SVFEventHandler):
         raise GlasgowAppletError("the PIO command is not supported")
 
 
+# A compiled SVF program starts with a header, followed by a sequence of operations, each
+# starting with an opcode byte. All values are little-endian; scan data is stored in the same
+# format as it is sent to the device.
+_PROGRAM_MAGIC   = b"GLASGOW-SVF\0"
+_PROGRAM_VERSION = 1
+_PROGRAM_HEADER  = struct.Struct("<12sHd")   # magic, version, TCK frequency
+_PROGRAM_STATE   = struct.Struct("<BB")      # opcode, path length, then state for each
+_PROGRAM_SHIFT   = struct.Struct("<BBBBLL")  # opcode, IR/DR, end state, TDO?, length, line
+_PROGRAM_RUNTEST = struct.Struct("<BBBQ")    # opcode, run state, end state, TCK cycles
+_PROGRAM_TRST    = struct.Struct("<BB")      # opcode, mode
+_PROGRAM_FREQ    = struct.Struct("<Bd")      # opcode, TCK frequency
+
+OP_STATE, OP_SHIFT, OP_RUNTEST, OP_TRST, OP_FREQUENCY = range(1, 6)
+
+_program_states     = tuple(TAP_STATES)
+_program_trst_modes = ("ABSENT", "Z", "ON", "OFF")
+
+
+class SVFProgramCompiler(JTAGSVFInterface):
+    """
+    An SVF event handler that writes the JTAG operations it would perform to ``file`` as
+    an :class:`SVFProgram`, instead of performing them. The program only depends on the TCK
+    frequency the applet is configured for, ``frequency`` Hz, and the system clock frequency of
+    the device, ``sys_clk_freq`` Hz.
+    """
+    def __init__(self, file, logger, frequency, sys_clk_freq):
+        self._sys_clk_freq = sys_clk_freq
+        frequency = self._actual_frequency(frequency)
+        super().__init__(None, logger, frequency)
+        self._file = file
+        self._file.write(_PROGRAM_HEADER.pack(_PROGRAM_MAGIC, _PROGRAM_VERSION, frequency))
+
+    def _actual_frequency(self, frequency):
+        return self._sys_clk_freq / (2 * _half_cyc(self._sys_clk_freq, frequency))
+
+    async def flush(self):
+        pass
+
+    async def _enter_state(self, state, path=[]):
+        states = list(path) + [state]
+        self._file.write(_PROGRAM_STATE.pack(OP_STATE, len(states)))
+        self._file.write(bytes(_program_states.index(state) for state in states))
+
+    async def _shift(self, command, shift_state, op, end_state):
+        self._file.write(_PROGRAM_SHIFT.pack(OP_SHIFT, shift_state == "DRSHIFT",
+            _program_states.index(end_state), op.tdo is not None, len(op.tdi), self.line or 0))
+        self._file.write(op.tdi.tobytes())
+        if op.tdo is not None:
+            self._file.write(op.tdo.tobytes())
+            self._file.write(op.mask.tobytes())
+
+    async def _run_test(self, run_state, run_count, end_state):
+        self._file.write(_PROGRAM_RUNTEST.pack(OP_RUNTEST,
+            _program_states.index(run_state), _program_states.index(end_state), run_count))
+
+    async def svf_trst(self, mode):
+        self._file.write(_PROGRAM_TRST.pack(OP_TRST, _program_trst_modes.index(mode)))
+
+    async def _set_frequency(self, frequency):
+        self._file.write(_PROGRAM_FREQ.pack(OP_FREQUENCY, frequency))
+        return self._actual_frequency(frequency)
+
+
+class SVFProgram:
+    """
+    A compiled SVF program, read from ``buffer``, e.g. an ``mmap`` of a file written by
+    :class:`SVFProgramCompiler`. Iterating it yields the operations it consists of.
+    """
+    def __init__(self, buffer):
+        if len(buffer) < _PROGRAM_HEADER.size:
+            raise GlasgowAppletError("not a compiled SVF program")
+        magic, version, self.frequency = _PROGRAM_HEADER.unpack_from(buffer, 0)
+        if magic != _PROGRAM_MAGIC:
+            raise GlasgowAppletError("not a compiled SVF program")
+        if version != _PROGRAM_VERSION:
+            raise GlasgowAppletError("compiled SVF program has unsupported version %d"
+                                     % version)
+        self._buffer = buffer
+
+    @staticmethod
+    def is_program(buffer):
+        return buffer[:len(_PROGRAM_MAGIC)] == _PROGRAM_MAGIC
+
+    def _bits(self, offset, length):
+        bits = bitarray(endian="little")
+        bits.frombytes(self._buffer[offset:offset + (length + 7) // 8])
+        del bits[length:]
+        return bits, offset + (length + 7) // 8
+
+    def __iter__(self):
+        offset = _PROGRAM_HEADER.size
+        while offset < len(self._buffer):
+            opcode = self._buffer[offset]
+            if opcode == OP_STATE:
+                _, count = _PROGRAM_STATE.unpack_from(self._buffer, offset)
+                offset += _PROGRAM_STATE.size
+                *path, state = (_program_states[index]
+                                for index in self._buffer[offset:offset + count])
+                offset += count
+                yield "state", state, path
+            elif opcode == OP_SHIFT:
+                _, is_dr, end_state, has_tdo, length, line = \
+                    _PROGRAM_SHIFT.unpack_from(self._buffer, offset)
+                offset += _PROGRAM_SHIFT.size
+                tdi, offset = self._bits(offset, length)
+                if has_tdo:
+                    tdo,  offset = self._bits(offset, length)
+                    mask, offset = self._bits(offset, length)
+                else:
+                    tdo,  mask   = None, None
+                yield ("shift", "SDR" if is_dr else "SIR", "DRSHIFT" if is_dr else "IRSHIFT",
+                       SVFOperation(tdi, None, tdo, mask), _program_states[end_state],
+                       line or None)
+            elif opcode == OP_RUNTEST:
+                _, run_state, end_state, run_count = \
+                    _PROGRAM_RUNTEST.unpack_from(self._buffer, offset)
+                offset += _PROGRAM_RUNTEST.size
+                yield ("runtest", _program_states[run_state], run_count,
+                       _program_states[end_state])
+            elif opcode == OP_TRST:
+                _, mode = _PROGRAM_TRST.unpack_from(self._buffer, offset)
+                offset += _PROGRAM_TRST.size
+                yield "trst", _program_trst_modes[mode]
+            elif opcode == OP_FREQUENCY:
+                _, frequency = _PROGRAM_FREQ.unpack_from(self._buffer, offset)
+                offset += _PROGRAM_FREQ.size
+                yield "frequency", frequency
+            else:
+                raise GlasgowAppletError("compiled SVF program is corrupted at offset %d"
+                                         % offset)
+
+
+def compile_svf(svf_data, file, logger, frequency, sys_clk_freq):
+    """
+    Compile SVF test vectors ``svf_data`` into an :class:`SVFProgram`, and write it to ``file``.
+    """
+    compiler = SVFProgramCompiler(file, logger, frequency, sys_clk_freq)
+    svf_parser = SVFParser(svf_data, compiler)
+    while True:
+        coro = svf_parser.parse_command()
+        if not coro: break
+        compiler.line = svf_parser.last_command_line()
+        try:
+            coro.send(None)
+        except StopIteration:
+            pass
+        else:
+            assert False, "SVF compilation must not block"
+
+
+def _map_file(file):
+    try:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        # Empty files and pipes cannot be mapped.
+        return file.read()
+
+
 class JTAGSVFApplet(JTAGApplet, name="jtag-svf"):
     logger = logging.getLogger(__name__)
     help = "play SVF test vectors via JTAG"
     description = """
     Play SVF test vectors via the JTAG interface.
 
+    Commands are sent to the device without waiting for it to execute them, and TDO data is
+    checked in bulk; when a check fails, the applet reports the line of the failed command and
+    terminates itself, but a few of the commands following it may have already been executed.
+
+    SVF files are compiled to a binary program of JTAG operations before they are played, and
+    the program is cached, so playing the same file again at the same frequency does not require
+    parsing it. Programs compiled in advance with `glasgow tool jtag-svf compile` can be played
+    in place of SVF files as well.
+
     This applet currently does not implement some SVF features:
         * PIOMAP and PIO are not supported;
-        * Explict state path may not be specified for STATE;
         * The SCK clock in RUNTEST is not supported.
 
     If any commands requiring these features are encountered, the applet terminates itself.
@@ -167,22 +403,196 @@ class JTAGSVFApplet(JTAGApplet, name="jtag-svf"):
         jtag_iface = await super().run(device, args)
         await jtag_iface.pulse_trst()
 
-        return JTAGSVFInterface(jtag_iface, self.logger, args.frequency * 1000)
+        return JTAGSVFInterface(jtag_iface, self.logger, jtag_iface.frequency)
 
     @classmethod
     def add_interact_arguments(cls, parser):
         parser.add_argument(
-            "svf_file", metavar="SVF-FILE", type=argparse.FileType("r"),
-            help="test vector to play")
+            "svf_file", metavar="SVF-FILE", type=argparse.FileType("rb"),
+            help="test vector or compiled SVF program to play")
+        parser.add_argument(
+            "--cache-dir", metavar="DIR", type=str, default=_default_cache_dir("jtag-svf"),
+            help="cache compiled SVF programs in DIR (default: %(default)s)")
+        parser.add_argument(
+            "--no-cache", dest="cache_dir", action="store_const", const=None,
+            help="do not compile SVF files before playing them")
+
+    def _cached_program(self, svf_data, cache_dir, frequency):
+        digest = hashlib.sha256(svf_data).hexdigest()
+        # Programs compiled by a different version of the compiler are never used, but kept,
+        # in case that version is used again.
+        path = os.path.join(cache_dir, "{}-{:.0f}-v{}.svfp".format(digest, frequency,
+                                                                  _PROGRAM_VERSION))
+        if not os.path.exists(path):
+            self.logger.info("compiling SVF file")
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                compile_svf(svf_data, f, self.logger, frequency,
+                            GlasgowHardwareTarget.sys_clk_freq)
+            os.replace(path + ".tmp", path)
+        else:
+            self.logger.info("using compiled SVF program %s", path)
+        with open(path, "rb") as f:
+            return SVFProgram(_map_file(f))
 
     async def interact(self, device, args, svf_iface):
-        svf_parser = SVFParser(args.svf_file.read(), svf_iface)
-        while True:
-            coro = svf_parser.parse_command()
-            if not coro: break
-
-            for line in svf_parser.last_command().split("\n"):
-                line = line.strip()
-                if line: svf_iface._log(line)
+        svf_data = _map_file(args.svf_file)
+        if SVFProgram.is_program(svf_data):
+            program = SVFProgram(svf_data)
+        elif args.cache_dir is not None:
+            program = self._cached_program(svf_data, args.cache_dir, svf_iface.frequency)
+        else:
+            program = None
+
+        if program is not None:
+            async with svf_iface.lower.batch():
+                await svf_iface.play_program(program)
+                await svf_iface.flush()
+            return
+
+        svf_parser = SVFParser(svf_data, svf_iface)
+        log_commands = svf_iface._logger.isEnabledFor(svf_iface._level)
+        async with svf_iface.lower.batch():
+            while True:
+                coro = svf_parser.parse_command()
+                if not coro: break
+
+                if log_commands:
+                    for line in svf_parser.last_command().split("\n"):
+                        line = line.strip()
+                        if line: svf_iface._log(line)
+                svf_iface.line = svf_parser.last_command_line()
+
+                await coro
+            await svf_iface.flush()
+
+# -------------------------------------------------------------------------------------------------
+
+class JTAGSVFAppletTool(GlasgowAppletTool, applet=JTAGSVFApplet):
+    help = "compile SVF test vectors"
+    description = """
+    Compile SVF test vectors to a binary program that `run jtag-svf` plays without parsing.
+    """
 
-            await coro
+    @classmethod
+    def add_arguments(cls, parser):
+        p_operation = parser.add_subparsers(dest="operation", metavar="OPERATION")
+
+        p_compile = p_operation.add_parser(
+            "compile", help="compile SVF test vectors")
+        p_compile.add_argument(
+            "-f", "--frequency", metavar="FREQ", type=int, default=100,
+            help="compile for TCK frequency FREQ kHz, which must match the frequency "
+                 "the program is played at (default: %(default)s)")
+        p_compile.add_argument(
+            "svf_file", metavar="SVF-FILE", type=argparse.FileType("rb"),
+            help="test vector to compile")
+        p_compile.add_argument(
+            "program_file", metavar="PROGRAM-FILE", type=argparse.FileType("wb"),
+            help="write compiled program to PROGRAM-FILE")
+
+    async def run(self, args):
+        if args.operation == "compile":
+            compile_svf(_map_file(args.svf_file), args.program_file, self.logger,
+                        args.frequency * 1e3, GlasgowHardwareTarget.sys_clk_freq)
+
+# -------------------------------------------------------------------------------------------------
+
+import io
+import asyncio
+import tempfile
+
+from . import JTAGInterface, _MockJTAGChain, _MockTAP
+
+
+class JTAGSVFAppletTestCase(GlasgowAppletTestCase, applet=JTAGSVFApplet):
+    @synthesis_test
+    def test_build(self):
+        self.assertBuilds()
+
+    def play_mock_svf(self, source, cache_dir=None):
+        if isinstance(source, str):
+            source = source.encode()
+        chain = _MockJTAGChain([_MockTAP(4, idcode=0x4ba00477)])
+        jtag_iface = JTAGInterface(chain, self.applet.logger,
+                                   sys_clk_freq=30e6, addr_half_cyc=(0, 1))
+        svf_iface = JTAGSVFInterface(jtag_iface, self.applet.logger, 1e6)
+        args = argparse.Namespace(svf_file=io.BytesIO(source), cache_dir=cache_dir)
+        asyncio.get_event_loop().run_until_complete(
+            self.applet.interact(None, args, svf_iface))
+        return chain
+
+    def compile_svf(self, source, frequency=1e6):
+        program = io.BytesIO()
+        compile_svf(source.encode(), program, self.applet.logger, frequency, 30e6)
+        return program.getvalue()
+
+    def test_play(self):
+        chain = self.play_mock_svf(
+            "STATE RESET;\n"
+            "! select BYPASS\n"
+            "SIR 4 TDI (f) TDO (1) MASK (3);\n"
+            "SDR 8 TDI (a5) TDO (4a);\n"
+            "SDR 8 TDI (ff)\n"
+            "    TDO (fe);\n"
+            "RUNTEST 10 TCK ENDSTATE DRPAUSE;\n")
+        self.assertEqual(chain._state, "DRPAUSE")
+        # All TDO data is checked at once.
+        self.assertEqual(chain.reads, 1)
+
+    def test_play_failure(self):
+        with self.assertRaisesRegex(GlasgowAppletError,
+                r"^SDR command at line 4 failed: TDO <00000000> & <11111111> != <11111111>"):
+            self.play_mock_svf(
+                "STATE RESET;\n"
+                "SIR 4 TDI (f);\n"
+                "SDR 8 TDI (a5) TDO (4a);\n"
+                "SDR 8 TDI (00) TDO (ff);\n"
+                "SDR 8 TDI (00) TDO (00);\n")
+
+    def test_play_program(self):
+        program = self.compile_svf(
+            "STATE RESET;\n"
+            "SIR 4 TDI (f) TDO (1) MASK (3);\n"
+            "SDR 8 TDI (ff) TDO (fe);\n"
+            "FREQUENCY 5E5 HZ;\n"
+            "RUNTEST 10 TCK ENDSTATE DRPAUSE;\n")
+        self.assertTrue(SVFProgram.is_program(program))
+        chain = self.play_mock_svf(program)
+        self.assertEqual(chain._state, "DRPAUSE")
+        self.assertEqual(chain.reads, 1)
+
+    def test_play_program_failure(self):
+        program = self.compile_svf(
+            "STATE RESET;\n"
+            "SIR 4 TDI (f);\n"
+            "SDR 8 TDI (00) TDO (ff);\n")
+        with self.assertRaisesRegex(GlasgowAppletError,
+                r"^SDR command at line 3 failed"):
+            self.play_mock_svf(program)
+
+    def test_play_program_frequency(self):
+        program = self.compile_svf("STATE RESET;\n", frequency=500e3)
+        with self.assertRaisesRegex(GlasgowAppletError,
+                r"^SVF program was compiled for TCK frequency 500\.000 kHz, not 1000\.000 kHz"):
+            self.play_mock_svf(program)
+
+    def test_play_cached(self):
+        source = "STATE RESET;\nSIR 4 TDI (f);\nSDR 8 TDI (ff) TDO (fe);\n"
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self.play_mock_svf(source, cache_dir)
+            cached, = os.listdir(cache_dir)
+            self.assertTrue(cached.endswith("-1000000-v{}.svfp".format(_PROGRAM_VERSION)))
+            with open(os.path.join(cache_dir, cached), "rb") as f:
+                self.assertEqual(f.read(), self.compile_svf(source))
+            mtime = os.stat(os.path.join(cache_dir, cached)).st_mtime_ns
+            chain = self.play_mock_svf(source, cache_dir)
+            self.assertEqual(os.stat(os.path.join(cache_dir, cached)).st_mtime_ns, mtime)
+            self.assertEqual(chain._state, "IDLE")
+
+            # A program compiled by another version of the compiler is not used.
+            stale = cached.replace("-v{}.".format(_PROGRAM_VERSION), "-v0.")
+            os.rename(os.path.join(cache_dir, cached), os.path.join(cache_dir, stale))
+            chain = self.play_mock_svf(source, cache_dir)
+            self.assertEqual(sorted(os.listdir(cache_dir)), sorted([cached, stale]))
+            self.assertEqual(chain._state, "IDLE")
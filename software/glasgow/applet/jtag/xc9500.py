@@ -212,6 +212,7 @@
 # by FPGM in a way that it is reused by FPGMI once FPGM DR is updated once with the strobe bit
 # set.
 
+import time
 import struct
 import logging
 import argparse
@@ -223,12 +224,17 @@ from .. import *
 from ...arch.jtag import *
 from ...arch.xilinx.xc9500 import *
 from ...database.xilinx.xc9500 import *
+from ...protocol.jesd3 import *
 
 
 BLOCK_FUSES = 432
 BLOCK_WORDS = 15
 GROUP_WORDS = 5
 
+# DR shifts for this many words are queued in a single JTAG batch, and their TDO data is read in
+# a single transfer; it has to fit in the device FIFOs.
+BATCH_WORDS = 4 * BLOCK_WORDS
+
 
 def jed_to_device_address(jed_address):
     block_num = jed_address // BLOCK_FUSES
@@ -247,6 +253,106 @@ def bitstream_to_device_address(word_address):
     return 32 * block_num + 8 * (block_off // GROUP_WORDS) + block_off % GROUP_WORDS
 
 
+# Each block starts with 9 4x8 L-fields, which map directly to 9 words, followed by 6 4x6 L-fields,
+# which map to 6 words with every 6-fuse group padded to 8 bits.
+_BLOCK_FUSES_4X8 = 9 * 32
+
+
+def jed_to_bitstream(fuse, device):
+    """
+    Convert JED fuse states ``fuse`` to a bitstream for ``device``, as a :class:`bitarray`
+    with the bits of consecutive words, LSB first.
+    """
+    blocks = device.bitstream_words // BLOCK_WORDS
+    assert len(fuse) == blocks * BLOCK_FUSES
+    # Pad the 4x6 L-fields of every block at once, with one strided copy per bit of a group.
+    fuse_4x6 = bitarray(endian="little")
+    for block in range(blocks):
+        fuse_4x6 += fuse[block * BLOCK_FUSES + _BLOCK_FUSES_4X8:(block + 1) * BLOCK_FUSES]
+    bits_4x6 = bitarray(len(fuse_4x6) // 6 * 8, endian="little")
+    bits_4x6.setall(0)
+    for bit in range(6):
+        bits_4x6[bit::8] = fuse_4x6[bit::6]
+
+    block_bits_4x6 = len(bits_4x6) // blocks
+    bits = bitarray(endian="little")
+    for block in range(blocks):
+        bits += fuse[block * BLOCK_FUSES:block * BLOCK_FUSES + _BLOCK_FUSES_4X8]
+        bits += bits_4x6[block * block_bits_4x6:(block + 1) * block_bits_4x6]
+    return bits
+
+
+def bitstream_to_jed(bits, device):
+    """
+    Convert a bitstream for ``device`` to JED fuse states. The inverse of
+    :func:`jed_to_bitstream`; bits that do not correspond to any fuse are discarded.
+    """
+    blocks = device.bitstream_words // BLOCK_WORDS
+    assert len(bits) == device.bitstream_words * 32
+    block_bits = BLOCK_WORDS * 32
+    bits_4x6 = bitarray(endian="little")
+    for block in range(blocks):
+        bits_4x6 += bits[block * block_bits + _BLOCK_FUSES_4X8:(block + 1) * block_bits]
+    fuse_4x6 = bitarray(len(bits_4x6) // 8 * 6, endian="little")
+    for bit in range(6):
+        fuse_4x6[bit::6] = bits_4x6[bit::8]
+
+    block_fuses_4x6 = BLOCK_FUSES - _BLOCK_FUSES_4X8
+    fuse = bitarray(endian="little")
+    for block in range(blocks):
+        fuse += bits[block * block_bits:block * block_bits + _BLOCK_FUSES_4X8]
+        fuse += fuse_4x6[block * block_fuses_4x6:(block + 1) * block_fuses_4x6]
+    return fuse
+
+
+def bitstream_to_words(bits):
+    return list(struct.unpack("<{}L".format(len(bits) // 32), bits.tobytes()))
+
+
+def words_to_bitstream(words):
+    bits = bitarray(endian="little")
+    bits.frombytes(struct.pack("<{}L".format(len(words)), *words))
+    return bits
+
+
+def load_bitstream(file, device):
+    """
+    Read a bitstream for ``device`` from ``file``, which is either a .bit file or a .jed file,
+    and return it as a list of words. A file is considered to be a .jed file if its name ends
+    with ``.jed``, or if it starts with STX.
+    """
+    data = file.read()
+    if getattr(file, "name", "").lower().endswith(".jed") or data.lstrip().startswith(b"\x02"):
+        try:
+            fuse = JESD3Parser(data).parse()
+        except JESD3ParsingError as e:
+            raise GlasgowAppletError("cannot parse .jed file: {}".format(e))
+        if len(fuse) != device.bitstream_words // BLOCK_WORDS * BLOCK_FUSES:
+            raise GlasgowAppletError("incorrect .jed file size (%d fuses) for device %s"
+                                     % (len(fuse), device.name))
+        return bitstream_to_words(jed_to_bitstream(fuse, device))
+
+    if len(data) != device.bitstream_words * 4:
+        raise GlasgowAppletError("incorrect .bit file size (%d words) for device %s"
+                                 % (len(data) // 4, device.name))
+    return list(struct.unpack("<{}L".format(device.bitstream_words), data))
+
+
+def save_jed(file, words, device):
+    """
+    Write bitstream ``words`` for ``device`` to ``file`` as a .jed file, with the same L-field
+    layout as Xilinx tools use.
+    """
+    emitter = JESD3Emitter(bitstream_to_jed(words_to_bitstream(words), device),
+                           notes=["DEVICE {}".format(device.name)])
+    for block in range(device.bitstream_words // BLOCK_WORDS):
+        for jed_address in range(0, _BLOCK_FUSES_4X8, 32):
+            emitter.add_list(block * BLOCK_FUSES + jed_address, [8] * 4)
+        for jed_address in range(_BLOCK_FUSES_4X8, BLOCK_FUSES, 24):
+            emitter.add_list(block * BLOCK_FUSES + jed_address, [6] * 4)
+    file.write(emitter.emit())
+
+
 class JTAGXC9500Interface:
     def __init__(self, interface, logger, frequency):
         self.lower   = interface
@@ -289,14 +395,20 @@ class JTAGXC9500Interface:
         await self.lower.write_dr(isconf.to_bitarray()[:50])
 
         words = []
-        for offset in range(count):
-            dev_address = bitstream_to_device_address(address + offset + 1)
-            isconf = DR_ISCONFIGURATION(valid=1, strobe=1, address=dev_address)
-            isconf_bits = await self.lower.exchange_dr(isconf.to_bitarray()[:50])
-            isconf = DR_ISCONFIGURATION.from_bitarray(isconf_bits)
-            self._log("read address=%03x prev-data=%s",
-                      dev_address, "{:032b}".format(isconf.data))
-            words.append(isconf.data)
+        for batch_offset in range(0, count, BATCH_WORDS):
+            results = []
+            async with self.lower.batch():
+                for offset in range(batch_offset, min(batch_offset + BATCH_WORDS, count)):
+                    dev_address = bitstream_to_device_address(address + offset + 1)
+                    isconf = DR_ISCONFIGURATION(valid=1, strobe=1, address=dev_address)
+                    isconf_bits = await self.lower.exchange_dr(isconf.to_bitarray()[:50])
+                    results.append((dev_address, isconf_bits))
+
+            for dev_address, isconf_bits in results:
+                isconf = DR_ISCONFIGURATION.from_bitarray(isconf_bits.result())
+                self._log("read address=%03x prev-data=%s",
+                          dev_address, "{:032b}".format(isconf.data))
+                words.append(isconf.data)
 
         return words
 
@@ -304,16 +416,21 @@ class JTAGXC9500Interface:
         await self.lower.write_ir(IR_FVFYI)
 
         words = []
-        index = 0
-        while index < count:
-            isdata_bits = await self.lower.read_dr(34)
-            isdata = DR_ISDATA.from_bitarray(isdata_bits)
-            if isdata.valid:
-                self._log("read autoinc data=%s", "{:032b}".format(isdata.data))
-                words.append(isdata.data)
-                index += 1
-            else:
-                self._log("read autoinc invalid")
+        while len(words) < count:
+            # Reads that return invalid data do not advance the address counter, so any words
+            # missing from a batch are read in the next one.
+            results = []
+            async with self.lower.batch():
+                for _ in range(min(count - len(words), BATCH_WORDS)):
+                    results.append(await self.lower.read_dr(34))
+
+            for isdata_bits in results:
+                isdata = DR_ISDATA.from_bitarray(isdata_bits.result())
+                if isdata.valid:
+                    self._log("read autoinc data=%s", "{:032b}".format(isdata.data))
+                    words.append(isdata.data)
+                else:
+                    self._log("read autoinc invalid")
 
         return words
 
@@ -330,33 +447,42 @@ class JTAGXC9500Interface:
     async def bulk_erase(self):
         self._log("bulk erase")
         await self.lower.write_ir(IR_FBULK)
-        isaddr = DR_ISADDRESS(valid=1, strobe=1, address=0xffff)
-        await self.lower.write_dr(isaddr.to_bitarray()[:18])
+        async with self.lower.batch():
+            isaddr = DR_ISADDRESS(valid=1, strobe=1, address=0xffff)
+            await self.lower.write_dr(isaddr.to_bitarray()[:18])
 
-        await self.lower.run_test_idle(200_000)
+            await self.lower.run_test_idle(200_000)
 
-        isaddr_bits = await self.lower.read_dr(18)
-        isaddr = DR_ISADDRESS.from_bitarray(isaddr_bits)
+            isaddr_bits = await self.lower.read_dr(18)
+        isaddr = DR_ISADDRESS.from_bitarray(isaddr_bits.result())
         if not (isaddr.valid and not isaddr.strobe):
             raise GlasgowAppletError("bulk erase failed %s" % isaddr.bits_repr())
 
     async def _fpgm(self, address, words):
         await self.lower.write_ir(IR_FPGM)
 
-        for offset, word in enumerate(words):
-            dev_address = bitstream_to_device_address(address + offset)
-            self._log("program address=%03x data=%s",
-                      dev_address, "{:032b}".format(word))
-            strobe = (offset % BLOCK_WORDS == BLOCK_WORDS - 1)
-            isconf = DR_ISCONFIGURATION(valid=1, strobe=strobe, address=dev_address, data=word)
-            await self.lower.write_dr(isconf.to_bitarray()[:50])
-
-            if strobe:
-                await self.lower.run_test_idle(20_000)
-
-                isconf = DR_ISCONFIGURATION(address=dev_address)
-                isconf_bits = await self.lower.exchange_dr(isconf.to_bitarray()[:50])
-                isconf = DR_ISCONFIGURATION.from_bitarray(isconf_bits)
+        for batch_offset in range(0, len(words), BATCH_WORDS):
+            results = []
+            async with self.lower.batch():
+                for offset in range(batch_offset, min(batch_offset + BATCH_WORDS, len(words))):
+                    word = words[offset]
+                    dev_address = bitstream_to_device_address(address + offset)
+                    self._log("program address=%03x data=%s",
+                              dev_address, "{:032b}".format(word))
+                    strobe = (offset % BLOCK_WORDS == BLOCK_WORDS - 1)
+                    isconf = DR_ISCONFIGURATION(valid=1, strobe=strobe, address=dev_address,
+                                                data=word)
+                    await self.lower.write_dr(isconf.to_bitarray()[:50])
+
+                    if strobe:
+                        await self.lower.run_test_idle(20_000)
+
+                        isconf = DR_ISCONFIGURATION(address=dev_address)
+                        isconf_bits = await self.lower.exchange_dr(isconf.to_bitarray()[:50])
+                        results.append((offset, isconf_bits))
+
+            for offset, isconf_bits in results:
+                isconf = DR_ISCONFIGURATION.from_bitarray(isconf_bits.result())
                 if not (isconf.valid and not isconf.strobe):
                     self._logger.warn("program word %03x failed %s"
                                       % (offset, isconf.bits_repr()))
@@ -369,19 +495,26 @@ class JTAGXC9500Interface:
     async def _fpgmi(self, words):
         await self.lower.write_ir(IR_FPGMI)
 
-        for offset, word in enumerate(words):
-            self._log("program autoinc data=%s",
-                      "{:032b}".format(word))
-            strobe = (offset % BLOCK_WORDS == BLOCK_WORDS - 1)
-            isdata = DR_ISDATA(valid=1, strobe=strobe, data=word)
-            await self.lower.write_dr(isdata.to_bitarray()[:34])
-
-            if strobe:
-                await self.lower.run_test_idle(20_000)
-
-                isdata = DR_ISDATA()
-                isdata_bits = await self.lower.exchange_dr(isdata.to_bitarray()[:34])
-                isdata = DR_ISDATA.from_bitarray(isdata_bits)
+        for batch_offset in range(0, len(words), BATCH_WORDS):
+            results = []
+            async with self.lower.batch():
+                for offset in range(batch_offset, min(batch_offset + BATCH_WORDS, len(words))):
+                    word = words[offset]
+                    self._log("program autoinc data=%s",
+                              "{:032b}".format(word))
+                    strobe = (offset % BLOCK_WORDS == BLOCK_WORDS - 1)
+                    isdata = DR_ISDATA(valid=1, strobe=strobe, data=word)
+                    await self.lower.write_dr(isdata.to_bitarray()[:34])
+
+                    if strobe:
+                        await self.lower.run_test_idle(20_000)
+
+                        isdata = DR_ISDATA()
+                        isdata_bits = await self.lower.exchange_dr(isdata.to_bitarray()[:34])
+                        results.append((offset, isdata_bits))
+
+            for offset, isdata_bits in results:
+                isdata = DR_ISDATA.from_bitarray(isdata_bits.result())
                 if not (isdata.valid and not isdata.strobe):
                     self._logger.warn("program autoinc word %03x failed %s"
                                       % (offset, isdata.bits_repr()))
@@ -416,7 +549,8 @@ class JTAGXC9500Applet(JTAGApplet, name="jtag-xc9500"):
     The Glasgow .bit XC9500 bitstream format is a flat, unstructured sequence of 32-bit words
     comprising the bitstream, written in little endian binary. It is substantially different
     from both .jed and .svf bitstream formats, but matches the internal device programming
-    architecture.
+    architecture. Bitstreams can also be programmed and verified directly from .jed files, and
+    converted between the two formats with `glasgow tool jtag-xc9500`.
     """.format(
         devices="\n".join(map(lambda x: "        * {.name}\n".format(x), devices.values()))
     )
@@ -437,7 +571,7 @@ class JTAGXC9500Applet(JTAGApplet, name="jtag-xc9500"):
         if not tap_iface:
             raise GlasgowAppletError("cannot select TAP #%d" % args.tap_index)
 
-        return JTAGXC9500Interface(tap_iface, self.logger, args.frequency * 1000)
+        return JTAGXC9500Interface(tap_iface, self.logger, jtag_iface.frequency)
 
     @classmethod
     def add_interact_arguments(cls, parser):
@@ -457,13 +591,13 @@ class JTAGXC9500Applet(JTAGApplet, name="jtag-xc9500"):
             "program-bit", help="read bitstream from a .bit file and program it to the device")
         p_program_bit.add_argument(
             "bit_file", metavar="BIT-FILE", type=argparse.FileType("rb"),
-            help="bitstream file to read")
+            help="bitstream file (.bit or .jed) to read")
 
         p_verify_bit = p_operation.add_parser(
             "verify-bit", help="read bitstream from a .bit file and verify it against the device")
         p_verify_bit.add_argument(
             "bit_file", metavar="BIT-FILE", type=argparse.FileType("rb"),
-            help="bitstream file to read")
+            help="bitstream file (.bit or .jed) to read")
 
         p_erase = p_operation.add_parser(
             "erase", help="erase bitstream from the device")
@@ -484,30 +618,31 @@ class JTAGXC9500Applet(JTAGApplet, name="jtag-xc9500"):
         try:
             if args.operation == "read-bit":
                 await xc9500_iface.programming_enable()
-                for word in await xc9500_iface.read(0, device.bitstream_words,
-                                                    fast=not args.slow):
+                started = time.time()
+                words = await xc9500_iface.read(0, device.bitstream_words, fast=not args.slow)
+                self.logger.info("read %d words in %.3f s",
+                                 len(words), time.time() - started)
+                for word in words:
                     args.bit_file.write(struct.pack("<L", word))
 
             if args.operation in ("program-bit", "verify-bit"):
-                words = []
-                while True:
-                    data = args.bit_file.read(4)
-                    if data == b"": break
-                    words.append(*struct.unpack("<L", data))
-
-                if len(words) != device.bitstream_words:
-                    raise GlasgowAppletError("incorrect .bit file size (%d words) for device %s"
-                                             % (len(words), device.name))
+                words = load_bitstream(args.bit_file, device)
 
             if args.operation == "program-bit":
                 await xc9500_iface.programming_enable()
+                started = time.time()
                 await xc9500_iface.program(0, words,
                                            fast=not args.slow)
+                self.logger.info("programmed %d words in %.3f s",
+                                 len(words), time.time() - started)
 
             if args.operation == "verify-bit":
                 await xc9500_iface.programming_enable()
+                started = time.time()
                 device_words = await xc9500_iface.read(0, device.bitstream_words,
                                                        fast=not args.slow)
+                self.logger.info("read %d words in %.3f s",
+                                 len(device_words), time.time() - started)
                 for offset, (device_word, gold_word) in enumerate(zip(device_words, words)):
                     if device_word != gold_word:
                         raise GlasgowAppletError("bitstream verification failed at word %03x"
@@ -546,20 +681,58 @@ class JTAGXC9500AppletTool(GlasgowAppletTool, applet=JTAGXC9500Applet):
         p_read_bit_usercode = p_operation.add_parser(
             "read-bit-usercode", help="read USERCODE from a .bit file")
         p_read_bit_usercode.add_argument(
+            "bit_file", metavar="BIT-FILE", type=argparse.FileType("rb"),
+            help="bitstream file (.bit or .jed) to read")
+
+        p_jed2bit = p_operation.add_parser(
+            "jed2bit", help="convert a .jed file to a .bit file")
+        p_jed2bit.add_argument(
+            "jed_file", metavar="JED-FILE", type=argparse.FileType("rb"),
+            help="bitstream file to read")
+        p_jed2bit.add_argument(
+            "bit_file", metavar="BIT-FILE", type=argparse.FileType("wb"),
+            help="bitstream file to write")
+
+        p_bit2jed = p_operation.add_parser(
+            "bit2jed", help="convert a .bit file to a .jed file")
+        p_bit2jed.add_argument(
             "bit_file", metavar="BIT-FILE", type=argparse.FileType("rb"),
             help="bitstream file to read")
+        p_bit2jed.add_argument(
+            "jed_file", metavar="JED-FILE", type=argparse.FileType("wb"),
+            help="bitstream file to write")
+
+        p_diff = p_operation.add_parser(
+            "diff", help="show words that differ between two bitstreams")
+        p_diff.add_argument(
+            "bit_file_a", metavar="FILE-A", type=argparse.FileType("rb"),
+            help="bitstream file (.bit or .jed) to compare")
+        p_diff.add_argument(
+            "bit_file_b", metavar="FILE-B", type=argparse.FileType("rb"),
+            help="bitstream file (.bit or .jed) to compare")
 
     async def run(self, args):
-        if args.operation == "read-bit-usercode":
-            words = []
-            while True:
-                data = args.bit_file.read(4)
-                if data == b"": break
-                words.append(*struct.unpack("<L", data))
+        if args.operation == "jed2bit":
+            words = load_bitstream(args.jed_file, args.device)
+            args.bit_file.write(struct.pack("<{}L".format(len(words)), *words))
+
+        if args.operation == "bit2jed":
+            save_jed(args.jed_file, load_bitstream(args.bit_file, args.device), args.device)
+
+        if args.operation == "diff":
+            bits_a = words_to_bitstream(load_bitstream(args.bit_file_a, args.device))
+            bits_b = words_to_bitstream(load_bitstream(args.bit_file_b, args.device))
+            word_addresses = sorted({bit // 32 for bit in (bits_a ^ bits_b).search(bitarray("1"))})
+            words_a = bitstream_to_words(bits_a)
+            words_b = bitstream_to_words(bits_b)
+            for word_address in word_addresses:
+                print("{:04x} (address {:04x}): {:032b} {:032b}".format(
+                      word_address, bitstream_to_device_address(word_address),
+                      words_a[word_address], words_b[word_address]))
+            self.logger.info("%d of %d words differ", len(word_addresses), len(words_a))
 
-            if len(words) != args.device.bitstream_words:
-                raise GlasgowAppletError("incorrect .bit file size (%d words) for device %s"
-                                         % (len(words), args.device.name))
+        if args.operation == "read-bit-usercode":
+            words = load_bitstream(args.bit_file, args.device)
 
             usercode_words = [
                 words[index] for index in range(args.device.usercode_low,
@@ -575,3 +748,48 @@ class JTAGXC9500AppletTool(GlasgowAppletTool, applet=JTAGXC9500Applet):
             self.logger.info("USERCODE=%s (%s)",
                              usercode.hex(),
                              re.sub(rb"[^\x20-\x7e]", b"?", usercode).decode("ascii"))
+
+# -------------------------------------------------------------------------------------------------
+
+import io
+import random
+import unittest
+
+
+class JTAGXC9500BitstreamTestCase(unittest.TestCase):
+    device = devices[0x049, 0x9604]
+
+    def test_jed_to_bitstream(self):
+        fuse = bitarray(self.device.bitstream_words // BLOCK_WORDS * BLOCK_FUSES,
+                        endian="little")
+        fuse.setall(0)
+        fuse[BLOCK_FUSES + 33] = 1  # block 1, 4x8 L-field 1
+        fuse[BLOCK_FUSES + 9 * 32 + 24 + 7] = 1  # block 1, 4x6 L-field 1, group 1
+        words = bitstream_to_words(jed_to_bitstream(fuse, self.device))
+        self.assertEqual([(address, word) for address, word in enumerate(words) if word],
+                         [(jed_to_device_address(BLOCK_FUSES + 33), 1 << 1),
+                          (jed_to_device_address(BLOCK_FUSES + 9 * 32 + 24 + 7), 1 << 9)])
+        self.assertEqual(bitstream_to_jed(words_to_bitstream(words), self.device), fuse)
+
+    def test_roundtrip(self):
+        rng = random.Random(0)
+        words = [rng.getrandbits(32) for _ in range(self.device.bitstream_words)]
+        for address in range(self.device.bitstream_words):
+            if address % BLOCK_WORDS >= 9:
+                words[address] &= 0x3f3f3f3f
+
+        jed_file = io.BytesIO()
+        save_jed(jed_file, words, self.device)
+        jed_file.seek(0)
+        self.assertEqual(load_bitstream(jed_file, self.device), words)
+
+        bit_file = io.BytesIO(struct.pack("<{}L".format(len(words)), *words))
+        self.assertEqual(load_bitstream(bit_file, self.device), words)
+
+    def test_load_errors(self):
+        with self.assertRaisesRegex(GlasgowAppletError,
+                r"^incorrect \.bit file size \(1 words\) for device XC9572XL"):
+            load_bitstream(io.BytesIO(b"\0" * 4), self.device)
+        with self.assertRaisesRegex(GlasgowAppletError,
+                r"^incorrect \.jed file size \(8 fuses\) for device XC9572XL"):
+            load_bitstream(io.BytesIO(b"\x02*QF8*\x03"), self.device)
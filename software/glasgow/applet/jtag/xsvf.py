@@ -0,0 +1,288 @@
+import math
+import logging
+import argparse
+from bitarray import bitarray
+
+from . import JTAGApplet, JTAGDeferred
+from .svf import _MAX_PENDING_TDO_BITS, _map_file
+from .. import *
+from ...protocol.jtag_xsvf import *
+
+
+class JTAGXSVFInterface(XSVFEventHandler):
+    def __init__(self, interface, logger, frequency):
+        self.lower   = interface
+        self._logger = logger
+        self._level  = logging.DEBUG if self._logger.name == __name__ else logging.TRACE
+        self._frequency = frequency
+
+        self._repeat  = 0
+        self._runtest = 0
+        self._endir   = "IDLE"
+        self._enddr   = "IDLE"
+
+        # The offset of the command being executed, used when reporting failed TDO checks.
+        self.offset   = None
+        self._pending_checks = []
+        self._pending_bits   = 0
+
+    def _log(self, message, *args):
+        self._logger.log(self._level, "XSVF: " + message, *args)
+
+    def _check_tdo(self, offset, tdo, expected, mask):
+        if isinstance(tdo, JTAGDeferred):
+            tdo = tdo.result()
+        if tdo & mask != expected & mask:
+            raise GlasgowAppletError("command%s failed: TDO <%s> & <%s> != <%s>"
+                                     % ("" if offset is None else " at offset %#x" % offset,
+                                        tdo.to01(), mask.to01(), expected.to01()))
+
+    async def flush(self):
+        """
+        Wait until every command has been executed, and check TDO data of every command
+        that was not checked yet.
+        """
+        await self.lower.commit()
+        pending_checks, self._pending_checks = self._pending_checks, []
+        self._pending_bits = 0
+        for check in pending_checks:
+            self._check_tdo(*check)
+
+    def _cycles(self, time):
+        return math.ceil(time * self._frequency / 1e6)
+
+    async def _wait(self, state, cycles):
+        if cycles == 0:
+            return
+        if state == "RESET":
+            await self.lower.shift_tms(bitarray("1" * cycles, endian="little"))
+        elif state in ("IDLE", "DRPAUSE", "IRPAUSE"):
+            await self.lower.enter_state(state)
+            await self.lower.pulse_tck(cycles)
+        else:
+            raise GlasgowAppletError("cannot wait in TAP state %s" % state)
+
+    async def _shift(self, shift_state, tdi, tdo, mask, last=True):
+        await self.lower.enter_state(shift_state)
+        if tdo is None or not mask.any():
+            await self.lower.shift_tdi(tdi, last=last)
+            return None
+        elif len(tdi) > _MAX_PENDING_TDO_BITS:
+            tdo_bits = bitarray(endian="little")
+            async for tdo_chunk in self.lower.shift_tdio_stream(tdi, last=last):
+                tdo_bits += tdo_chunk
+            return tdo_bits
+        else:
+            return await self.lower.shift_tdio(tdi, last=last)
+
+    async def _shift_checked(self, shift_state, tdi, tdo, mask, last=True):
+        tdo_bits = await self._shift(shift_state, tdi, tdo, mask, last)
+        if tdo_bits is None:
+            return
+
+        self._pending_checks.append((self.offset, tdo_bits, tdo, mask))
+        self._pending_bits += len(tdi)
+        if self._pending_bits >= _MAX_PENDING_TDO_BITS:
+            await self.flush()
+
+    async def xsvf_sir(self, tdi):
+        self._log("XSIR count=%d", len(tdi))
+        await self._shift("IRSHIFT", tdi, None, None)
+        await self.lower.enter_state(self._endir)
+        await self._wait(self._endir, self._cycles(self._runtest))
+
+    async def xsvf_sdr(self, tdi, tdo, mask):
+        self._log("XSDR count=%d", len(tdi))
+        runtest = self._runtest
+        if tdo is None or not mask.any() or self._repeat == 0 or self._runtest == 0:
+            # The result of the check does not affect the commands that follow it, so it is
+            # deferred. As in the XAPP503 reference player, the command is only retried if it
+            # is followed by a wait in Run-Test/Idle, and otherwise a mismatch is a failure.
+            await self._shift_checked("DRSHIFT", tdi, tdo, mask)
+        else:
+            # The TDO data has to be checked before the next command, since a mismatch means
+            # the command has to be retried. The retry sequence is sent together with
+            # the repeated shift, so there is a single round trip per attempt.
+            for attempt in range(self._repeat + 1):
+                tdo_bits = await self._shift("DRSHIFT", tdi, tdo, mask)
+                await self.flush()
+                if isinstance(tdo_bits, JTAGDeferred):
+                    tdo_bits = tdo_bits.result()
+                if tdo_bits & mask == tdo & mask:
+                    break
+                if attempt == self._repeat:
+                    self._check_tdo(self.offset, tdo_bits, tdo, mask)
+
+                self._log("XSDR retry %d", attempt + 1)
+                await self.lower.enter_state("IDLE",
+                    path=["DRPAUSE", "DREXIT2", "DRSHIFT", "DREXIT1", "DRUPDATE"])
+                runtest += runtest >> 2
+                await self._wait("IDLE", self._cycles(runtest))
+        await self.lower.enter_state(self._enddr)
+        await self._wait(self._enddr, self._cycles(runtest))
+
+    async def xsvf_sdr_part(self, part, tdi, tdo, mask):
+        self._log("XSDR part=%s count=%d", part, len(tdi))
+        await self._shift_checked("DRSHIFT", tdi, tdo, mask, last=(part == "end"))
+        if part == "end":
+            await self.lower.enter_state(self._enddr)
+            await self._wait(self._enddr, self._cycles(self._runtest))
+
+    async def xsvf_runtest(self, time):
+        self._runtest = time
+
+    async def xsvf_repeat(self, count):
+        self._repeat = count
+
+    async def xsvf_state(self, state):
+        if state == "RESET":
+            await self.lower.enter_test_logic_reset(force=True)
+        else:
+            await self.lower.enter_state(state)
+
+    async def xsvf_endir(self, state):
+        self._endir = state
+
+    async def xsvf_enddr(self, state):
+        self._enddr = state
+
+    async def xsvf_comment(self, text):
+        self._log("%s", text)
+
+    async def xsvf_wait(self, wait_state, end_state, cycles, time):
+        await self.lower.enter_state(wait_state)
+        await self._wait(wait_state, max(cycles or 0, self._cycles(time)))
+        await self.lower.enter_state(end_state)
+
+    async def xsvf_trst(self, mode):
+        if mode == "ABSENT":
+            pass
+        elif mode == "Z":
+            await self.lower.set_trst(state=None)
+        elif mode == "ON":
+            await self.lower.set_trst(state=True)
+        elif mode == "OFF":
+            await self.lower.set_trst(state=False)
+        else:
+            assert False
+
+
+class JTAGXSVFApplet(JTAGApplet, name="jtag-xsvf"):
+    logger = logging.getLogger(__name__)
+    help = "play XSVF test vectors via JTAG"
+    description = """
+    Play XSVF test vectors via the JTAG interface.
+
+    The XSVF file is decoded as it is played. Wait times (XRUNTEST and XWAIT) are converted to
+    TCK cycles, and commands are sent to the device without waiting for it to execute them,
+    with TDO data checked in bulk. However, if XREPEAT is not zero, TDO data of every XSDR and
+    XSDRTDO command has to be checked before the next command is sent, since it determines
+    whether the command is retried.
+
+    The obsolete XSETSDRMASKS and XSDRINC commands are not supported.
+    """
+
+    async def run(self, device, args):
+        jtag_iface = await super().run(device, args)
+        await jtag_iface.pulse_trst()
+
+        return JTAGXSVFInterface(jtag_iface, self.logger, jtag_iface.frequency)
+
+    @classmethod
+    def add_interact_arguments(cls, parser):
+        parser.add_argument(
+            "xsvf_file", metavar="XSVF-FILE", type=argparse.FileType("rb"),
+            help="test vector to play")
+
+    async def interact(self, device, args, xsvf_iface):
+        xsvf_parser = XSVFParser(_map_file(args.xsvf_file), xsvf_iface)
+        async with xsvf_iface.lower.batch():
+            while True:
+                coro = xsvf_parser.parse_command()
+                if not coro: break
+
+                xsvf_iface.offset = xsvf_parser.last_command_offset()
+                await coro
+            await xsvf_iface.flush()
+
+# -------------------------------------------------------------------------------------------------
+
+import io
+import asyncio
+
+from . import JTAGInterface, _MockJTAGChain, _MockTAP
+
+
+class JTAGXSVFAppletTestCase(GlasgowAppletTestCase, applet=JTAGXSVFApplet):
+    @synthesis_test
+    def test_build(self):
+        self.assertBuilds()
+
+    def play_mock_xsvf(self, source, chain=None):
+        if chain is None:
+            chain = _MockJTAGChain([_MockTAP(4, idcode=0x4ba00477)])
+        jtag_iface = JTAGInterface(chain, self.applet.logger,
+                                   sys_clk_freq=30e6, addr_half_cyc=(0, 1))
+        xsvf_iface = JTAGXSVFInterface(jtag_iface, self.applet.logger, 1e6)
+        args = argparse.Namespace(xsvf_file=io.BytesIO(source))
+        asyncio.get_event_loop().run_until_complete(
+            self.applet.interact(None, args, xsvf_iface))
+        return chain
+
+    # XSTATE Test-Logic-Reset; XSIR 4 (f), selecting BYPASS; XSDRSIZE 8; XTDOMASK (ff)
+    _prologue = b"\x12\x00\x02\x04\x0f\x08\x00\x00\x00\x08\x01\xff"
+
+    def test_play(self):
+        chain = self.play_mock_xsvf(self._prologue +
+            b"\x16select BYPASS\x00"
+            b"\x09\xa5\x4a"             # XSDRTDO (a5) (4a)
+            b"\x14\x01"                 # XENDDR Pause-DR
+            b"\x04\x00\x00\x00\x0a"     # XRUNTEST 10
+            b"\x09\xff\xfe"             # XSDRTDO (ff) (fe)
+            b"\x00")                    # XCOMPLETE
+        self.assertEqual(chain._state, "DRPAUSE")
+        # All TDO data is checked at once.
+        self.assertEqual(chain.reads, 1)
+
+    def test_play_failure(self):
+        with self.assertRaisesRegex(GlasgowAppletError,
+                r"^command at offset 0xf failed: TDO <00000000> & <11111111> != <11111111>"):
+            self.play_mock_xsvf(self._prologue +
+                b"\x09\xa5\x4a"         # XSDRTDO (a5) (4a)
+                b"\x09\x00\xff"         # XSDRTDO (00) (ff)
+                b"\x09\x00\x00")        # XSDRTDO (00) (00)
+
+    def test_play_repeat(self):
+        chain = self.play_mock_xsvf(self._prologue +
+            b"\x07\x03"                 # XREPEAT 3
+            b"\x09\xa5\x4a")            # XSDRTDO (a5) (4a)
+        self.assertEqual(chain.reads, 1)
+
+        chain = _MockJTAGChain([_MockTAP(4, idcode=0x4ba00477)])
+        with self.assertRaisesRegex(GlasgowAppletError,
+                r"^command at offset 0x13 failed"):
+            self.play_mock_xsvf(self._prologue +
+                b"\x07\x03"             # XREPEAT 3
+                b"\x04\x00\x00\x00\x0a" # XRUNTEST 10
+                b"\x09\x00\xff",        # XSDRTDO (00) (ff)
+                chain)
+        # One round trip per attempt.
+        self.assertEqual(chain.reads, 4)
+
+        # Without a wait in Run-Test/Idle, commands are not retried, and checks are deferred.
+        chain = _MockJTAGChain([_MockTAP(4, idcode=0x4ba00477)])
+        with self.assertRaisesRegex(GlasgowAppletError,
+                r"^command at offset 0x13 failed"):
+            self.play_mock_xsvf(self._prologue +
+                b"\x07\x03"             # XREPEAT 3
+                b"\x04\x00\x00\x00\x00" # XRUNTEST 0
+                b"\x09\x00\xff"         # XSDRTDO (00) (ff)
+                b"\x09\xa5\x4a",        # XSDRTDO (a5) (4a)
+                chain)
+        self.assertEqual(chain.reads, 1)
+
+    def test_play_wait(self):
+        chain = self.play_mock_xsvf(
+            b"\x17\x01\x06\x00\x00\x00\x64" # XWAIT Run-Test/Idle Pause-DR 100
+            b"\x1c\x03")                    # XTRST ABSENT
+        self.assertEqual(chain._state, "DRPAUSE")
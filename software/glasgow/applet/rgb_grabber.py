@@ -9,6 +9,11 @@ from . import *
 
 class RGBGrabberSubtarget(Module):
     def __init__(self, rows, columns, vblank, pads, in_fifo, sys_clk_freq):
+        self.frame_stb = Signal()
+        self.row_stb   = Signal()
+
+        ###
+
         rx    = Signal(5)
         gx    = Signal(5)
         bx    = Signal(5)
@@ -42,14 +47,15 @@ class RGBGrabberSubtarget(Module):
         self.sync += \
             If(stb, pixel.eq(Cat(rx, gx, bx)))
 
-        frame = Signal(5, reset_less=True)
+        self.frame = frame = Signal(5, reset_less=True)
+        self.row   = row   = Signal(max=rows)
         ovf_r = Signal()
-        row   = Signal(max=rows)
         col   = Signal(max=columns)
         self.submodules.fsm = ResetInserter()(FSM(reset_state="CAPTURE-ROW"))
         self.fsm.act("CAPTURE-ROW",
             If(stb,
                 If(row == 0,
+                    self.frame_stb.eq(1),
                     ovf_r.eq(ovf),
                     ovf_c.eq(1),
                     NextValue(frame, frame + 1),
@@ -73,6 +79,7 @@ class RGBGrabberSubtarget(Module):
             NextState("REPORT-ROW")
         )
         self.fsm.act("REPORT-ROW",
+            self.row_stb.eq(1),
             din.eq(row & 0x7f),
             we.eq(1),
             NextState("REPORT-1")
@@ -140,7 +147,7 @@ class RGBGrabberApplet(GlasgowApplet, name="rgb-grabber"):
 
     def build(self, target, args):
         self.mux_interface = iface = target.multiplexer.claim_interface(self, args)
-        iface.add_subtarget(RGBGrabberSubtarget(
+        subtarget = iface.add_subtarget(RGBGrabberSubtarget(
             rows=args.rows,
             columns=args.columns,
             vblank=args.vblank,
@@ -148,6 +155,8 @@ class RGBGrabberApplet(GlasgowApplet, name="rgb-grabber"):
             in_fifo=iface.get_in_fifo(depth=512 * 30, auto_flush=False),
             sys_clk_freq=target.sys_clk_freq,
         ))
+        iface.add_event("frame", trigger=subtarget.frame_stb, data=subtarget.frame)
+        iface.add_event("row",   trigger=subtarget.row_stb,   data=subtarget.row)
 
     async def run(self, device, args):
         iface = await device.demultiplexer.claim_interface(self, self.mux_interface, args)
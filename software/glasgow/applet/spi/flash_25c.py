@@ -1,5 +1,6 @@
 import re
 import sys
+import time
 import struct
 import logging
 import argparse
@@ -29,16 +30,19 @@ class SPIFlash25CInterface:
     def _log(self, message, *args):
         self._logger.log(self._level, "SPI Flash 25C: " + message, *args)
 
-    async def _command(self, cmd, arg=[], dummy=0, ret=0, hold_ss=False):
+    async def _command(self, cmd, arg=[], dummy=0, ret=0, hold_ss=False, output=None):
         arg = bytes(arg)
 
         self._log("cmd=%02X arg=<%s> dummy=%d ret=%d", cmd, arg.hex(), dummy, ret)
 
         await self.lower.write([cmd, *arg, *[0 for _ in range(dummy)]],
                                hold_ss=(ret > 0))
-        result = await self.lower.read(ret)
+        result = await self.lower.read(ret, output=output)
 
-        self._log("result=<%s>", result.hex())
+        if output is None:
+            self._log("result=<%s>", result.hex())
+        else:
+            self._log("result=%d bytes", ret)
 
         return result
 
@@ -69,28 +73,40 @@ class SPIFlash25CInterface:
     def _format_addr(self, addr):
         return bytes([(addr >> 16) & 0xff, (addr >> 8) & 0xff, addr & 0xff])
 
-    async def _read_command(self, address, length, chunk_size, cmd, dummy=0):
+    async def _read_command(self, address, length, chunk_size, cmd, dummy=0, output=None):
         if chunk_size is None:
-            chunk_size = 0xff # FIXME: raise once #44 is fixed
+            # The whole range is read with one command, which the SPI master streams.
+            chunk_size = max(length, 1)
 
         data = bytearray()
         while length > 0:
+            chunk_length = min(chunk_size, length)
             chunk   = await self._command(cmd, arg=self._format_addr(address),
-                                          dummy=dummy, ret=min(chunk_size, length))
-            data   += chunk
-
-            length  -= len(chunk)
-            address += len(chunk)
-
-        return data
-
-    async def read(self, address, length, chunk_size=None):
+                                          dummy=dummy, ret=chunk_length, output=output)
+            if output is None:
+                data += chunk
+
+            length  -= chunk_length
+            address += chunk_length
+
+        if output is None:
+            return data
+
+    async def read(self, address, length, chunk_size=None, output=None):
+        """
+        Read ``length`` bytes at ``address``. If ``output`` is specified, the data is written to
+        it as it arrives (it can be a binary file or anything else with a ``write`` method,
+        such as an :class:`mmap.mmap`) instead of being returned.
+        """
         self._log("read addr=%#08x len=%d", address, length)
-        return await self._read_command(address, length, chunk_size, cmd=0x03)
+        return await self._read_command(address, length, chunk_size, cmd=0x03,
+                                        output=output)
 
-    async def fast_read(self, address, length, chunk_size=None):
+    async def fast_read(self, address, length, chunk_size=None, output=None):
+        """Like :meth:`read`, but using the FAST READ command."""
         self._log("fast read addr=%#08x len=%d", address, length)
-        return await self._read_command(address, length, chunk_size, cmd=0x0B, dummy=1)
+        return await self._read_command(address, length, chunk_size, cmd=0x0B, dummy=1,
+                                        output=output)
 
     async def read_status(self):
         status, = await self._command(0x05, ret=1)
@@ -351,15 +367,19 @@ class SPIFlash25CApplet(SPIMasterApplet, name="spi-flash-25c"):
                                  manufacturer_id, manufacturer_name, device_id)
 
         if args.operation in ("read", "fast-read"):
+            begin = time.time()
             if args.operation == "read":
-                data = await flash_iface.read(args.address, args.length)
+                data = await flash_iface.read(args.address, args.length, output=args.file)
             if args.operation == "fast-read":
-                data = await flash_iface.fast_read(args.address, args.length)
+                data = await flash_iface.fast_read(args.address, args.length, output=args.file)
+            end   = time.time()
 
-            if args.file:
-                args.file.write(data)
-            else:
+            if not args.file:
                 print(data.hex())
+            if args.length > 0:
+                self.logger.info("read %d bytes in %.3f s (%.3f MiB/s)",
+                                 args.length, end - begin,
+                                 args.length / max(end - begin, 1e-6) / (1 << 20))
 
         if args.operation in ("program-page", "program", "erase-program"):
             if args.data is not None:
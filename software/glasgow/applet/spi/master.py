@@ -7,6 +7,7 @@ from migen.genlib.fsm import *
 from migen.genlib.cdc import *
 
 from .. import *
+from ...decoder import *
 
 
 class SPIBus(Module):
@@ -168,7 +169,45 @@ class SPIMasterSubtarget(Module):
         )
 
 
+# The gateware counts bytes with a 16-bit counter, so longer transfers are split into several
+# commands, with chip select held between them.
+_MAX_CHUNK_SIZE = 0xffff
+
+# Exchanged data that is written to the device but not read back yet has to fit into the FIFOs
+# and the FX2 endpoint buffers (at least 3 KiB in each direction); otherwise, the device stops
+# accepting data while the host is busy writing it, and neither side can make progress. Transfers
+# are split into windows, and one window is queued while the previous one is read back.
+_XFER_WINDOW_SIZE = 1024
+
+
+def _chunks(data, size):
+    # Split a bytes-like object or a binary file into chunks of at most `size` bytes, flagging
+    # the last one. An empty input still produces one (empty) chunk.
+    if hasattr(data, "read"):
+        chunk = data.read(size)
+        while True:
+            next_chunk = data.read(size)
+            yield chunk, not next_chunk
+            if not next_chunk:
+                break
+            chunk = next_chunk
+    else:
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data)
+        data = memoryview(data)
+        for offset in range(0, max(len(data), 1), size):
+            yield data[offset:offset + size], offset + size >= len(data)
+
+
 class SPIMasterInterface:
+    """
+    An interface to the SPI master.
+
+    Transfers of any length are accepted; they are split into several commands without
+    deasserting chip select, and the commands are sent ahead of time, so that the bus is kept
+    busy. Data to send can be a bytes-like object or a binary file, and received data is
+    returned, or written to ``output`` if it is a binary file.
+    """
     def __init__(self, interface, logger):
         self.lower   = interface
         self._logger = logger
@@ -177,45 +216,73 @@ class SPIMasterInterface:
     def _log(self, message, *args):
         self._logger.log(self._level, "SPI: " + message, *args)
 
+    def _log_data(self, message, data):
+        if self._logger.isEnabledFor(self._level):
+            self._log(message, bytes(data).hex())
+
+    @staticmethod
+    def _command(cmd, count, hold_ss):
+        return struct.pack(">BH", cmd | (BIT_HOLD_SS if hold_ss else 0), count)
+
     async def reset(self):
         self._log("reset")
         await self.lower.reset()
 
-    async def transfer(self, data, hold_ss=False):
-        assert len(data) <= 0xffff
-        data = bytes(data)
-
-        self._log("xfer-out=<%s>", data.hex())
-
-        cmd = CMD_XFER | (BIT_HOLD_SS if hold_ss else 0)
-        await self.lower.write(struct.pack(">BH", cmd, len(data)))
-        await self.lower.write(data)
-        data = await self.lower.read(len(data))
-
-        self._log("xfer-in=<%s>", data.hex())
-
-        return data
-
-    async def read(self, count, hold_ss=False):
-        assert count <= 0xffff
-
-        cmd = CMD_READ | (BIT_HOLD_SS if hold_ss else 0)
-        await self.lower.write(struct.pack(">BH", cmd, count))
-        data = await self.lower.read(count)
-
-        self._log("read-in=<%s>", data.hex())
-
-        return data
+    async def transfer(self, data, hold_ss=False, output=None):
+        chunks = []
+        sink   = chunks.append if output is None else output.write
+
+        async def receive(count):
+            data = await self.lower.read(count)
+            self._log_data("xfer-in=<%s>", data)
+            sink(data)
+
+        pending = None
+        for chunk, last in _chunks(data, _XFER_WINDOW_SIZE):
+            self._log_data("xfer-out=<%s>", chunk)
+            await self.lower.write(self._command(CMD_XFER, len(chunk), hold_ss or not last))
+            await self.lower.write(chunk)
+            if pending is not None:
+                # Reading flushes the window that was just queued.
+                await receive(pending)
+            pending = len(chunk)
+        await receive(pending)
+
+        if output is None:
+            return bytearray().join(chunks)
+
+    async def read(self, count, hold_ss=False, output=None):
+        chunks = []
+        sink   = chunks.append if output is None else output.write
+
+        async def receive(count):
+            data = await self.lower.read(count)
+            self._log_data("read-in=<%s>", data)
+            sink(data)
+
+        # As in `transfer`, the next command is queued before the data for the previous one is
+        # read back, so that the device is never idle, but never has more than two commands
+        # waiting to be executed.
+        pending = None
+        for offset in range(0, max(count, 1), _MAX_CHUNK_SIZE):
+            length = min(count - offset, _MAX_CHUNK_SIZE)
+            await self.lower.write(self._command(CMD_READ, length,
+                                                 hold_ss or offset + length < count))
+            if pending is not None:
+                await receive(pending)
+            pending = length
+        await receive(pending)
+
+        if output is None:
+            return bytearray().join(chunks)
 
     async def write(self, data, hold_ss=False):
-        assert len(data) <= 0xffff
-        data = bytes(data)
-
-        self._log("write-out=<%s>", data.hex())
-
-        cmd = CMD_WRITE | (BIT_HOLD_SS if hold_ss else 0)
-        await self.lower.write(struct.pack(">BH", cmd, len(data)))
-        await self.lower.write(data)
+        for chunk, last in _chunks(data, _MAX_CHUNK_SIZE):
+            self._log_data("write-out=<%s>", chunk)
+            await self.lower.write(self._command(CMD_WRITE, len(chunk), hold_ss or not last))
+            await self.lower.write(chunk)
+            if not last:
+                await self.lower.flush()
 
 
 class SPIMasterApplet(GlasgowApplet, name="spi-master"):
@@ -224,7 +291,7 @@ class SPIMasterApplet(GlasgowApplet, name="spi-master"):
     description = """
     Initiate transactions on the SPI bus.
 
-    Maximum transaction length is 65535 bytes.
+    Transactions of any length are supported.
     """
 
     __pins = ("sck", "ss", "mosi", "miso")
@@ -281,9 +348,142 @@ class SPIMasterApplet(GlasgowApplet, name="spi-master"):
         data = await spi_iface.transfer(args.data)
         print(data.hex())
 
+    def protocol_decoder(self, args, clock_freq):
+        return SPIDecoder(clock_freq, sck_edge=args.sck_edge, ss_active=args.ss_active)
+
+
+class SPIMasterAppletTool(GlasgowAppletTool, applet=SPIMasterApplet):
+    help = "decode SPI transactions"
+    description = """
+    Decode SPI transactions from an event analyzer trace stream.
+    """
+
+    @classmethod
+    def add_arguments(cls, parser):
+        p_operation = parser.add_subparsers(dest="operation", metavar="OPERATION")
+
+        p_decode = p_operation.add_parser(
+            "decode", help="decode SPI transfers from a trace stream")
+        SPIDecoder.add_arguments(p_decode)
+        add_trace_argument(p_decode)
+
+    async def run(self, args):
+        if args.operation == "decode":
+            await decode_trace(args.trace,
+                lambda clock_freq: SPIDecoder.from_arguments(args, clock_freq))
+
 # -------------------------------------------------------------------------------------------------
 
+import io
+
+
+class _MockSPIMaster:
+    """
+    A model of the SPI master that accepts the same commands as :class:`SPIMasterSubtarget`,
+    with MISO looped back to MOSI, and data read by CMD_READ being the low byte of its offset.
+    Records every command as ``(cmd, hold_ss, count)``, and the most commands that were ever
+    waiting for their data to be read back.
+    """
+    def __init__(self):
+        self.commands    = []
+        self.outstanding = []
+        self.max_outstanding = 0
+        self._out = bytearray()
+        self._in  = bytearray()
+
+    async def write(self, data):
+        self._out += data
+        while len(self._out) >= 3:
+            cmd, count = struct.unpack(">BH", self._out[:3])
+            if cmd & ~BIT_HOLD_SS == CMD_READ:
+                data = bytes(offset & 0xff for offset in range(count))
+                size = 3
+            else:
+                data = bytes(self._out[3:3 + count])
+                size = 3 + count
+                if len(self._out) < size:
+                    break
+            del self._out[:size]
+            self.commands.append((cmd & ~BIT_HOLD_SS, bool(cmd & BIT_HOLD_SS), count))
+            if cmd & ~BIT_HOLD_SS != CMD_WRITE:
+                self._in += data
+                self.outstanding.append(count)
+                self.max_outstanding = max(self.max_outstanding, len(self.outstanding))
+
+    async def flush(self):
+        pass
+
+    async def read(self, length):
+        assert len(self._in) >= length
+        data, self._in = self._in[:length], self._in[length:]
+        while length > 0 or self.outstanding and self.outstanding[0] == 0:
+            consumed = min(length, self.outstanding[0])
+            self.outstanding[0] -= consumed
+            length -= consumed
+            if self.outstanding[0] == 0:
+                self.outstanding.pop(0)
+        return data
+
+
 class SPIMasterAppletTestCase(GlasgowAppletTestCase, applet=SPIMasterApplet):
+    def run_mock(self, method, *args, **kwargs):
+        lower = _MockSPIMaster()
+        spi_iface = SPIMasterInterface(lower, self.applet.logger)
+        result = asyncio.get_event_loop().run_until_complete(
+            getattr(spi_iface, method)(*args, **kwargs))
+        self.assertLessEqual(lower.max_outstanding, 2)
+        self.assertEqual(lower.outstanding, [])
+        return lower.commands, result
+
+    @staticmethod
+    def expected_commands(cmd, counts, hold_ss=False):
+        return [(cmd, hold_ss or index + 1 < len(counts), count)
+                for index, count in enumerate(counts)]
+
+    def test_transfer_chunks(self):
+        for length, counts in ((0, [0]),
+                               (_XFER_WINDOW_SIZE, [_XFER_WINDOW_SIZE]),
+                               (_XFER_WINDOW_SIZE + 1, [_XFER_WINDOW_SIZE, 1]),
+                               (_XFER_WINDOW_SIZE * 3, [_XFER_WINDOW_SIZE] * 3)):
+            data = bytes(range(256)) * (length // 256) + bytes(length % 256)
+            for hold_ss in (False, True):
+                commands, result = self.run_mock("transfer", data, hold_ss=hold_ss)
+                self.assertEqual(commands, self.expected_commands(CMD_XFER, counts, hold_ss))
+                self.assertEqual(result, data)
+
+    def test_transfer_file(self):
+        data   = bytes(range(256)) * 10
+        output = io.BytesIO()
+        commands, result = self.run_mock("transfer", io.BytesIO(data), output=output)
+        self.assertEqual(commands, self.expected_commands(CMD_XFER, [1024, 1024, 512]))
+        self.assertEqual(result, None)
+        self.assertEqual(output.getvalue(), data)
+
+    def test_read_chunks(self):
+        for length, counts in ((0, [0]),
+                               (_MAX_CHUNK_SIZE, [_MAX_CHUNK_SIZE]),
+                               (_MAX_CHUNK_SIZE + 1, [_MAX_CHUNK_SIZE, 1]),
+                               (_MAX_CHUNK_SIZE * 3, [_MAX_CHUNK_SIZE] * 3)):
+            for hold_ss in (False, True):
+                commands, result = self.run_mock("read", length, hold_ss=hold_ss)
+                self.assertEqual(commands, self.expected_commands(CMD_READ, counts, hold_ss))
+                self.assertEqual(len(result), length)
+
+        output = io.BytesIO()
+        commands, result = self.run_mock("read", _MAX_CHUNK_SIZE + 1, output=output)
+        self.assertEqual(result, None)
+        self.assertEqual(output.getvalue(),
+                         bytes(offset & 0xff for offset in range(_MAX_CHUNK_SIZE)) + b"\x00")
+
+    def test_write_chunks(self):
+        for length, counts in ((0, [0]),
+                               (_MAX_CHUNK_SIZE, [_MAX_CHUNK_SIZE]),
+                               (_MAX_CHUNK_SIZE + 1, [_MAX_CHUNK_SIZE, 1])):
+            commands, result = self.run_mock("write", bytes(length))
+            self.assertEqual(commands, self.expected_commands(CMD_WRITE, counts))
+            commands, result = self.run_mock("write", io.BytesIO(bytes(length)), hold_ss=True)
+            self.assertEqual(commands, self.expected_commands(CMD_WRITE, counts, hold_ss=True))
+
     def test_build(self):
         self.assertBuilds(args=["--pin-sck",  "0", "--pin-ss",   "1",
                                 "--pin-mosi", "2", "--pin-miso", "3"])
@@ -8,6 +8,7 @@ from migen.genlib.fsm import *
 from . import *
 from ..gateware.pads import *
 from ..gateware.uart import *
+from ..decoder import *
 
 
 class UARTSubtarget(Module):
@@ -172,6 +173,30 @@ class UARTApplet(GlasgowApplet, name="uart"):
         if args.operation == "pty":
             await self._interact_pty(uart)
 
+    def protocol_decoder(self, args, clock_freq):
+        return UARTDecoder(clock_freq, baud=args.baud, parity=args.parity)
+
+
+class UARTAppletTool(GlasgowAppletTool, applet=UARTApplet):
+    help = "decode UART frames"
+    description = """
+    Decode UART frames from an event analyzer trace stream.
+    """
+
+    @classmethod
+    def add_arguments(cls, parser):
+        p_operation = parser.add_subparsers(dest="operation", metavar="OPERATION")
+
+        p_decode = p_operation.add_parser(
+            "decode", help="decode UART frames from a trace stream")
+        UARTDecoder.add_arguments(p_decode)
+        add_trace_argument(p_decode)
+
+    async def run(self, args):
+        if args.operation == "decode":
+            await decode_trace(args.trace,
+                lambda clock_freq: UARTDecoder.from_arguments(args, clock_freq))
+
 # -------------------------------------------------------------------------------------------------
 
 class UARTAppletTestCase(GlasgowAppletTestCase, applet=UARTApplet):
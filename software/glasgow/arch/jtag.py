@@ -6,11 +6,97 @@ from ..support.bits import *
 
 
 __all__ = [
+    # TAP
+    "TAP_STATES", "TAP_STATE_NAMES", "TAP_STABLE_STATES", "TAP_PATHS", "tap_path_tms",
     # DR
     "DR_IDCODE",
 ]
 
 
+# TAP controller state graph, as {state: (next state if TMS=0, next state if TMS=1)}.
+# State names are as used in SVF.
+TAP_STATES = {
+    "RESET":     ("IDLE",      "RESET"),
+    "IDLE":      ("IDLE",      "DRSELECT"),
+    "DRSELECT":  ("DRCAPTURE", "IRSELECT"),
+    "DRCAPTURE": ("DRSHIFT",   "DREXIT1"),
+    "DRSHIFT":   ("DRSHIFT",   "DREXIT1"),
+    "DREXIT1":   ("DRPAUSE",   "DRUPDATE"),
+    "DRPAUSE":   ("DRPAUSE",   "DREXIT2"),
+    "DREXIT2":   ("DRSHIFT",   "DRUPDATE"),
+    "DRUPDATE":  ("IDLE",      "DRSELECT"),
+    "IRSELECT":  ("IRCAPTURE", "RESET"),
+    "IRCAPTURE": ("IRSHIFT",   "IREXIT1"),
+    "IRSHIFT":   ("IRSHIFT",   "IREXIT1"),
+    "IREXIT1":   ("IRPAUSE",   "IRUPDATE"),
+    "IRPAUSE":   ("IRPAUSE",   "IREXIT2"),
+    "IREXIT2":   ("IRSHIFT",   "IRUPDATE"),
+    "IRUPDATE":  ("IDLE",      "DRSELECT"),
+}
+
+# Names of TAP controller states as used in IEEE 1149.1.
+TAP_STATE_NAMES = {
+    "RESET":     "Test-Logic-Reset",
+    "IDLE":      "Run-Test/Idle",
+    "DRSELECT":  "Select-DR-Scan",
+    "DRCAPTURE": "Capture-DR",
+    "DRSHIFT":   "Shift-DR",
+    "DREXIT1":   "Exit1-DR",
+    "DRPAUSE":   "Pause-DR",
+    "DREXIT2":   "Exit2-DR",
+    "DRUPDATE":  "Update-DR",
+    "IRSELECT":  "Select-IR-Scan",
+    "IRCAPTURE": "Capture-IR",
+    "IRSHIFT":   "Shift-IR",
+    "IREXIT1":   "Exit1-IR",
+    "IRPAUSE":   "Pause-IR",
+    "IREXIT2":   "Exit2-IR",
+    "IRUPDATE":  "Update-IR",
+}
+
+# TAP controller states that can be remained in indefinitely.
+TAP_STABLE_STATES = ("RESET", "IDLE", "DRSHIFT", "DRPAUSE", "IRSHIFT", "IRPAUSE")
+
+
+def _tap_shortest_paths():
+    # Breadth-first search from every state. Where several paths are equally short, the one
+    # that has TMS=0 earlier is preferred.
+    paths = {}
+    for start in TAP_STATES:
+        found = {start: ""}
+        queue = [start]
+        while queue:
+            state = queue.pop(0)
+            for tms, next_state in enumerate(TAP_STATES[state]):
+                if next_state not in found:
+                    found[next_state] = found[state] + str(tms)
+                    queue.append(next_state)
+        for end, tms_bits in found.items():
+            paths[start, end] = tms_bits
+    return paths
+
+# Shortest TMS sequences between every pair of TAP controller states,
+# as {(start state, end state): "TMS bits, in order they are shifted"}.
+TAP_PATHS = _tap_shortest_paths()
+
+
+def tap_path_tms(start, path):
+    """
+    Return the TMS bits that move the TAP controller from state ``start`` through every state
+    in ``path`` in turn, as a string. Raise :class:`ValueError` if ``path`` includes a state
+    that is not directly reachable from the preceding one.
+    """
+    tms_bits = ""
+    state = start
+    for next_state in path:
+        if next_state not in TAP_STATES[state]:
+            raise ValueError("TAP state {} is not reachable from {} in one step"
+                             .format(next_state, state))
+        tms_bits += str(TAP_STATES[state].index(next_state))
+        state = next_state
+    return tms_bits
+
+
 DR_IDCODE = Bitfield("DR_IDCODE", 4, [
     ("present",  1),
     ("mfg_id",  11),
@@ -17,6 +17,9 @@ from .device import GlasgowDeviceError
 from .device.config import GlasgowConfig
 from .target.hardware import GlasgowHardwareTarget
 from .gateware.analyzer import TraceDecoder
+from .protocol.trace_stream import TraceStreamEncoder, TraceStreamEndpoint
+from .decoder import format_record
+from .support.endpoint import endpoint
 from .device.hardware import VID_QIHW, PID_GLASGOW, GlasgowHardwareDevice
 from .internal_test import *
 from .access.direct import *
@@ -141,6 +144,35 @@ def get_argparser():
             "ports", metavar="PORTS", type=str, nargs="?", default="AB",
             help="I/O port set (one or more of: A B, default: all)")
 
+    def add_analyzer_args(parser):
+        def names(arg):
+            return [name for name in arg.split(",") if name]
+
+        parser.add_argument(
+            "--trace-pins", metavar="PINS", type=names, default=None,
+            help="only trace applet pins or pin sets named in comma-separated list PINS "
+                 "(default: all)")
+        parser.add_argument(
+            "--trace-fifos", metavar="DIR", choices=("none", "in", "out", "all"), default="all",
+            help="trace data passing through applet FIFOs in direction DIR "
+                 "(one of: none in out all, default: %(default)s)")
+        parser.add_argument(
+            "--trace-exclude", metavar="EVENTS", type=names, default=[],
+            help="do not trace pins, FIFOs (fifo-in, fifo-out) or applet events named in "
+                 "comma-separated list EVENTS")
+        parser.add_argument(
+            "--trace-delay-width", metavar="BITS", type=int, default=16,
+            help="measure time between events with a BITS wide timer; wider timers use more "
+                 "block RAM, but drain long idle periods faster (default: %(default)s)")
+        parser.add_argument(
+            "--trace-delay-septets", metavar="COUNT", type=int, default=5,
+            help="report time between events with at most COUNT 7-bit groups "
+                 "(default: %(default)s)")
+        parser.add_argument(
+            "--trace-heartbeat", metavar="MS", type=float, default=None,
+            help="report elapsed time while idle, at most once every MS milliseconds "
+                 "(default: only when the delay counter would overflow)")
+
     def add_voltage_arg(parser, help):
         parser.add_argument(
             "voltage", metavar="VOLTS", type=float, nargs="?", default=None,
@@ -175,6 +207,17 @@ def get_argparser():
     p_run.add_argument(
         "--trace", metavar="FILENAME", type=argparse.FileType("wt"), default=None,
         help="trace applet I/O to FILENAME")
+    p_run.add_argument(
+        "--trace-endpoint", metavar="ENDPOINT", type=endpoint, default=None,
+        help="stream applet I/O trace to ENDPOINT, either unix:PATH or tcp:HOST:PORT")
+    p_run.add_argument(
+        "--trace-decode", default=False, action="store_true",
+        help="decode applet pin traces with the applet protocol decoder and log the results")
+    p_run.add_argument(
+        "--trace-stats", metavar="SECONDS", type=float, default=None,
+        help="report analyzer statistics every SECONDS while tracing, in addition to "
+             "the report at shutdown")
+    add_analyzer_args(p_run)
     g_run_bitstream = p_run.add_mutually_exclusive_group(required=True)
     g_run_bitstream.add_argument(
         "--bitstream", metavar="FILENAME", type=argparse.FileType("rb"),
@@ -225,6 +268,7 @@ def get_argparser():
     p_build.add_argument(
         "--trace", default=False, action="store_true",
         help="include applet analyzer")
+    add_analyzer_args(p_build)
     p_build.add_argument(
         "-t", "--type", metavar="TYPE", type=str,
         choices=["zip", "archive", "v", "verilog", "bin", "bitstream"], default="bitstream",
@@ -278,8 +322,25 @@ def get_argparser():
 
 # The name of this function appears in Verilog output, so keep it tidy.
 def _applet(args):
+    with_analyzer = bool(getattr(args, "trace", None) or getattr(args, "trace_endpoint", None) or
+                         getattr(args, "trace_decode", None))
     target = GlasgowHardwareTarget(multiplexer_cls=DirectMultiplexer,
-                                   with_analyzer=hasattr(args, "trace") and args.trace)
+                                   with_analyzer=with_analyzer)
+    if with_analyzer:
+        trace_fifos = {"none": (), "in": ("in",), "out": ("out",), "all": ("in", "out")}
+        target.analyzer.set_event_filter(pins=args.trace_pins,
+                                         fifos=trace_fifos[args.trace_fifos],
+                                         exclude=args.trace_exclude)
+        heartbeat_cyc = None
+        if args.trace_heartbeat is not None:
+            heartbeat_cyc = int(args.trace_heartbeat * target.sys_clk_freq / 1000)
+        try:
+            target.analyzer.set_delay_encoding(delay_width=args.trace_delay_width,
+                                               delay_septets=args.trace_delay_septets,
+                                               heartbeat_cyc=heartbeat_cyc)
+        except ValueError as e:
+            logger.error(e)
+            raise SystemExit()
     applet = GlasgowApplet.all_applets[args.applet]()
     try:
         applet.build(target, args)
@@ -381,47 +442,86 @@ async def _main():
                                 bitstream_id.hex(), args.applet)
                     await device.download_bitstream(target.get_bitstream(debug=True), bitstream_id)
 
-                if args.trace:
+                tracing = args.trace or args.trace_endpoint or args.trace_decode
+                if tracing:
                     logger.info("starting applet analyzer")
                     await device.write_register(target.analyzer.addr_done, 0)
                     analyzer_iface = await device.demultiplexer.claim_interface(
                         target.analyzer, target.analyzer.mux_interface, args=None)
                     trace_decoder = TraceDecoder(target.analyzer.event_sources)
-                    vcd_writer = VCDWriter(args.trace, timescale="1 ns", check_values=False,
-                        comment='Generated by Glasgow for bitstream ID %s' % bitstream_id.hex())
+
+                    vcd_writer = None
+                    if args.trace:
+                        vcd_writer = VCDWriter(args.trace, timescale="1 ns", check_values=False,
+                            comment='Generated by Glasgow for bitstream ID %s' % bitstream_id.hex())
+
+                    trace_endpoint = None
+                    if args.trace_endpoint:
+                        trace_endpoint = await TraceStreamEndpoint("trace socket",
+                            target.analyzer.logger, args.trace_endpoint,
+                            TraceStreamEncoder(trace_decoder.events(), target.sys_clk_freq))
+
+                    protocol_decoder = None
+                    if args.trace_decode:
+                        protocol_decoder = applet.protocol_decoder(args, target.sys_clk_freq)
+                        if protocol_decoder is None:
+                            logger.warning("applet %r does not have a protocol decoder",
+                                           args.applet)
 
                 async def run_analyzer():
-                    if not args.trace:
+                    if not tracing:
                         return
 
                     signals = {}
                     strobes = set()
-                    for field_name, field_trigger, field_width in trace_decoder.events():
-                        if field_trigger == "throttle":
-                            var_type = "wire"
-                            var_init = 0
-                        elif field_trigger == "change":
-                            var_type = "wire"
-                            var_init = "x"
-                        elif field_trigger == "strobe":
-                            if field_width > 0:
-                                var_type = "tri"
-                                var_init = "z"
+                    if vcd_writer:
+                        for field_name, field_trigger, field_width in trace_decoder.events():
+                            if field_trigger == "throttle":
+                                var_type = "wire"
+                                var_init = 0
+                            elif field_trigger == "change":
+                                var_type = "wire"
+                                var_init = "x"
+                            elif field_trigger == "strobe":
+                                if field_width > 0:
+                                    var_type = "tri"
+                                    var_init = "z"
+                                else:
+                                    var_type = "event"
+                                    var_init = ""
                             else:
-                                var_type = "event"
-                                var_init = ""
-                        else:
-                            assert False
-                        signals[field_name] = vcd_writer.register_var(
-                            scope="", name=field_name, var_type=var_type,
-                            size=field_width, init=var_init)
-                        if field_trigger == "strobe":
-                            strobes.add(field_name)
+                                assert False
+                            signals[field_name] = vcd_writer.register_var(
+                                scope="", name=field_name, var_type=var_type,
+                                size=field_width, init=var_init)
+                            if field_trigger == "strobe":
+                                strobes.add(field_name)
+
+                    async def report_statistics():
+                        while True:
+                            await asyncio.sleep(args.trace_stats)
+                            target.analyzer.log_statistics(
+                                await target.analyzer.read_statistics(device))
+
+                    if args.trace_stats:
+                        stats_task = asyncio.ensure_future(report_statistics())
 
                     init = True
+                    trace_bytes = 0
                     while not trace_decoder.is_done():
-                        trace_decoder.process(await analyzer_iface.read())
-                        for cycle, events in trace_decoder.flush():
+                        trace_data = await analyzer_iface.read()
+                        trace_bytes += len(trace_data)
+                        trace_decoder.process(trace_data)
+                        timeline = trace_decoder.flush()
+                        if protocol_decoder:
+                            protocol_decoder.process(timeline)
+                            for record in protocol_decoder.flush():
+                                applet.logger.info("%s", format_record(record))
+
+                        for cycle, events in timeline:
+                            if trace_endpoint:
+                                trace_endpoint.send_events(cycle, events)
+
                             if events == "overrun":
                                 target.analyzer.logger.error("FIFO overrun, shutting down")
 
@@ -436,6 +536,8 @@ async def _main():
 
                             timestamp      = 1e9 * (cycle + 0) // target.sys_clk_freq
                             next_timestamp = 1e9 * (cycle + 1) // target.sys_clk_freq
+                            if not vcd_writer:
+                                continue
                             if init:
                                 init = False
                                 vcd_writer._timestamp = timestamp
@@ -446,7 +548,23 @@ async def _main():
                                     vcd_writer.change(signals[name], next_timestamp, "z")
                             vcd_writer.flush()
 
-                    vcd_writer.close(timestamp)
+                    if protocol_decoder:
+                        for record in protocol_decoder.flush(pending=True):
+                            applet.logger.info("%s", format_record(record))
+                    if vcd_writer:
+                        vcd_writer.close(timestamp)
+                    if trace_endpoint:
+                        trace_endpoint.send_done()
+                        await trace_endpoint.close()
+
+                    if args.trace_stats:
+                        stats_task.cancel()
+                    statistics = await target.analyzer.read_statistics(device)
+                    target.analyzer.log_statistics(statistics)
+                    duration = statistics["cycles"] / target.sys_clk_freq
+                    target.analyzer.logger.info("received %d trace bytes (%.1f bytes/s)",
+                                                trace_bytes,
+                                                trace_bytes / duration if duration else 0)
 
                 async def run_applet():
                     logger.info("running handler for applet %r", args.applet)
@@ -456,7 +574,7 @@ async def _main():
                     except GlasgowAppletError as e:
                         applet.logger.error(str(e))
                     finally:
-                        if args.trace:
+                        if tracing:
                             await device.write_register(target.analyzer.addr_done, 1)
 
                 done, pending = await asyncio.wait([run_analyzer(), run_applet()],
@@ -0,0 +1,189 @@
+import re
+import sys
+import asyncio
+import argparse
+from abc import ABCMeta, abstractmethod
+from bitarray import bitarray
+
+from ..protocol.trace_stream import TraceStreamDecoder
+from ..support.endpoint import endpoint
+
+
+__all__ = ["ProtocolDecoder", "format_record", "add_trace_argument", "decode_trace",
+           "SPIDecoder", "I2CDecoder", "UARTDecoder", "JTAGDecoder"]
+
+
+class ProtocolDecoder(metaclass=ABCMeta):
+    """
+    Base class for streaming protocol decoders.
+
+    A protocol decoder incrementally consumes an event timeline in the format produced by
+    :meth:`TraceDecoder.flush`, tracks the levels of the pins it is interested in, and produces
+    protocol-level records. Pins are looked up by the names they were registered with in
+    the analyzer (usually the applet pin names, e.g. ``sck``), which can be overridden with
+    ``pin_names``.
+
+    Records are ``(cycle, kind, fields)`` tuples, where ``fields`` is a dict.
+
+    :attr pins:
+        Names of the pins this decoder uses.
+    """
+    pins = ()
+
+    @classmethod
+    def add_arguments(cls, parser):
+        def pin_name(arg):
+            m = re.match(r"^([a-z0-9_]+)=(.+)$", arg)
+            if not m or m[1] not in cls.pins:
+                raise argparse.ArgumentTypeError("{!r} is not a valid pin assignment"
+                                                 .format(arg))
+            return (m[1], m[2])
+
+        parser.add_argument(
+            "--pin", metavar="PIN=NAME", dest="pin_names", type=pin_name,
+            action="append", default=[],
+            help="decode PIN (one of: {}) from the trace pin NAME"
+                 .format(" ".join(cls.pins)))
+
+    @classmethod
+    def from_arguments(cls, args, clock_freq, **kwargs):
+        return cls(clock_freq, pin_names=dict(args.pin_names), **kwargs)
+
+    def __init__(self, clock_freq, pin_names={}):
+        self.clock_freq = clock_freq
+        self.pin_names  = {pin: pin_names.get(pin, pin) for pin in self.pins}
+
+        self._fields  = {"{}-io".format(name): pin for pin, name in self.pin_names.items()}
+        self._levels  = {pin: None for pin in self.pins}
+        self._records = []
+        self.reset()
+
+    def reset(self):
+        """
+        Forget any partially decoded records. Called at the start of decoding, and whenever
+        the trace has a gap in it.
+        """
+
+    @abstractmethod
+    def _pins_changed(self, cycle, levels, prev_levels):
+        pass
+
+    def _flush_pending(self):
+        pass
+
+    def _emit(self, cycle, kind, **fields):
+        self._records.append((cycle, kind, fields))
+
+    def process(self, timeline):
+        """
+        Incrementally process a chunk of event timeline.
+        """
+        for cycle, events in timeline:
+            if events in ("overrun", "dropped"):
+                self.reset()
+                self._levels = {pin: None for pin in self.pins}
+                continue
+
+            prev_levels = None
+            for field_name, value in events.items():
+                pin = self._fields.get(field_name)
+                if pin is not None and self._levels[pin] != value:
+                    if prev_levels is None:
+                        prev_levels = dict(self._levels)
+                    self._levels[pin] = value
+            if prev_levels is not None:
+                self._pins_changed(cycle, self._levels, prev_levels)
+
+    def flush(self, pending=False):
+        """
+        Return records decoded since the start of decoding or the previous flush. If ``pending``
+        is ``True``, also complete records that are waiting for more events, assuming the pins
+        keep their current levels.
+        """
+        if pending:
+            self._flush_pending()
+        records, self._records = self._records, []
+        return records
+
+
+def format_record(record):
+    cycle, kind, fields = record
+    parts = [kind]
+    for name, value in fields.items():
+        if isinstance(value, (bytes, bytearray)):
+            value = "<{}>".format(value.hex())
+        elif isinstance(value, bitarray):
+            value = "<{}>".format(value.to01())
+        elif isinstance(value, int) and not isinstance(value, bool):
+            value = "{:#04x}".format(value)
+        parts.append("{}={}".format(name, value))
+    return "cycle {}: {}".format(cycle, " ".join(parts))
+
+
+def add_trace_argument(parser):
+    def trace_source(arg):
+        try:
+            return endpoint(arg)
+        except argparse.ArgumentTypeError:
+            return argparse.FileType("rb")(arg)
+
+    parser.add_argument(
+        "trace", metavar="TRACE", type=trace_source,
+        help="read trace stream from TRACE, which is either a file with a recorded trace stream, "
+             "or the unix:PATH or tcp:HOST:PORT endpoint of `run --trace-endpoint`")
+
+
+async def decode_trace(trace, decoder_factory, file=sys.stdout):
+    """
+    Read a trace stream from ``trace`` (a file or an endpoint tuple), decode it with
+    a protocol decoder created by ``decoder_factory(clock_freq)``, and print the records
+    to ``file``.
+    """
+    writer = None
+    if isinstance(trace, tuple):
+        proto, *proto_args = trace
+        if proto == "unix":
+            reader, writer = await asyncio.open_unix_connection(*proto_args)
+        elif proto == "tcp":
+            reader, writer = await asyncio.open_connection(*proto_args)
+        async def read():
+            return await reader.read(65536)
+    else:
+        async def read():
+            return trace.read(65536)
+
+    try:
+        stream_decoder   = TraceStreamDecoder()
+        protocol_decoder = None
+        while not stream_decoder.is_done():
+            data = await read()
+            if not data:
+                break
+            stream_decoder.process(data)
+            if protocol_decoder is None and stream_decoder.clock_freq is not None:
+                protocol_decoder = decoder_factory(stream_decoder.clock_freq)
+            if protocol_decoder is not None:
+                protocol_decoder.process(stream_decoder.flush())
+                for record in protocol_decoder.flush():
+                    print(format_record(record), file=file)
+
+        if protocol_decoder is not None:
+            for record in protocol_decoder.flush(pending=True):
+                print(format_record(record), file=file)
+
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _pin_timeline(pins, changes):
+    # Used by protocol decoder tests: every item in ``changes`` is a tuple of pin levels.
+    return [(cycle, {"{}-io".format(pin): level for pin, level in zip(pins, levels)})
+            for cycle, levels in enumerate(changes)]
+
+# -------------------------------------------------------------------------------------------------
+
+from .spi import SPIDecoder
+from .i2c import I2CDecoder
+from .uart import UARTDecoder
+from .jtag import JTAGDecoder
@@ -0,0 +1,85 @@
+from . import ProtocolDecoder, _pin_timeline
+
+
+__all__ = ["I2CDecoder"]
+
+
+class I2CDecoder(ProtocolDecoder):
+    """
+    I2C protocol decoder.
+
+    Emits ``start``, ``restart`` and ``stop`` records for bus conditions, an ``address`` record
+    with the 7-bit ``address``, the direction and the acknowledgement for the first byte of
+    every transaction, and a ``data`` record with the ``data`` byte and the acknowledgement
+    for every other byte.
+    """
+    pins = ("scl", "sda")
+
+    def reset(self):
+        self._state = "IDLE"
+        self._start = None
+        self._count = 0
+        self._shreg = 0
+
+    def _pins_changed(self, cycle, levels, prev_levels):
+        scl, sda = levels["scl"], levels["sda"]
+        if None in (scl, sda, prev_levels["scl"], prev_levels["sda"]):
+            return
+
+        if prev_levels["scl"] == 1 and scl == 1 and prev_levels["sda"] != sda:
+            if sda == 0:
+                self._emit(cycle, "start" if self._state == "IDLE" else "restart")
+                self._state = "ADDRESS"
+                self._count = 0
+                self._shreg = 0
+            else:
+                self._emit(cycle, "stop")
+                self._state = "IDLE"
+
+        elif prev_levels["scl"] == 0 and scl == 1 and self._state != "IDLE":
+            # Data is latched with the level it had just before the clock edge.
+            bit = prev_levels["sda"]
+            if self._count < 8:
+                if self._count == 0:
+                    self._start = cycle
+                self._shreg = (self._shreg << 1) | bit
+                self._count += 1
+            else:
+                if self._state == "ADDRESS":
+                    self._emit(self._start, "address", address=self._shreg >> 1,
+                               write=not self._shreg & 1, ack=not bit)
+                    self._state = "DATA"
+                else:
+                    self._emit(self._start, "data", data=self._shreg, ack=not bit)
+                self._count = 0
+                self._shreg = 0
+
+# -------------------------------------------------------------------------------------------------
+
+import unittest
+
+
+class I2CDecoderTestCase(unittest.TestCase):
+    def byte(self, data, ack):
+        changes = []
+        for bit in [(data >> n) & 1 for n in range(7, -1, -1)] + [0 if ack else 1]:
+            changes += [(0, bit), (1, bit), (0, bit)]
+        return changes
+
+    def test_transaction(self):
+        decoder = I2CDecoder(30e6, pin_names={"scl": "scl_io", "sda": "sda_io"})
+        changes  = [(1, 1), (1, 0)]
+        changes += self.byte(0x50 << 1, ack=True)
+        changes += self.byte(0xa5, ack=False)
+        changes += [(0, 1), (1, 1), (1, 0)]
+        changes += self.byte((0x50 << 1) | 1, ack=False)
+        changes += [(0, 0), (1, 0), (1, 1)]
+        decoder.process(_pin_timeline(("scl_io", "sda_io"), changes))
+        self.assertEqual(decoder.flush(), [
+            (1,  "start",   {}),
+            (3,  "address", {"address": 0x50, "write": True, "ack": True}),
+            (30, "data",    {"data": 0xa5, "ack": False}),
+            (58, "restart", {}),
+            (60, "address", {"address": 0x50, "write": False, "ack": False}),
+            (88, "stop",    {}),
+        ])
@@ -0,0 +1,115 @@
+from bitarray import bitarray
+
+from . import ProtocolDecoder, _pin_timeline
+from ..arch.jtag import TAP_STATES
+
+
+__all__ = ["JTAGDecoder"]
+
+
+class JTAGDecoder(ProtocolDecoder):
+    """
+    JTAG protocol decoder.
+
+    Follows the TAP controller state and emits an ``ir`` or ``dr`` record with the ``tdi``
+    and ``tdo`` bits (as little-endian bit arrays, first shifted bit first) for every IR or
+    DR scan, and a ``reset`` record whenever the TAP enters Test-Logic-Reset. Until the TAP
+    state is known, i.e. until the TAP is reset either with five TMS=1 clocks or with TRST#,
+    no other records are emitted.
+    """
+    pins = ("tck", "tms", "tdi", "tdo", "trst")
+
+    def reset(self):
+        self._state = None
+        self._ones  = 0
+        self._tdi   = bitarray(endian="little")
+        self._tdo   = bitarray(endian="little")
+        self._start = None
+
+    def _enter_reset(self, cycle):
+        if self._state != "RESET":
+            self._emit(cycle, "reset")
+        self._state = "RESET"
+
+    def _pins_changed(self, cycle, levels, prev_levels):
+        if levels["trst"] == 0:
+            self._enter_reset(cycle)
+            return
+
+        if prev_levels["tck"] == 0 and levels["tck"] == 1:
+            # Data is latched with the levels it had just before the clock edge.
+            tms, tdi, tdo = prev_levels["tms"], prev_levels["tdi"], prev_levels["tdo"]
+            if tms is None:
+                return
+
+            if self._state is None:
+                self._ones = self._ones + 1 if tms else 0
+                if self._ones == 5:
+                    self._enter_reset(cycle)
+                return
+
+            if self._state in ("IRSHIFT", "DRSHIFT"):
+                if self._start is None:
+                    self._start = cycle
+                self._tdi.append(bool(tdi))
+                self._tdo.append(bool(tdo))
+
+            next_state = TAP_STATES[self._state][tms]
+            if next_state == "RESET":
+                self._enter_reset(cycle)
+            self._state = next_state
+
+            if self._state in ("IRUPDATE", "DRUPDATE") and self._start is not None:
+                self._emit(self._start, self._state[:2].lower(),
+                           tdi=self._tdi,
+                           tdo=self._tdo if levels["tdo"] is not None else None)
+                self._start = None
+                self._tdi   = bitarray(endian="little")
+                self._tdo   = bitarray(endian="little")
+
+# -------------------------------------------------------------------------------------------------
+
+import unittest
+
+
+class JTAGDecoderTestCase(unittest.TestCase):
+    def clock(self, tms, tdi=0, tdo=0):
+        return [(0, tms, tdi, tdo), (1, tms, tdi, tdo)]
+
+    def test_scan(self):
+        decoder = JTAGDecoder(30e6)
+        changes  = [(1, 1, 0, 0)]
+        for _ in range(5):
+            changes += self.clock(1)
+        # RESET -> IDLE -> DRSELECT -> IRSELECT -> IRCAPTURE -> IRSHIFT
+        for tms in (0, 1, 1, 0, 0):
+            changes += self.clock(tms)
+        # Shift 4 bits of IR, exiting to IREXIT1 on the last one.
+        for n, (tdi, tdo) in enumerate(((1, 1), (0, 0), (0, 0), (1, 0))):
+            changes += self.clock(n == 3, tdi, tdo)
+        # IREXIT1 -> IRUPDATE -> DRSELECT -> DRCAPTURE -> DRSHIFT
+        for tms in (1, 1, 0, 0):
+            changes += self.clock(tms)
+        # Shift 2 bits of DR, pausing in between.
+        changes += self.clock(1, 1, 0)
+        for tms in (0, 1, 0):
+            changes += self.clock(tms)
+        changes += self.clock(1, 0, 1)
+        # DREXIT1 -> DRUPDATE -> IDLE
+        for tms in (1, 0):
+            changes += self.clock(tms)
+        decoder.process(_pin_timeline(("tck", "tms", "tdi", "tdo"), changes))
+        self.assertEqual(decoder.flush(), [
+            (10, "reset", {}),
+            (22, "ir", {"tdi": bitarray("1001"), "tdo": bitarray("1000")}),
+            (38, "dr", {"tdi": bitarray("10"),   "tdo": bitarray("01")}),
+        ])
+
+    def test_trst(self):
+        decoder = JTAGDecoder(30e6)
+        changes  = [(1, 1, 0, 0, 1), (1, 1, 0, 0, 0), (1, 1, 0, 0, 1)]
+        changes += [(0, 1, 0, 0, 1), (1, 1, 0, 0, 1)]
+        decoder.process(_pin_timeline(JTAGDecoder.pins, changes))
+        self.assertEqual(decoder.flush(), [
+            (1, "reset", {}),
+        ])
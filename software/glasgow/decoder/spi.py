@@ -0,0 +1,126 @@
+from . import ProtocolDecoder, _pin_timeline
+
+
+__all__ = ["SPIDecoder"]
+
+
+class SPIDecoder(ProtocolDecoder):
+    """
+    SPI protocol decoder.
+
+    Emits a ``transfer`` record with the ``mosi`` and ``miso`` bytes for every chip select
+    assertion, or for every byte if the trace does not include chip select. Bits are assumed
+    to be sent MSB first.
+    """
+    pins = ("sck", "ss", "mosi", "miso")
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            "--sck-edge", metavar="EDGE", type=str, choices=["r", "rising", "f", "falling"],
+            default="rising",
+            help="latch data at clock edge EDGE (default: %(default)s)")
+        parser.add_argument(
+            "--ss-active", metavar="LEVEL", type=int, choices=[0, 1], default=0,
+            help="active chip select level is LEVEL (default: %(default)s)")
+
+    @classmethod
+    def from_arguments(cls, args, clock_freq):
+        return super().from_arguments(args, clock_freq,
+                                      sck_edge=args.sck_edge, ss_active=args.ss_active)
+
+    def __init__(self, clock_freq, pin_names={}, sck_edge="rising", ss_active=0):
+        assert sck_edge in ("r", "rising", "f", "falling")
+        self._sck_latch = 1 if sck_edge in ("r", "rising") else 0
+        self._ss_active = ss_active
+        super().__init__(clock_freq, pin_names)
+
+    def reset(self):
+        self._start = None
+        self._count = 0
+        self._mosi  = bytearray()
+        self._miso  = bytearray()
+        self._shreg = {"mosi": 0, "miso": 0}
+
+    def _emit_transfer(self):
+        if self._start is not None and (self._mosi or self._miso):
+            self._emit(self._start, "transfer",
+                       mosi=bytes(self._mosi) if self._levels["mosi"] is not None else None,
+                       miso=bytes(self._miso) if self._levels["miso"] is not None else None)
+        self._start = None
+        self._count = 0
+        self._mosi.clear()
+        self._miso.clear()
+
+    def _pins_changed(self, cycle, levels, prev_levels):
+        if levels["ss"] != prev_levels["ss"]:
+            self._emit_transfer()
+            if levels["ss"] == self._ss_active:
+                self._start = cycle
+
+        selected = (levels["ss"] is None or levels["ss"] == self._ss_active)
+        if (selected and prev_levels["sck"] is not None and
+                levels["sck"] != prev_levels["sck"] and levels["sck"] == self._sck_latch):
+            if self._start is None:
+                self._start = cycle
+
+            # Data is latched with the levels it had just before the clock edge.
+            for pin in ("mosi", "miso"):
+                self._shreg[pin] = (self._shreg[pin] << 1) | (prev_levels[pin] or 0)
+            self._count += 1
+
+            if self._count % 8 == 0:
+                self._mosi.append(self._shreg["mosi"] & 0xff)
+                self._miso.append(self._shreg["miso"] & 0xff)
+                if levels["ss"] is None:
+                    self._emit_transfer()
+
+    def _flush_pending(self):
+        self._emit_transfer()
+
+# -------------------------------------------------------------------------------------------------
+
+import unittest
+
+
+class SPIDecoderTestCase(unittest.TestCase):
+    def bits(self, byte_mosi, byte_miso, ss=0):
+        changes = []
+        for bit in range(7, -1, -1):
+            mosi = (byte_mosi >> bit) & 1
+            miso = (byte_miso >> bit) & 1
+            changes.append((0, ss, mosi, miso))
+            changes.append((1, ss, mosi, miso))
+        return changes
+
+    def test_transfer(self):
+        decoder = SPIDecoder(30e6)
+        changes = [(0, 1, 0, 0)]
+        changes += self.bits(0xa5, 0x3c)
+        changes += self.bits(0x01, 0xff)
+        changes += [(0, 1, 0, 0)]
+        decoder.process(_pin_timeline(SPIDecoder.pins, changes))
+        self.assertEqual(decoder.flush(), [
+            (1, "transfer", {"mosi": b"\xa5\x01", "miso": b"\x3c\xff"}),
+        ])
+
+    def test_no_ss(self):
+        decoder = SPIDecoder(30e6)
+        changes = [(0, 0)] + [(sck, mosi) for sck, _, mosi, _ in self.bits(0x12, 0)] + \
+                  [(sck, mosi) for sck, _, mosi, _ in self.bits(0x34, 0)]
+        decoder.process(_pin_timeline(("sck", "mosi"), changes))
+        self.assertEqual(decoder.flush(), [
+            (2,  "transfer", {"mosi": b"\x12", "miso": None}),
+            (18, "transfer", {"mosi": b"\x34", "miso": None}),
+        ])
+
+    def test_falling_edge(self):
+        decoder = SPIDecoder(30e6, sck_edge="falling")
+        changes = [(1, 1, 0, 0)]
+        changes += [(1 - sck, ss, mosi, miso) for sck, ss, mosi, miso in self.bits(0xc3, 0x00)]
+        decoder.process(_pin_timeline(SPIDecoder.pins, changes))
+        self.assertEqual(decoder.flush(pending=True), [
+            (1, "transfer", {"mosi": b"\xc3", "miso": b"\x00"}),
+        ])
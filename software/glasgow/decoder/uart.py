@@ -0,0 +1,153 @@
+from . import ProtocolDecoder, _pin_timeline
+
+
+__all__ = ["UARTDecoder"]
+
+
+class UARTDecoder(ProtocolDecoder):
+    """
+    UART protocol decoder.
+
+    Emits an ``rx`` or ``tx`` record with the ``data`` byte for every frame received on
+    the corresponding pin. Frames with an invalid parity or stop bit additionally have
+    an ``error`` field. Only 8-bit frames with one stop bit are supported.
+    """
+    pins = ("rx", "tx")
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super().add_arguments(parser)
+
+        parser.add_argument(
+            "-b", "--baud", metavar="RATE", type=int, default=115200,
+            help="decode frames at RATE bits per second (default: %(default)s)")
+        parser.add_argument(
+            "--parity", metavar="PARITY", choices=("none", "zero", "one", "odd", "even"),
+            default="none",
+            help="expect parity bit as PARITY (default: %(default)s)")
+
+    @classmethod
+    def from_arguments(cls, args, clock_freq):
+        return super().from_arguments(args, clock_freq, baud=args.baud, parity=args.parity)
+
+    def __init__(self, clock_freq, pin_names={}, baud=115200, parity="none"):
+        assert parity in ("none", "zero", "one", "odd", "even")
+        self._bit_cyc = clock_freq / baud
+        self._parity  = parity
+        super().__init__(clock_freq, pin_names)
+
+    def reset(self):
+        # For every pin: the cycle at which the current frame started (or None), and the bits
+        # that were sampled so far, starting with the start bit.
+        self._frames = {pin: (None, []) for pin in self.pins}
+
+    def _frame_bits(self):
+        return 1 + 8 + (self._parity != "none") + 1
+
+    def _advance(self, pin, cycle, level):
+        # Sample, at the middle of every bit period that lies before `cycle`, the current
+        # frame on `pin` that had the level `level` throughout.
+        start, bits = self._frames[pin]
+        while start is not None:
+            sample_at = start + int((len(bits) + 0.5) * self._bit_cyc)
+            if cycle is not None and sample_at >= cycle:
+                break
+
+            bits.append(level)
+            if len(bits) == 1 and level != 0:
+                # A glitch rather than a start bit.
+                start, bits = None, []
+            elif len(bits) == self._frame_bits():
+                self._emit_frame(pin, start, bits)
+                start, bits = None, []
+        self._frames[pin] = (start, bits)
+
+    def _emit_frame(self, pin, start, bits):
+        data = sum(bit << n for n, bit in enumerate(bits[1:9]))
+        error = None
+        if self._parity != "none":
+            parity = bits[9]
+            if self._parity == "zero":
+                expected = 0
+            elif self._parity == "one":
+                expected = 1
+            elif self._parity == "odd":
+                expected = 1 - sum(bits[1:9]) % 2
+            elif self._parity == "even":
+                expected = sum(bits[1:9]) % 2
+            if parity != expected:
+                error = "parity"
+        if bits[-1] != 1:
+            error = "frame"
+
+        if error is None:
+            self._emit(start, pin, data=data)
+        else:
+            self._emit(start, pin, data=data, error=error)
+
+    def _pins_changed(self, cycle, levels, prev_levels):
+        for pin in self.pins:
+            if prev_levels[pin] is None:
+                continue
+
+            self._advance(pin, cycle, prev_levels[pin])
+            start, bits = self._frames[pin]
+            if start is None and prev_levels[pin] == 1 and levels[pin] == 0:
+                self._frames[pin] = (cycle, [])
+
+    def _flush_pending(self):
+        for pin in self.pins:
+            if self._levels[pin] is not None:
+                self._advance(pin, None, self._levels[pin])
+
+# -------------------------------------------------------------------------------------------------
+
+import unittest
+
+
+class UARTDecoderTestCase(unittest.TestCase):
+    def frame(self, data, bit_cyc, parity=None, stop=1):
+        bits = [0] + [(data >> n) & 1 for n in range(8)]
+        if parity is not None:
+            bits.append(parity)
+        bits.append(stop)
+        changes = []
+        for bit in bits:
+            changes += [(bit,)] * bit_cyc
+        return changes
+
+    def test_frames(self):
+        decoder = UARTDecoder(30e6, baud=30e6 / 4)
+        changes  = [(1,)] * 3
+        changes += self.frame(0x55, bit_cyc=4)
+        changes += self.frame(0xf0, bit_cyc=4)
+        changes += [(1,)] * 3
+        decoder.process(_pin_timeline(("tx",), changes))
+        self.assertEqual(decoder.flush(pending=True), [
+            (3,  "tx", {"data": 0x55}),
+            (43, "tx", {"data": 0xf0}),
+        ])
+
+    def test_pending(self):
+        decoder = UARTDecoder(30e6, baud=30e6 / 4)
+        changes  = [(1,)]
+        changes += self.frame(0xff, bit_cyc=4)
+        decoder.process(_pin_timeline(("rx",), changes))
+        self.assertEqual(decoder.flush(), [])
+        self.assertEqual(decoder.flush(pending=True), [
+            (1,  "rx", {"data": 0xff}),
+        ])
+
+    def test_errors(self):
+        decoder = UARTDecoder(30e6, baud=30e6 / 4, parity="odd")
+        changes  = [(1,)]
+        changes += self.frame(0x01, bit_cyc=4, parity=0)
+        changes += self.frame(0x01, bit_cyc=4, parity=1)
+        changes += self.frame(0x03, bit_cyc=4, parity=1, stop=0)
+        changes += [(1,)] * 8
+        decoder.process(_pin_timeline(("rx",), changes))
+        self.assertEqual(decoder.flush(), [
+            (1,  "rx", {"data": 0x01}),
+            (45, "rx", {"data": 0x01, "error": "parity"}),
+            (89, "rx", {"data": 0x03, "error": "frame"}),
+        ])
@@ -20,6 +20,7 @@ SPECIAL_DONE        =   0b000000
 SPECIAL_OVERRUN     =   0b000001
 SPECIAL_THROTTLE    =   0b000010
 SPECIAL_DETHROTTLE  =   0b000011
+SPECIAL_HEARTBEAT   =   0b000100
 
 
 class EventSource(Module):
@@ -36,6 +37,9 @@ class EventSource(Module):
         self.data    = Signal(max(1, width))
         self.trigger = Signal()
 
+        self.event_count = Signal(32)
+        self.peak_level  = Signal(16)
+
 
 class EventAnalyzer(Module):
     """
@@ -58,6 +62,19 @@ class EventAnalyzer(Module):
     only cycles that have at least one event add new FIFO entries, and only one wide timestamp
     counter needs to be maintained, greatly reducing the amount of necessary resources compared
     to a more naive approach.
+
+    The event analyzer also collects statistics that help diagnose throttling and overruns, and
+    choose FIFO depths. The statistics are: the number of events and the peak data FIFO level for
+    every event source, peak event and delay FIFO levels, the total number of cycles and
+    the number of throttled cycles since reset, and the cycle at which the overrun was first
+    detected. Event and cycle counters saturate instead of wrapping around.
+
+    Delays between events are accumulated in a counter ``7 * delay_septets`` bits wide and
+    reported as that many septets at most. Idle time does not produce any output until the next
+    event, unless the accumulated delay reaches ``heartbeat_cyc`` cycles (or approaches
+    the counter capacity), in which case a heartbeat is reported. Heartbeats are only checked
+    every ``2 ** delay_width`` idle cycles, so ``heartbeat_cyc`` is rounded up to that; a wider
+    delay timer is cheaper to drain during long idle periods, but requires a wider delay FIFO.
     """
 
     @staticmethod
@@ -73,16 +90,25 @@ class EventAnalyzer(Module):
         else:
             return 256
 
-    def __init__(self, output_fifo, event_depth=None, delay_width=16):
+    def __init__(self, output_fifo, event_depth=None, delay_width=16, delay_septets=5,
+                 heartbeat_cyc=None):
         assert output_fifo.width == 8
 
         self.output_fifo   = output_fifo
         self.delay_width   = delay_width
+        self.delay_septets = delay_septets
+        self.heartbeat_cyc = heartbeat_cyc
         self.event_depth   = event_depth
         self.event_sources = Array()
         self.done          = Signal()
         self.throttle      = Signal()
-        self.overrun      = Signal()
+        self.overrun       = Signal()
+
+        self.cycle_count      = Signal(48)
+        self.throttle_count   = Signal(48)
+        self.overrun_cycle    = Signal(48)
+        self.event_peak_level = Signal(16)
+        self.delay_peak_level = Signal(16)
 
     def add_event_source(self, name, kind, width, fields=(), depth=None):
         if depth is None:
@@ -95,6 +121,8 @@ class EventAnalyzer(Module):
     def do_finalize(self):
         assert len(self.event_sources) < 2 ** 6
         assert max(s.width for s in self.event_sources) <= 32
+        # The delay counter must be able to absorb at least one full delay timer period.
+        assert 7 * self.delay_septets > self.delay_width + 1
 
         # Fill the event, event data, and delay FIFOs.
         throttle_on    = Signal()
@@ -185,6 +213,39 @@ class EventAnalyzer(Module):
                  for f in throttle_fifos)))
         ]
 
+        # Collect statistics.
+        def saturating_increment(counter):
+            return If(counter != (1 << len(counter)) - 1,
+                counter.eq(counter + 1)
+            )
+
+        def track_peak(peak, level):
+            return If(level > peak,
+                peak.eq(level)
+            )
+
+        self.sync += [
+            saturating_increment(self.cycle_count),
+            If(self.throttle,
+                saturating_increment(self.throttle_count)
+            ),
+            If(overrun_trip & ~self.overrun,
+                self.overrun_cycle.eq(self.cycle_count)
+            ),
+            track_peak(self.event_peak_level, event_fifo.level),
+            track_peak(self.delay_peak_level, delay_fifo.level),
+        ]
+        for event_source in self.event_sources:
+            self.sync += [
+                If(event_source.trigger,
+                    saturating_increment(event_source.event_count)
+                ),
+            ]
+            if event_source.width > 0:
+                self.sync += [
+                    track_peak(event_source.peak_level, event_source.data_fifo.level)
+                ]
+
         # Dequeue events, and serialize events and event data.
         self.submodules.event_encoder = event_encoder = \
             PriorityEncoder(width=len(self.event_sources))
@@ -196,15 +257,25 @@ class EventAnalyzer(Module):
         rep_overrun      = Signal()
         rep_throttle_new = Signal()
         rep_throttle_cur = Signal()
-        delay_septets = 5
+        rep_heartbeat    = Signal()
+        delay_septets = self.delay_septets
         delay_counter = Signal(7 * delay_septets)
+        delay_next    = Signal.like(delay_counter)
+        # Report the delay before adding another delay timer period could overflow the counter.
+        delay_report  = 128 ** delay_septets - 2 ** self.delay_width - 1
+        if self.heartbeat_cyc is not None:
+            delay_report = min(delay_report, self.heartbeat_cyc)
+        self.comb += delay_next.eq(delay_counter + delay_fifo.dout + 1)
         serializer.act("WAIT-EVENT",
             If(delay_fifo.readable,
                 delay_fifo.re.eq(1),
-                NextValue(delay_counter, delay_counter + delay_fifo.dout + 1),
+                NextValue(delay_counter, delay_next),
                 If(delay_fifo.dout == delay_ovrun,
                     NextValue(rep_overrun, 1),
                     NextState("REPORT-DELAY")
+                ).Elif(delay_next >= delay_report,
+                    NextValue(rep_heartbeat, 1),
+                    NextState("REPORT-DELAY")
                 )
             ),
             If(event_fifo.readable,
@@ -218,23 +289,23 @@ class EventAnalyzer(Module):
                 NextState("REPORT-DELAY")
             )
         )
+        delay_length = [NextState("REPORT-DELAY-1")]
+        for septet_no in range(2, delay_septets + 1):
+            delay_length = [
+                If(delay_counter >= 128 ** (septet_no - 1),
+                    NextState("REPORT-DELAY-%d" % septet_no)
+                ).Else(
+                    *delay_length
+                )
+            ]
         serializer.act("REPORT-DELAY",
-            If(delay_counter >= 128 ** 4,
-                NextState("REPORT-DELAY-5")
-            ).Elif(delay_counter >= 128 ** 3,
-                NextState("REPORT-DELAY-4")
-            ).Elif(delay_counter >= 128 ** 2,
-                NextState("REPORT-DELAY-3")
-            ).Elif(delay_counter >= 128 ** 1,
-                NextState("REPORT-DELAY-2")
-            ).Else(
-                NextState("REPORT-DELAY-1")
-            )
+            *delay_length
         )
         for septet_no in range(delay_septets, 0, -1):
             if septet_no == 1:
                 next_state = [
                     NextValue(delay_counter, 0),
+                    NextValue(rep_heartbeat, 0),
                     If(rep_overrun,
                         NextState("REPORT-OVERRUN")
                     ).Elif(rep_throttle_cur != rep_throttle_new,
@@ -243,6 +314,8 @@ class EventAnalyzer(Module):
                         NextState("REPORT-EVENT")
                     ).Elif(self.done,
                         NextState("REPORT-DONE")
+                    ).Elif(rep_heartbeat,
+                        NextState("REPORT-HEARTBEAT")
                     ).Else(
                         NextState("WAIT-EVENT")
                     )
@@ -259,6 +332,13 @@ class EventAnalyzer(Module):
                     *next_state
                 )
             )
+        serializer.act("REPORT-HEARTBEAT",
+            If(self.output_fifo.writable,
+                self.output_fifo.din.eq(REPORT_SPECIAL | SPECIAL_HEARTBEAT),
+                self.output_fifo.we.eq(1),
+                NextState("WAIT-EVENT")
+            )
+        )
         serializer.act("REPORT-THROTTLE",
             If(self.output_fifo.writable,
                 NextValue(rep_throttle_cur, rep_throttle_new),
@@ -355,7 +435,7 @@ class TraceDecoder:
     Event analyzer trace decoder.
 
     Decodes raw analyzer traces into a timestamped sequence of maps from event fields to
-    their values.
+    their values. Heartbeats are decoded as empty maps.
     """
     def __init__(self, event_sources, absolute_timestamps=True):
         self.event_sources       = event_sources
@@ -424,6 +504,11 @@ class TraceDecoder:
                 elif special == SPECIAL_DETHROTTLE:
                     self._pending["throttle"] = 0
 
+            elif self._state == "DELAY" and is_special and special == SPECIAL_HEARTBEAT:
+                self._flush_timestamp()
+                self._timeline.append((self._timestamp, OrderedDict()))
+                self._state = "IDLE"
+
             elif self._state in ("IDLE", "DELAY") and is_event:
                 self._flush_timestamp()
 
@@ -535,7 +620,9 @@ class EventAnalyzerTestCase(unittest.TestCase):
     def setUp(self):
         self.tb = EventAnalyzerTestbench(event_depth=16)
 
-    def configure(self, tb, sources):
+    def configure(self, tb, sources, **kwargs):
+        if kwargs:
+            self.tb = tb = EventAnalyzerTestbench(event_depth=16, **kwargs)
         for n, args in enumerate(sources):
             if not isinstance(args, tuple):
                 args = (args,)
@@ -793,6 +880,39 @@ class EventAnalyzerTestCase(unittest.TestCase):
             (0xffff * 64 + 1, {"0": 0b1}),
         ])
 
+    @simulation_test(sources=(1,), delay_width=4, delay_septets=2, heartbeat_cyc=140)
+    def test_heartbeat(self, tb):
+        for _ in range(160):
+            yield
+        yield from tb.trigger(0, 1)
+        yield from tb.step()
+        yield from self.assertEmitted(tb, [
+            REPORT_DELAY|0b0000001,
+            REPORT_DELAY|0b0010110,
+            REPORT_SPECIAL|SPECIAL_HEARTBEAT,
+            REPORT_DELAY|12,
+            REPORT_EVENT|0, 0b1
+        ], [
+            (150, {}),
+            (162, {"0": 0b1}),
+        ])
+
+    @simulation_test(sources=(1,), delay_width=4, delay_septets=1)
+    def test_delay_limit(self, tb):
+        for _ in range(128):
+            yield
+        yield from tb.trigger(0, 1)
+        yield from tb.step()
+        yield from self.assertEmitted(tb, [
+            REPORT_DELAY|120,
+            REPORT_SPECIAL|SPECIAL_HEARTBEAT,
+            REPORT_DELAY|10,
+            REPORT_EVENT|0, 0b1
+        ], [
+            (120, {}),
+            (130, {"0": 0b1}),
+        ])
+
     @simulation_test(sources=(1,))
     def test_done(self, tb):
         yield from tb.trigger(0, 1)
@@ -825,6 +945,23 @@ class EventAnalyzerTestCase(unittest.TestCase):
         yield
         self.assertEqual((yield tb.dut.throttle), 0)
 
+    @simulation_test(sources=(8, 0))
+    def test_statistics(self, tb):
+        yield from tb.trigger(0, 0xaa)
+        yield from tb.step()
+        yield from tb.trigger(0, 0xbb)
+        yield from tb.trigger(1, 0)
+        yield from tb.step()
+        yield
+        self.assertEqual((yield tb.dut.event_sources[0].event_count), 2)
+        self.assertEqual((yield tb.dut.event_sources[1].event_count), 1)
+        self.assertEqual((yield tb.dut.event_sources[0].peak_level), 1)
+        self.assertEqual((yield tb.dut.event_sources[1].peak_level), 0)
+        self.assertEqual((yield tb.dut.event_peak_level), 1)
+        self.assertEqual((yield tb.dut.delay_peak_level), 1)
+        self.assertEqual((yield tb.dut.cycle_count), 3)
+        self.assertEqual((yield tb.dut.throttle_count), 0)
+
     @simulation_test(sources=(1,))
     def test_overrun(self, tb):
         for x in range(20):
@@ -834,6 +971,8 @@ class EventAnalyzerTestCase(unittest.TestCase):
         yield from tb.trigger(0, 1)
         yield from tb.step()
         self.assertEqual((yield tb.dut.overrun), 1)
+        self.assertEqual((yield tb.dut.overrun_cycle), 20)
+        self.assertNotEqual((yield tb.dut.throttle_count), 0)
         yield tb.fifo.re.eq(1)
         for x in range(61):
             while not (yield tb.fifo.readable):
@@ -841,6 +980,7 @@ class EventAnalyzerTestCase(unittest.TestCase):
             yield
         yield tb.fifo.re.eq(0)
         yield
+        self.assertEqual((yield tb.dut.event_sources[0].event_count), 21)
         yield from self.assertEmitted(tb, [
             REPORT_DELAY|0b0000100,
             REPORT_DELAY|0b0000000,
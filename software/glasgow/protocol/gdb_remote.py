@@ -9,6 +9,19 @@ from ..applet import GlasgowAppletError
 __all__ = ["GDBRemote"]
 
 
+# The largest packet the debugger may send; large packets make loading memory contents faster.
+_MAX_PACKET_SIZE = 0x4000
+
+
+def _escape(data):
+    # Binary data in packets has the special characters escaped with "}" and XOR 0x20.
+    return re.sub(rb"[#$}*]", lambda m: bytes([0x7d, m[0][0] ^ 0x20]), data)
+
+
+def _unescape(data):
+    return re.sub(rb"}(.)", lambda m: bytes([m[1][0] ^ 0x20]), data, flags=re.S)
+
+
 class GDBRemote(metaclass=ABCMeta):
     @abstractmethod
     def gdb_log(self, level, message, *args):
@@ -90,9 +103,49 @@ class GDBRemote(metaclass=ABCMeta):
     async def target_clear_instr_breakpt(self, address):
         pass
 
-    async def gdb_run(self, endpoint):
+    def target_memory_map(self):
+        """
+        Return the memory map of the target as a list of ``(kind, address, length, block_size)``
+        tuples, where ``kind`` is ``"ram"``, ``"rom"`` or ``"flash"``, and ``block_size`` is
+        the erase block size for flash memory, or ``None`` if the memory map is not known.
+
+        The debugger uses the ``target_flash_*`` methods to write to flash memory.
+        """
+        return None
+
+    async def target_flash_erase(self, address, length):
+        raise GlasgowAppletError("erasing flash memory is not supported")
+
+    async def target_flash_write(self, address, data):
+        raise GlasgowAppletError("writing flash memory is not supported")
+
+    async def target_flash_done(self):
+        pass
+
+    async def gdb_run(self, endpoint, cache_page_size=64):
+        """
+        Serve GDB remote protocol requests from ``endpoint``.
+
+        While the target is stopped, register values and memory contents are cached. Memory is
+        read from the target in ``cache_page_size`` byte pages, but only within the regions that
+        :meth:`target_memory_map` reports as RAM, since reading anything else may have side
+        effects; if ``cache_page_size`` is 0, memory is not cached. Writes go to the target,
+        and update the cached data they affect; the whole cache is invalidated whenever
+        the target runs.
+        """
         self.__non_stop = False
 
+        self.__cache_page_size = cache_page_size
+        self.__cache_regions   = [(address, length)
+                                  for kind, address, length, _ in self.target_memory_map() or []
+                                  if kind == "ram"]
+        self.__cache_stats     = {"register": [0, 0], "memory page": [0, 0]}
+        self.__register_cache  = {}
+        self.__memory_cache    = {}
+
+        self.__packet_count = 0
+        self.__packet_bytes = 0
+
         try:
             no_ack_mode = False
 
@@ -114,15 +167,18 @@ class GDBRemote(metaclass=ABCMeta):
                     checksum = -1
                 if sum(command) & 0xff != checksum:
                     self.gdb_log(logging.ERROR, "invalid checksum for command '%s'", command)
+                self.__packet_count += 1
+                self.__packet_bytes += len(command)
                 if not no_ack_mode:
                     await endpoint.send(b"+")
 
-                command_asc = command.decode("ascii", errors="replace")
+                command_asc = command.decode("ascii", errors="backslashreplace")
                 self.gdb_log(logging.DEBUG, "recv '%s'", command_asc)
 
                 if command == b"QStartNoAckMode":
                     no_ack_mode = True
                     response = b"OK"
+                    command_failed = False
                 else:
                     try:
                         response = await self._gdb_process(command, lambda: endpoint.recv_wait())
@@ -143,7 +199,7 @@ class GDBRemote(metaclass=ABCMeta):
                     response = response[0:3]
 
                 while True:
-                    response_asc = response.decode("ascii", errors="replace")
+                    response_asc = response.decode("ascii", errors="backslashreplace")
                     self.gdb_log(logging.DEBUG, "send '%s'", response_asc)
 
                     await endpoint.send(b"$%s#%02x" % (response, sum(response) & 0xff))
@@ -170,7 +226,166 @@ class GDBRemote(metaclass=ABCMeta):
         except asyncio.CancelledError:
             pass
 
+        finally:
+            self.__invalidate_cache()
+            self.gdb_log(logging.DEBUG, "received %d packets, %d bytes",
+                         self.__packet_count, self.__packet_bytes)
+
+    def __invalidate_cache(self, registers=True, memory=True):
+        if registers:
+            self.__register_cache = {}
+        if memory:
+            self.__memory_cache = {}
+        if registers and memory:
+            for kind, (hits, misses) in self.__cache_stats.items():
+                if hits + misses > 0:
+                    self.gdb_log(logging.DEBUG, "cache: %d %s reads, %d%% hits",
+                                 hits + misses, kind, 100 * hits // (hits + misses))
+
+    def __count_cache(self, kind, hits, misses):
+        self.__cache_stats[kind][0] += hits
+        self.__cache_stats[kind][1] += misses
+
+    async def __get_registers(self):
+        numbers = range(len(self.target_register_names()))
+        if all(number in self.__register_cache for number in numbers):
+            self.__count_cache("register", 1, 0)
+        else:
+            self.__count_cache("register", 0, 1)
+            self.__register_cache = dict(enumerate(await self.target_get_registers()))
+        return [self.__register_cache[number] for number in numbers]
+
+    async def __get_register(self, number):
+        if number in self.__register_cache:
+            self.__count_cache("register", 1, 0)
+        else:
+            self.__count_cache("register", 0, 1)
+            self.__register_cache[number] = await self.target_get_register(number)
+        return self.__register_cache[number]
+
+    def __cached_pages(self, address, length):
+        page_size = self.__cache_page_size
+        return range(address // page_size * page_size, address + length, page_size)
+
+    def __cacheable_page(self, page):
+        return any(region_beg <= page and page + self.__cache_page_size <= region_beg + length
+                   for region_beg, length in self.__cache_regions)
+
+    async def __read_pages(self, pages):
+        missing = [page for page in pages if page not in self.__memory_cache]
+        self.__count_cache("memory page", len(pages) - len(missing), len(missing))
+        # Consecutive missing pages are read from the target all at once.
+        while missing:
+            count = 1
+            while count < len(missing) and \
+                    missing[count] == missing[0] + count * self.__cache_page_size:
+                count += 1
+            data = await self.target_read_memory(missing[0], count * self.__cache_page_size)
+            for index, page in enumerate(missing[:count]):
+                offset = index * self.__cache_page_size
+                self.__memory_cache[page] = bytearray(data[offset:offset + self.__cache_page_size])
+            missing = missing[count:]
+        return b"".join(self.__memory_cache[page] for page in pages)
+
+    async def __read_memory(self, address, length):
+        if not self.__cache_page_size or length == 0 or self.target_running():
+            return await self.target_read_memory(address, length)
+
+        # Cacheable pages are read whole, and the rest of the range exactly as requested; both
+        # are read in as few target accesses as possible.
+        end  = address + length
+        data = bytearray()
+        pages = list(self.__cached_pages(address, length))
+        while pages:
+            cacheable = self.__cacheable_page(pages[0])
+            count = 1
+            while count < len(pages) and self.__cacheable_page(pages[count]) == cacheable:
+                count += 1
+            run_beg = max(address, pages[0])
+            run_end = min(end, pages[count - 1] + self.__cache_page_size)
+            if cacheable:
+                run_data = await self.__read_pages(pages[:count])
+                data += run_data[run_beg - pages[0]:run_end - pages[0]]
+            else:
+                data += await self.target_read_memory(run_beg, run_end - run_beg)
+            pages = pages[count:]
+        return bytes(data)
+
+    async def __write_memory(self, address, data):
+        await self.target_write_memory(address, data)
+        if self.__cache_page_size:
+            end = address + len(data)
+            for page in self.__cached_pages(address, len(data)):
+                if page in self.__memory_cache:
+                    beg, page_end = max(address, page), min(end, page + self.__cache_page_size)
+                    self.__memory_cache[page][beg - page:page_end - page] = \
+                        data[beg - address:page_end - address]
+
+    def __memory_map_xml(self):
+        memory_map = self.target_memory_map()
+        if memory_map is None:
+            return None
+
+        xml = ['<?xml version="1.0"?>',
+               '<!DOCTYPE memory-map PUBLIC "+//IDN gnu.org//DTD GDB Memory Map V1.0//EN" '
+               '"http://sourceware.org/gdb/gdb-memory-map.dtd">',
+               '<memory-map>']
+        for kind, address, length, block_size in memory_map:
+            if block_size is None:
+                xml.append('<memory type="%s" start="%#x" length="%#x"/>'
+                           % (kind, address, length))
+            else:
+                xml.append('<memory type="%s" start="%#x" length="%#x">'
+                           '<property name="blocksize">%#x</property></memory>'
+                           % (kind, address, length, block_size))
+        xml.append('</memory-map>')
+        return "\n".join(xml).encode("ascii")
+
+    async def __continue(self, make_recv_fut):
+        self.__invalidate_cache()
+        continue_fut  = asyncio.ensure_future(self.target_continue())
+        interrupt_fut = asyncio.ensure_future(make_recv_fut())
+        await asyncio.wait([continue_fut, interrupt_fut], return_when=asyncio.FIRST_COMPLETED)
+        if interrupt_fut.done():
+            await interrupt_fut
+        else:
+            interrupt_fut.cancel()
+        if continue_fut.done():
+            await continue_fut
+        else:
+            continue_fut.cancel()
+            await self.target_stop()
+        return b"S05"
+
+    async def __single_step(self):
+        self.__invalidate_cache()
+        await self.target_single_step()
+        return b"S05"
+
     async def _gdb_process(self, command, make_recv_fut):
+        # "Which protocol features does the stub support?"
+        if command.startswith(b"qSupported"):
+            features = [
+                b"PacketSize=%x" % _MAX_PACKET_SIZE,
+                b"QStartNoAckMode+",
+                b"vContSupported+",
+            ]
+            if self.target_memory_map() is not None:
+                features.append(b"qXfer:memory-map:read+")
+            return b";".join(features)
+
+        # "Read the target memory map, starting at offset."
+        if command.startswith(b"qXfer:memory-map:read::"):
+            memory_map = self.__memory_map_xml()
+            if memory_map is None:
+                return b"E00;memory map not available"
+            offset, length = map(lambda x: int(x, 16), command[23:].split(b","))
+            chunk = memory_map[offset:offset + length]
+            if offset + len(chunk) < len(memory_map):
+                return b"m" + _escape(chunk)
+            else:
+                return b"l" + _escape(chunk)
+
         # (lldb) "What are the properties of machine the target is running on?"
         if command == b"qHostInfo":
             info = [
@@ -198,6 +413,7 @@ class GDBRemote(metaclass=ABCMeta):
             #
             # So, we only stop the target when we positively have to have it stopped.
             if self.target_running():
+                self.__invalidate_cache()
                 await self.target_stop()
 
             # "Target caught signal SIGTRAP."
@@ -205,34 +421,37 @@ class GDBRemote(metaclass=ABCMeta):
 
         # "Resume target."
         if command == b"c":
-            continue_fut  = asyncio.ensure_future(self.target_continue())
-            interrupt_fut = asyncio.ensure_future(make_recv_fut())
-            await asyncio.wait([continue_fut, interrupt_fut], return_when=asyncio.FIRST_COMPLETED)
-            if interrupt_fut.done():
-                await interrupt_fut
-            else:
-                interrupt_fut.cancel()
-            if continue_fut.done():
-                await continue_fut
-            else:
-                continue_fut.cancel()
-                await self.target_stop()
-            return b"S05"
+            return await self.__continue(make_recv_fut)
 
         # "Single-step target [but first jump to this address]."
         if command == b"s":
-            await self.target_single_step()
-            return b"S05"
+            return await self.__single_step()
+
+        # "Which actions does vCont support?"
+        if command == b"vCont?":
+            return b"vCont;c;C;s;S"
+
+        # "Resume target, with an action for every thread." There is only one thread, so only
+        # the first action is relevant, and signals are ignored.
+        if command.startswith(b"vCont;"):
+            action = command[6:].split(b";")[0].split(b":")[0]
+            if action[:1] in (b"c", b"C"):
+                return await self.__continue(make_recv_fut)
+            elif action[:1] in (b"s", b"S"):
+                return await self.__single_step()
+            else:
+                return b"E00;unsupported vCont action"
 
         # "Detach from target."
         if command == b"D":
+            self.__invalidate_cache()
             await self.target_detach()
             return b"OK"
 
         # "Get all registers of the target."
         if command == b"g":
             values = bytearray()
-            for register in await self.target_get_registers():
+            for register in await self.__get_registers():
                 if register is None:
                     values += b"xx" * self.target_word_size()
                 else:
@@ -243,7 +462,7 @@ class GDBRemote(metaclass=ABCMeta):
         if command.startswith(b"p"):
             number = int(command[1:], 16)
             if number < len(self.target_register_names()):
-                value  = await self.target_get_register(number)
+                value  = await self.__get_register(number)
                 return b"%.*x" % (self.target_word_size() * 2, value)
             else:
                 return b"E00;unrecognized register"
@@ -253,15 +472,18 @@ class GDBRemote(metaclass=ABCMeta):
             values = command[1:]
             registers = []
             while values:
-                registers.append(int(values[:self.target_word_size() * 2]))
+                registers.append(int(values[:self.target_word_size() * 2], 16))
                 values = values[self.target_word_size() * 2:]
             await self.target_set_registers(registers)
+            self.__register_cache = dict(enumerate(registers))
+            return b"OK"
 
         # "Set specific register of the target."
         if command.startswith(b"P"):
             number, value = map(lambda x: int(x, 16), command[1:].split(b"="))
             if number < len(self.target_register_names()):
                 await self.target_set_register(number, value)
+                self.__register_cache[number] = value
                 return b"OK"
             else:
                 return b"E00;unrecognized register"
@@ -269,16 +491,52 @@ class GDBRemote(metaclass=ABCMeta):
         # "Read specified memory range of the target."
         if command.startswith(b"m"):
             address, length = map(lambda x: int(x, 16), command[1:].split(b","))
-            data = await self.target_read_memory(address, length)
+            data = await self.__read_memory(address, length)
             return data.hex().encode("ascii")
 
         # "Write specified memory range of the target."
         if command.startswith(b"M"):
             location, data = command[1:].split(b":")
             address, _length = map(lambda x: int(x, 16), location.split(b","))
-            await self.target_write_memory(address, bytes.fromhex(data.decode("ascii")))
+            await self.__write_memory(address, bytes.fromhex(data.decode("ascii")))
+            return b"OK"
+
+        # "Write specified memory range of the target, with binary data."
+        if command.startswith(b"X"):
+            location, data = command[1:].split(b":", 1)
+            address, length = map(lambda x: int(x, 16), location.split(b","))
+            data = _unescape(data)
+            if len(data) != length:
+                return b"E00;data length mismatch"
+            # A zero length write is used to check whether the packet is supported.
+            if length > 0:
+                await self.__write_memory(address, data)
+            return b"OK"
+
+        # "Erase specified flash memory range of the target."
+        if command.startswith(b"vFlashErase:"):
+            address, length = map(lambda x: int(x, 16), command[12:].split(b","))
+            self.__invalidate_cache(registers=False)
+            await self.target_flash_erase(address, length)
             return b"OK"
 
+        # "Write specified flash memory range of the target."
+        if command.startswith(b"vFlashWrite:"):
+            address, data = command[12:].split(b":", 1)
+            address = int(address, 16)
+            self.__invalidate_cache(registers=False)
+            await self.target_flash_write(address, _unescape(data))
+            return b"OK"
+
+        # "Finish writing flash memory."
+        if command == b"vFlashDone":
+            await self.target_flash_done()
+            return b"OK"
+
+        # Breakpoints may be implemented by changing memory contents.
+        if command.startswith((b"Z", b"z")):
+            self.__invalidate_cache(registers=False)
+
         if command.startswith(b"Z0"):
             address, _kind = map(lambda x: int(x, 16), command[3:].split(b","))
             if await self.target_set_software_breakpt(address):
@@ -308,3 +566,148 @@ class GDBRemote(metaclass=ABCMeta):
                 return b"E00;hardware breakpoint not set"
 
         return b""
+
+# -------------------------------------------------------------------------------------------------
+
+import unittest
+
+
+class _MockEndpoint:
+    def __init__(self, commands):
+        self.data = bytearray(b"".join(b"$%s#%02x" % (command, sum(command) & 0xff)
+                                       for command in [b"QStartNoAckMode", *commands]))
+        self.responses = []
+
+    async def recv(self, length):
+        if not self.data:
+            raise asyncio.CancelledError
+        data, self.data = bytes(self.data[:length]), self.data[length:]
+        return data
+
+    async def recv_until(self, separator):
+        return (await self.recv(self.data.index(separator) + 1))[:-1]
+
+    async def send(self, data):
+        if data.startswith(b"$"):
+            self.responses.append(data[1:-3])
+
+    async def close(self):
+        pass
+
+
+class _MockGDBTarget(GDBRemote):
+    # 4 KiB of memory, of which the first half is RAM, and the second half is not in
+    # the memory map.
+    def __init__(self):
+        self.memory    = bytearray(range(256)) * 16
+        self.registers = [0x10 * number for number in range(4)]
+        self.accesses  = []
+
+    def gdb_log(self, level, message, *args):
+        pass
+
+    def target_word_size(self):
+        return 4
+
+    def target_endianness(self):
+        return "little"
+
+    def target_triple(self):
+        return "mock"
+
+    def target_register_names(self):
+        return ["r0", "r1", "r2", "r3"]
+
+    def target_running(self):
+        return False
+
+    def target_memory_map(self):
+        return [("ram", 0x0000, 0x0800, None)]
+
+    async def target_stop(self):
+        pass
+
+    async def target_continue(self):
+        pass
+
+    async def target_single_step(self):
+        self.accesses.append(("step",))
+
+    async def target_detach(self):
+        pass
+
+    async def target_get_registers(self):
+        self.accesses.append(("get_registers",))
+        return list(self.registers)
+
+    async def target_set_registers(self, registers):
+        self.accesses.append(("set_registers",))
+        self.registers = list(registers)
+
+    async def target_get_register(self, number):
+        self.accesses.append(("get_register", number))
+        return self.registers[number]
+
+    async def target_set_register(self, number, value):
+        self.accesses.append(("set_register", number))
+        self.registers[number] = value
+
+    async def target_read_memory(self, address, length):
+        self.accesses.append(("read", address, length))
+        return self.memory[address:address + length]
+
+    async def target_write_memory(self, address, data):
+        self.accesses.append(("write", address, len(data)))
+        self.memory[address:address + len(data)] = data
+
+    async def target_set_software_breakpt(self, address):
+        pass
+
+    async def target_clear_software_breakpt(self, address):
+        pass
+
+    async def target_set_instr_breakpt(self, address):
+        pass
+
+    async def target_clear_instr_breakpt(self, address):
+        pass
+
+
+class GDBRemoteTestCase(unittest.TestCase):
+    def run_gdb(self, commands, cache_page_size=64):
+        target   = _MockGDBTarget()
+        endpoint = _MockEndpoint(commands)
+        asyncio.get_event_loop().run_until_complete(
+            target.gdb_run(endpoint, cache_page_size=cache_page_size))
+        return target.accesses, endpoint.responses[1:]
+
+    def test_memory_cache(self):
+        accesses, responses = self.run_gdb([b"m4,4", b"m8,4", b"m3c,8"])
+        self.assertEqual(accesses, [("read", 0x00, 0x40), ("read", 0x40, 0x40)])
+        self.assertEqual(responses, [b"04050607", b"08090a0b", b"3c3d3e3f40414243"])
+
+    def test_memory_uncached(self):
+        accesses, responses = self.run_gdb([b"m7fe,4", b"m800,4", b"m800,4"])
+        self.assertEqual(accesses, [("read", 0x7c0, 0x40), ("read", 0x800, 0x02),
+                                    ("read", 0x800, 0x04), ("read", 0x800, 0x04)])
+        self.assertEqual(responses, [b"feff0001", b"00010203", b"00010203"])
+
+        accesses, responses = self.run_gdb([b"m4,4", b"m4,4"], cache_page_size=0)
+        self.assertEqual(accesses, [("read", 0x4, 0x4), ("read", 0x4, 0x4)])
+
+    def test_memory_write_through(self):
+        accesses, responses = self.run_gdb([b"m0,8", b"M6,4:aabbccdd", b"X3e,4:\x11\x22\x33\x44",
+                                            b"m0,8", b"m3e,4"])
+        self.assertEqual(accesses, [("read", 0x00, 0x40), ("write", 0x06, 0x04),
+                                    ("write", 0x3e, 0x04), ("read", 0x40, 0x40)])
+        self.assertEqual(responses, [b"0001020304050607", b"OK", b"OK",
+                                     b"000102030405aabb", b"11223344"])
+
+    def test_register_cache(self):
+        accesses, responses = self.run_gdb([b"g", b"p2", b"P2=55", b"p2", b"s", b"p2",
+                                            b"G00000000111111112222222233333333", b"g"])
+        self.assertEqual(accesses, [("get_registers",), ("set_register", 2), ("step",),
+                                    ("get_register", 2), ("set_registers",)])
+        self.assertEqual(responses, [b"00000000000000100000002000000030", b"00000020",
+                                     b"OK", b"00000055", b"S05", b"00000055",
+                                     b"OK", b"00000000111111112222222233333333"])
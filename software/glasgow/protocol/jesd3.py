@@ -0,0 +1,183 @@
+# Ref: JEDEC JESD3-C Standard Data Transfer Format Between Data Preparation System and
+#      Programmable Logic Device Programmer
+
+import re
+from bitarray import bitarray
+
+
+__all__ = ["JESD3Parser", "JESD3Emitter", "JESD3ParsingError"]
+
+
+class JESD3ParsingError(Exception):
+    pass
+
+
+class JESD3Parser:
+    """
+    A parser for JEDEC fuse map (.jed) files.
+
+    Only the fields describing fuse states (``QF``, ``F``, ``L`` and ``C``) and notes (``N``)
+    are interpreted; all other fields are ignored. After :meth:`parse`, the fuse states are
+    available as ``fuse``, a :class:`bitarray` indexed by fuse number.
+    """
+    def __init__(self, buffer):
+        self._buffer     = bytes(buffer)
+        self.design_spec = None
+        self.notes       = []
+        self.fuse        = None
+
+    def _parse_error(self, error):
+        raise JESD3ParsingError(error)
+
+    def _parse_int(self, field, value, base=10):
+        try:
+            return int(value, base)
+        except ValueError:
+            self._parse_error("invalid field %s" % field[:16])
+
+    def parse(self):
+        start = self._buffer.find(b"\x02")
+        end   = self._buffer.find(b"\x03", start + 1)
+        if start == -1 or end == -1:
+            self._parse_error("STX or ETX not found")
+
+        checksum = self._buffer[end + 1:end + 5]
+        if len(checksum) == 4 and checksum != b"0000":
+            expected = sum(self._buffer[start:end + 1]) & 0xffff
+            if self._parse_int("transmission checksum", checksum.decode("ascii"), 16) \
+                    != expected:
+                self._parse_error("transmission checksum mismatch: expected %04X, got %s"
+                                  % (expected, checksum.decode("ascii")))
+
+        try:
+            text = self._buffer[start + 1:end].decode("ascii")
+        except UnicodeDecodeError:
+            self._parse_error("file is not ASCII")
+
+        fields = text.split("*")
+        # Everything after the last delimiter is not a field.
+        self.design_spec, fields = fields[0].strip(), fields[1:-1]
+
+        fuse_count = None
+        default    = 0
+        lists      = []
+        checksum   = None
+        for field in fields:
+            field = field.strip()
+            if field.startswith("QF"):
+                fuse_count = self._parse_int(field, field[2:])
+            elif field.startswith("F"):
+                default = self._parse_int(field, field[1:])
+            elif field.startswith("L"):
+                address, *states = field[1:].split()
+                try:
+                    lists.append((int(address), bitarray("".join(states), endian="little")))
+                except ValueError:
+                    self._parse_error("invalid field %s" % field[:16])
+            elif field.startswith("C"):
+                checksum = self._parse_int(field, field[1:], 16)
+            elif field.startswith("N"):
+                self.notes.append(field[1:].strip())
+
+        if fuse_count is None:
+            self._parse_error("fuse count (QF) not specified")
+        self.fuse = bitarray(fuse_count, endian="little")
+        self.fuse.setall(default)
+        for address, states in lists:
+            if address + len(states) > fuse_count:
+                self._parse_error("fuse list at %d exceeds fuse count %d"
+                                  % (address, fuse_count))
+            self.fuse[address:address + len(states)] = states
+
+        if checksum is not None and checksum != _fuse_checksum(self.fuse):
+            self._parse_error("fuse checksum mismatch: expected %04X, got %04X"
+                              % (_fuse_checksum(self.fuse), checksum))
+        return self.fuse
+
+
+def _fuse_checksum(fuse):
+    # The sum of 8-bit words made of fuse states, with fuse 0 as the LSB of the first one.
+    return sum(fuse.tobytes()) & 0xffff
+
+
+class JESD3Emitter:
+    """
+    An emitter for JEDEC fuse map (.jed) files, with the states of ``fuse``, a :class:`bitarray`
+    indexed by fuse number.
+
+    Every fuse list is written on its own line, split into groups of ``group_sizes`` fuses,
+    e.g. ``add_list(0, [8, 8, 8, 8])``; all fuses not in a list are written with the default
+    state, 0.
+    """
+    def __init__(self, fuse, design_spec="", notes=()):
+        self._fuse       = fuse
+        self._design_spec = design_spec
+        self._notes      = list(notes)
+        self._lists      = []
+
+    def add_list(self, address, group_sizes):
+        self._lists.append((address, group_sizes))
+
+    def emit(self):
+        lines = [
+            "\x02" + self._design_spec + "*",
+            "QF%d*" % len(self._fuse),
+        ]
+        lines += ["N %s*" % note for note in self._notes]
+        lines.append("F0*")
+        states = self._fuse.to01()
+        for address, group_sizes in self._lists:
+            groups = []
+            for size in group_sizes:
+                groups.append(states[address:address + size])
+                address += size
+            lines.append("L%07d %s*" % (address - sum(group_sizes), " ".join(groups)))
+        lines.append("C%04X*" % _fuse_checksum(self._fuse))
+        lines.append("\x03")
+
+        data = "\n".join(lines).encode("ascii")
+        return data + b"%04X" % (sum(data) & 0xffff)
+
+# -------------------------------------------------------------------------------------------------
+
+import unittest
+
+
+class JESD3TestCase(unittest.TestCase):
+    def assertErrors(self, source, error):
+        with self.assertRaisesRegex(JESD3ParsingError, r"^{}".format(re.escape(error))):
+            JESD3Parser(source).parse()
+
+    def test_parse(self):
+        parser = JESD3Parser(b"junk\x02design*\nN DEVICE X*\nQF12*\nF1*\n"
+                             b"L0002 0000 01*\nC0092*\n\x030000")
+        self.assertEqual(parser.parse(), bitarray("110000011111", endian="little"))
+        self.assertEqual(parser.design_spec, "design")
+        self.assertEqual(parser.notes, ["DEVICE X"])
+
+    def test_errors(self):
+        self.assertErrors(b"QF1*",
+                          "STX or ETX not found")
+        self.assertErrors(b"\x02*L0 1*\x03",
+                          "fuse count (QF) not specified")
+        self.assertErrors(b"\x02*QF1*L0 11*\x03",
+                          "fuse list at 0 exceeds fuse count 1")
+        self.assertErrors(b"\x02*QF1*L0 1*C0000*\x03",
+                          "fuse checksum mismatch: expected 0001, got 0000")
+        self.assertErrors(b"\x02*QF1*\x030001",
+                          "transmission checksum mismatch: expected 0121, got 0001")
+        self.assertErrors(b"\x02*QFx*\x03",
+                          "invalid field QFx")
+        self.assertErrors(b"\x02*QF2*L0 12*\x03",
+                          "invalid field L0 12")
+
+    def test_roundtrip(self):
+        fuse = bitarray("1011001110001111", endian="little")
+        emitter = JESD3Emitter(fuse, design_spec="test", notes=["DEVICE X"])
+        emitter.add_list(0, [4, 4])
+        emitter.add_list(8, [8])
+        data = emitter.emit()
+        self.assertEqual(data[:data.index(b"\x03") + 1],
+                         b"\x02test*\nQF16*\nN DEVICE X*\nF0*\n"
+                         b"L0000000 1011 0011*\nL0000008 10001111*\nC01BE*\n\x03")
+        self.assertEqual(JESD3Parser(data).parse(), fuse)
@@ -2,21 +2,56 @@
 # Ref: http://www.jtagtest.com/pdf/svf_specification.pdf
 
 import re
+import bisect
 from abc import ABCMeta, abstractmethod
 from bitarray import bitarray
 
 
-__all__ = ["SVFParser", "SVFEventHandler"]
+__all__ = ["SVFParser", "SVFEventHandler", "SVFScanData"]
 
 
-def _hex_to_bitarray(input_nibbles):
-    byte_len = (len(input_nibbles) + 1) // 2
-    input_bytes = bytes.fromhex(input_nibbles.rjust(byte_len * 2, "0"))
-    bits = bitarray(endian="little")
-    bits.frombytes(input_bytes)
-    bits.reverse()
-    bits.bytereverse()
-    return bits
+class SVFScanData:
+    """
+    Scan data, as a string of hexadecimal digits that is converted to a :class:`bitarray`
+    only when needed.
+    """
+    __slots__ = ("digits",)
+
+    def __init__(self, digits):
+        self.digits = digits
+
+    def __repr__(self):
+        return "SVFScanData({!r})".format(self.digits)
+
+    def __eq__(self, other):
+        return isinstance(other, SVFScanData) and self.digits == other.digits
+
+    def bit_length(self):
+        """Return the number of bits up to and including the most significant set bit."""
+        digits = self.digits.lstrip(b"0")
+        if not digits:
+            return 0
+        return (len(digits) - 1) * 4 + int(digits[:1], 16).bit_length()
+
+    def to_bitarray(self, length=None):
+        """
+        Return the scan data as a little-endian :class:`bitarray` of ``length`` bits, or,
+        if not specified, of as many bits as there are in whole bytes of the digits.
+        """
+        digits = self.digits
+        if len(digits) % 2:
+            digits = b"0" + digits
+        bits = bitarray(endian="little")
+        bits.frombytes(bytes.fromhex(digits.decode("ascii"))[::-1])
+        if length is None:
+            return bits
+        elif length > len(bits):
+            padding = bitarray(length - len(bits), endian="little")
+            padding.setall(0)
+            bits.extend(padding)
+            return bits
+        else:
+            return bits[:length]
 
 
 _commands = (
@@ -53,42 +88,44 @@ class SVFLexer:
         * Keyword (``HIR``, ``SIR``, ``TIO``, ..., ``;``), returned as Python ``str``;
         * Integer (``8``, ``16``, ...), returned as Python ``int``;
         * Real (``1E0``, ``1E+0``, ``1E-0``, ...), returned as Python ``float``;
-        * Bit array (``(0)``, ``(1234)``, ``(F00F)``, ...), returned as Python ``bitarray``;
+        * Scan data (``(0)``, ``(1234)``, ``(F00F)``, ...), returned as :class:`SVFScanData`;
         * Literal (``(HLUDXZHHLL)``, ``(IN FOO)``, ...), returned as Python ``tuple(str,)``;
         * End of file, returned as Python ``None``.
 
-    :type buffer: str
+    :type buffer: str or bytes-like
     :attr buffer:
-        Input buffer.
+        Input buffer. Buffers that are not ``str``, e.g. an ``mmap`` of an SVF file, are lexed
+        in place.
 
     :type position: int
     :attr position:
         Offset into buffer from which the next token will be read.
     """
 
-    _keywords = _commands + _parameters + _trst_modes + _tap_states + (";",)
-    _scanner  = tuple((re.compile(src, re.A|re.I|re.M), act) for src, act in (
-        (r"\s+",
-         None),
-        (r"(?:!|//)([^\n]*)(?:\n|\Z)",
-         None),
-        (r"({})(?=\s+|[;()]|\Z)".format("|".join(_keywords)),
-         lambda m: m[1]),
-        (r"(\d+)(?![\.E])",
-         lambda m: int(m[1])),
-        (r"(\d+(?:\.\d+)?(?:E[+-]?\d+)?)",
-         lambda m: float(m[1])),
-        (r"\(\s*([0-9A-F]+)\s*\)",
-         lambda m: _hex_to_bitarray(m[1])),
-        (r"\(\s*(.+?)\s*\)",
-         lambda m: (m[1],)),
-        (r"\Z",
-         lambda m: None),
-    ))
+    _skip_re  = re.compile(rb"(?:\s+|(?:!|//)[^\n]*(?:\n|\Z))*")
+    _token_re = re.compile(rb"""
+        (?P<keyword>(?:%s)(?=\s|[;()]|\Z)|;)
+      | (?P<integer>\d+)(?![.E\d])
+      | (?P<real>\d+(?:\.\d+)?(?:E[+-]?\d+)?)
+      | \(\s*(?P<scan_data>[0-9A-F][0-9A-F\s]*)\)
+      | \(\s*(?P<literal>.+?)\s*\)
+      | (?P<eof>\Z)
+    """ % b"|".join(keyword.encode() for keyword in _commands + _parameters + _trst_modes +
+                                                 _tap_states), re.A|re.I|re.X)
+    _keywords = {keyword.encode(): keyword
+                 for keyword in _commands + _parameters + _trst_modes + _tap_states + (";",)}
 
     def __init__(self, buffer):
+        if isinstance(buffer, str):
+            buffer = buffer.encode("utf-8")
         self.buffer   = buffer
         self.position = 0
+        # Offsets of the start of every line up to `_line_indexed`.
+        self._line_starts  = [0]
+        self._line_indexed = 0
+        # The token at `_cache_position`; the parser often reads the same token twice.
+        self._cache_position = None
+        self._cache_token    = None
 
     def line_column(self, position=None):
         """
@@ -96,37 +133,65 @@ class SVFLexer:
 
         Both the line and the column start at 1.
         """
-        line = len(re.compile(r"\n").findall(self.buffer, endpos=self.position))
-        if line > 1:
-            column = self.position - self.buffer.rindex("\n", 0, self.position)
-        else:
-            column = self.position
-        return line + 1, column + 1
+        if position is None:
+            position = self.position
+        while self._line_indexed < position:
+            newline = self.buffer.find(b"\n", self._line_indexed, position)
+            if newline == -1:
+                self._line_indexed = position
+            else:
+                self._line_starts.append(newline + 1)
+                self._line_indexed = newline + 1
+        line = bisect.bisect_right(self._line_starts, position)
+        return line, position - self._line_starts[line - 1] + 1
 
     def _lex(self):
-        while True:
-            for token_re, action in self._scanner:
-                match = token_re.match(self.buffer, self.position)
-                # print(token_re, match)
-                if match:
-                    if action is None:
-                        self.position = match.end()
-                        break
-                    else:
-                        return action(match), match.end()
-            else:
-                raise SVFParsingError("unrecognized SVF data at line %d, column %d (%s...)"
-                                    % (*self.line_column(),
-                                       self.buffer[self.position:self.position + 16]))
+        if self._cache_position == self.position:
+            return self._cache_token
+
+        position = self._skip_re.match(self.buffer, self.position).end()
+        match = self._token_re.match(self.buffer, position)
+        if match is None:
+            raise SVFParsingError("unrecognized SVF data at line %d, column %d (%s...)"
+                                  % (*self.line_column(position),
+                                     bytes(self.buffer[position:position + 16])
+                                        .decode("utf-8", "replace")))
+
+        kind = match.lastgroup
+        if kind == "keyword":
+            text = match.group(kind)
+            token = self._keywords.get(text) or text.decode("ascii")
+        elif kind == "integer":
+            token = int(match.group(kind))
+        elif kind == "real":
+            token = float(match.group(kind))
+        elif kind == "scan_data":
+            digits = match.group(kind)
+            if not digits.isalnum():
+                digits = digits.translate(None, b" \t\r\n\f\v")
+            token = SVFScanData(digits)
+        elif kind == "literal":
+            token = (match.group(kind).decode("utf-8"),)
+        else:
+            token = None
+        self._cache_position = self.position
+        self._cache_token    = (position, token, match.end())
+        return self._cache_token
+
+    @property
+    def token_position(self):
+        """Offset into buffer of the token that will be read next."""
+        position, _, _ = self._lex()
+        return position
 
     def peek(self):
         """Return the next token without advancing the position."""
-        token, _ = self._lex()
+        _, token, _ = self._lex()
         return token
 
     def next(self):
         """Return the next token and advance the position."""
-        token, next_pos = self._lex()
+        _, token, next_pos = self._lex()
         self.position = next_pos
         return token
 
@@ -154,6 +219,7 @@ class SVFParser:
         self._position  = 0
         self._token     = None
         self._cmd_pos   = 0
+        self._cmd_token_pos = 0
 
         self._param_tdi   = \
             {"HIR": None, "HDR": None, "SIR": None, "SDR": None, "TIR": None, "TDR": None}
@@ -174,7 +240,7 @@ class SVFParser:
             return None
 
     def _parse_token(self):
-        self._position = self._lexer.position
+        self._position = self._lexer.token_position
         self._token    = self._lexer.next()
         # print("token %s @ %d" % (self._token, self._position))
         return self._token
@@ -190,7 +256,7 @@ class SVFParser:
             actual = "integer"
         elif isinstance(self._token, float):
             actual = "real"
-        elif isinstance(self._token, bitarray):
+        elif isinstance(self._token, SVFScanData):
             actual = "scan data"
         elif isinstance(self._token, tuple):
             actual = "(%s)" % (*self._token,)
@@ -227,7 +293,7 @@ class SVFParser:
                 expected = "real"
             elif kind == (int, float):
                 expected = "number"
-            elif kind == bitarray:
+            elif kind == SVFScanData:
                 expected = "scan data"
             elif kind == tuple:
                 expected = "data"
@@ -254,23 +320,15 @@ class SVFParser:
             self._parse_unexpected("stable TAP state", _tap_stable_states)
 
     def _parse_scan_data(self, length):
-        value = self._parse_value(bitarray)
-        if value[length:].count(1) != 0:
-            residue = value[length:]
-            residue.reverse()
+        value = self._parse_value(SVFScanData)
+        if value.bit_length() > length:
             self._parse_error("scan data length %d exceeds command length %d"
-                              % (length + residue.index(1), length))
-
-        if length > len(value):
-            padding = bitarray(length - len(value), endian="little")
-            padding.setall(0)
-            value.extend(padding)
-            return value
-        else:
-            return value[:length]
+                              % (value.bit_length(), length))
+        return value
 
     def parse_command(self):
         self._cmd_pos = self._lexer.position
+        self._cmd_token_pos = self._lexer.token_position
 
         command = self._parse_token()
         if command is None:
@@ -326,34 +384,30 @@ class SVFParser:
                 self._param_smask[command] = bitarray(length, endian="little")
                 self._param_smask[command].setall(1)
 
-            param_tdi   = self._param_tdi[command]
-            param_tdo   = None
-            param_mask  = self._param_mask[command]
-            param_smask = self._param_smask[command]
-            parameters  = set()
+            values = {}
             while True:
                 parameter = self._try(self._parse_keywords, ("TDI", "TDO", "MASK", "SMASK"))
                 if parameter is None: break
 
                 value = self._parse_scan_data(length)
-                if parameter in parameters:
+                if parameter in values:
                     self._parse_error("parameter %s specified twice" % parameter)
-                parameters.add(parameter)
-
-                if parameter == "TDI":
-                    self._param_tdi[command] = value
-                    param_tdi = value
-                if parameter == "TDO":
-                    param_tdo = value
-                if parameter == "MASK":
-                    self._param_mask[command] = value
-                    param_mask = value
-                if parameter == "SMASK":
-                    self._param_smask[command] = value
-                    param_smask = value
+                values[parameter] = value
 
             self._parse_keyword(";")
 
+            # Scan data is only converted once the entire command is parsed.
+            if "TDI" in values:
+                self._param_tdi[command] = values["TDI"].to_bitarray(length)
+            if "MASK" in values:
+                self._param_mask[command] = values["MASK"].to_bitarray(length)
+            if "SMASK" in values:
+                self._param_smask[command] = values["SMASK"].to_bitarray(length)
+            param_tdi   = self._param_tdi[command]
+            param_tdo   = values["TDO"].to_bitarray(length) if "TDO" in values else None
+            param_mask  = self._param_mask[command]
+            param_smask = self._param_smask[command]
+
             if param_tdi is None and length == 0:
                 param_tdi = bitarray("", endian="little")
             elif param_tdi is None:
@@ -452,7 +506,12 @@ class SVFParser:
         return result or True
 
     def last_command(self):
-        return self._lexer.buffer[self._cmd_pos:self._lexer.position]
+        return bytes(self._lexer.buffer[self._cmd_pos:self._lexer.position]).decode("utf-8")
+
+    def last_command_line(self):
+        """Return the line at which the last command starts."""
+        line, _ = self._lexer.line_column(self._cmd_token_pos)
+        return line
 
     def parse_file(self):
         while self.parse_command(): pass
@@ -531,7 +590,8 @@ import unittest
 class SVFLexerTestCase(unittest.TestCase):
     def assertLexes(self, source, tokens):
         self.lexer = SVFLexer(source)
-        self.assertEqual(list(self.lexer), tokens)
+        self.assertEqual([token.to_bitarray() if isinstance(token, SVFScanData) else token
+                          for token in self.lexer], tokens)
 
     def test_eof(self):
         self.assertLexes("", [])
@@ -571,6 +631,13 @@ class SVFLexerTestCase(unittest.TestCase):
         self.assertLexes("(0F)",    [bitarray("11110000")])
         self.assertLexes("(FF)",    [bitarray("11111111")])
         self.assertLexes("(1AA)",   [bitarray("0101010110000000")])
+        self.assertLexes("(1A\n A)", [bitarray("0101010110000000")])
+
+    def test_scan_data(self):
+        self.assertEqual(SVFScanData(b"00").bit_length(), 0)
+        self.assertEqual(SVFScanData(b"011a").bit_length(), 9)
+        self.assertEqual(SVFScanData(b"1a").to_bitarray(4), bitarray("0101"))
+        self.assertEqual(SVFScanData(b"1a").to_bitarray(12), bitarray("010110000000"))
 
     def test_literal(self):
         self.assertLexes("(HHZZL)",     [("HHZZL",)])
@@ -580,6 +647,13 @@ class SVFLexerTestCase(unittest.TestCase):
         with self.assertRaises(SVFParsingError):
             SVFLexer("XXX").next()
 
+    def test_line_column(self):
+        lexer = SVFLexer("TRST OFF;\n\n  SIR 8\n")
+        self.assertEqual(lexer.line_column(), (1, 1))
+        self.assertEqual(lexer.line_column(13), (3, 3))
+        self.assertEqual(lexer.line_column(5), (1, 6))
+        self.assertEqual(lexer.line_column(10), (2, 1))
+
 
 class SVFMockEventHandler:
     def __init__(self):
@@ -878,6 +952,14 @@ class SVFParserTestCase(unittest.TestCase):
         parser.parse_command()
         self.assertEqual(parser.last_command(), " SIR 8 TDI (aa);")
 
+    def test_last_command_line(self):
+        handler = SVFMockEventHandler()
+        parser = SVFParser("TRST OFF;\n// comment\n\nSIR 8\n TDI (aa);", handler)
+        parser.parse_command()
+        self.assertEqual(parser.last_command_line(), 1)
+        parser.parse_command()
+        self.assertEqual(parser.last_command_line(), 4)
+
 # -------------------------------------------------------------------------------------------------
 
 class SVFPrintingEventHandler:
@@ -890,7 +972,41 @@ class SVFPrintingEventHandler:
             return super().__getattr__(name)
 
 
+class SVFNullEventHandler:
+    def __getattr__(self, name):
+        if name.startswith("svf_"):
+            return lambda **kwargs: None
+        else:
+            return super().__getattr__(name)
+
+
+def _synthetic_svf(blocks):
+    # Roughly 1.1 KB per block, shaped like SVF files produced by FPGA vendor tools.
+    import random
+    random = random.Random(0)
+    chunks = ["TRST OFF;\nENDIR IDLE;\nENDDR IDLE;\nSTATE RESET;\nSTATE IDLE;\n"]
+    for _ in range(blocks):
+        chunks.append("SIR 8 TDI (%02x) SMASK (ff);\n"
+                      "SDR 1024 TDI (%0256x)\n\tSMASK (%s)\n\tTDO (%0256x)\n\tMASK (%s);\n"
+                      "RUNTEST 100 TCK;\n"
+                      % (random.getrandbits(8), random.getrandbits(1024), "f" * 256,
+                         random.getrandbits(1024), "f" * 256))
+    return "".join(chunks).encode("ascii")
+
+
 if __name__ == "__main__":
     import sys
-    with open(sys.argv[1]) as f:
-        SVFParser(f.read(), SVFPrintingEventHandler()).parse_file()
+    import mmap
+    import time
+    if sys.argv[1] == "--benchmark":
+        # Usage: python -m glasgow.protocol.jtag_svf --benchmark [BLOCKS]
+        buffer = _synthetic_svf(int(sys.argv[2]) if len(sys.argv) > 2 else 20000)
+        started = time.perf_counter()
+        SVFParser(buffer, SVFNullEventHandler()).parse_file()
+        elapsed = time.perf_counter() - started
+        print("parsed %.1f MB in %.2f s (%.1f MB/s)"
+              % (len(buffer) / 1e6, elapsed, len(buffer) / elapsed / 1e6))
+    else:
+        with open(sys.argv[1], "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            SVFParser(buffer, SVFPrintingEventHandler()).parse_file()
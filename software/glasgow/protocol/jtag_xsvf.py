@@ -0,0 +1,431 @@
+# Ref: Xilinx XAPP503 "SVF and XSVF File Formats for Xilinx Devices"
+
+import struct
+from abc import ABCMeta, abstractmethod
+from bitarray import bitarray
+
+
+__all__ = ["XSVFParser", "XSVFEventHandler", "XSVFParsingError"]
+
+
+class XSVFParsingError(Exception):
+    pass
+
+
+# TAP states, in the order of their XSVF encoding, with names as used in SVF.
+_states = (
+    "RESET", "IDLE",
+    "DRSELECT", "DRCAPTURE", "DRSHIFT", "DREXIT1", "DRPAUSE", "DREXIT2", "DRUPDATE",
+    "IRSELECT", "IRCAPTURE", "IRSHIFT", "IREXIT1", "IRPAUSE", "IREXIT2", "IRUPDATE",
+)
+
+_trst_modes = ("ON", "OFF", "Z", "ABSENT")
+
+(XCOMPLETE, XTDOMASK, XSIR, XSDR, XRUNTEST, _, _, XREPEAT, XSDRSIZE, XSDRTDO,
+ XSETSDRMASKS, XSDRINC, XSDRB, XSDRC, XSDRE, XSDRTDOB, XSDRTDOC, XSDRTDOE, XSTATE,
+ XENDIR, XENDDR, XSIR2, XCOMMENT, XWAIT, XWAITSTATE) = range(0x19)
+XTRST = 0x1c
+
+
+class XSVFParser:
+    """
+    A Xilinx Serial Vector Format streaming parser.
+
+    Commands are decoded from ``buffer`` (e.g. an ``mmap`` of an XSVF file) one at a time, as
+    they are played, so the file is never decoded as a whole. The parser maintains the state
+    that is needed to decode commands (``XSDRSIZE``) or that is referenced by later commands
+    (``XTDOMASK``, and the expected TDO value of ``XSDRTDO``), and invokes the XSVF event
+    handler for all other commands.
+
+    Scan data is converted to :class:`bitarray` objects in the order it is shifted, i.e.
+    starting with the least significant bit of the last byte.
+    """
+    def __init__(self, buffer, handler):
+        self._buffer    = buffer
+        self._handler   = handler
+        self._position  = 0
+        self._cmd_pos   = 0
+        self._complete  = False
+
+        self._sdr_size  = 0
+        self._tdo_mask  = None
+        self._tdo_value = None
+
+    def _parse_error(self, error):
+        raise XSVFParsingError("%s at offset %#x" % (error, self._cmd_pos))
+
+    def _parse_bytes(self, size):
+        if self._position + size > len(self._buffer):
+            self._parse_error("unexpected end of file")
+        data = self._buffer[self._position:self._position + size]
+        self._position += size
+        return data
+
+    def _parse_u8(self):
+        return self._parse_bytes(1)[0]
+
+    def _parse_u16(self):
+        value, = struct.unpack(">H", self._parse_bytes(2))
+        return value
+
+    def _parse_u32(self):
+        value, = struct.unpack(">L", self._parse_bytes(4))
+        return value
+
+    def _parse_bits(self, length):
+        bits = bitarray(endian="little")
+        bits.frombytes(bytes(self._parse_bytes((length + 7) // 8))[::-1])
+        del bits[length:]
+        return bits
+
+    def _parse_enum(self, kind, values):
+        value = self._parse_u8()
+        if value >= len(values):
+            self._parse_error("invalid %s %d" % (kind, value))
+        return values[value]
+
+    def _parse_state(self, states=_states):
+        return self._parse_enum("TAP state", states)
+
+    def _tdo_mask_bits(self):
+        if self._tdo_mask is None or len(self._tdo_mask) != self._sdr_size:
+            # XTDOMASK is sized by the XSDRSIZE preceding it; a mask of a different size than
+            # the current XSDRSIZE would never be used by a well-formed file.
+            mask = bitarray(self._sdr_size, endian="little")
+            mask.setall(0)
+            return mask
+        return self._tdo_mask
+
+    def parse_command(self):
+        self._cmd_pos = self._position
+        if self._complete or self._position == len(self._buffer):
+            return False
+
+        command = self._parse_u8()
+        if command == XCOMPLETE:
+            self._complete = True
+            return False
+
+        elif command == XTDOMASK:
+            # Commands that only change the state of the parser are consumed together with
+            # the command that follows them.
+            self._tdo_mask = self._parse_bits(self._sdr_size)
+            return self.parse_command()
+
+        elif command in (XSIR, XSIR2):
+            length = self._parse_u8() if command == XSIR else self._parse_u16()
+            result = self._handler.xsvf_sir(tdi=self._parse_bits(length))
+
+        elif command in (XSDR, XSDRTDO):
+            tdi = self._parse_bits(self._sdr_size)
+            if command == XSDRTDO:
+                self._tdo_value = self._parse_bits(self._sdr_size)
+            if self._tdo_value is None or len(self._tdo_value) != self._sdr_size:
+                tdo, mask = None, None
+            else:
+                tdo, mask = self._tdo_value, self._tdo_mask_bits()
+            result = self._handler.xsvf_sdr(tdi=tdi, tdo=tdo, mask=mask)
+
+        elif command in (XSDRB, XSDRC, XSDRE, XSDRTDOB, XSDRTDOC, XSDRTDOE):
+            tdi = self._parse_bits(self._sdr_size)
+            if command in (XSDRTDOB, XSDRTDOC, XSDRTDOE):
+                tdo, mask = self._parse_bits(self._sdr_size), self._tdo_mask_bits()
+            else:
+                tdo, mask = None, None
+            part = ("begin", "continue", "end")[(command - XSDRB) % 3]
+            result = self._handler.xsvf_sdr_part(part=part, tdi=tdi, tdo=tdo, mask=mask)
+
+        elif command == XRUNTEST:
+            result = self._handler.xsvf_runtest(time=self._parse_u32())
+
+        elif command == XREPEAT:
+            result = self._handler.xsvf_repeat(count=self._parse_u8())
+
+        elif command == XSDRSIZE:
+            self._sdr_size = self._parse_u32()
+            return self.parse_command()
+
+        elif command == XSTATE:
+            result = self._handler.xsvf_state(state=self._parse_state())
+
+        elif command == XENDIR:
+            result = self._handler.xsvf_endir(state=self._parse_state(("IDLE", "IRPAUSE")))
+
+        elif command == XENDDR:
+            result = self._handler.xsvf_enddr(state=self._parse_state(("IDLE", "DRPAUSE")))
+
+        elif command == XCOMMENT:
+            end = self._position
+            while end < len(self._buffer) and self._buffer[end] != 0:
+                end += 1
+            text = bytes(self._parse_bytes(end - self._position)).decode("ascii", "replace")
+            self._parse_bytes(1)
+            result = self._handler.xsvf_comment(text=text)
+
+        elif command in (XWAIT, XWAITSTATE):
+            wait_state = self._parse_state()
+            end_state  = self._parse_state()
+            cycles     = self._parse_u32() if command == XWAITSTATE else None
+            time       = self._parse_u32()
+            result = self._handler.xsvf_wait(wait_state=wait_state, end_state=end_state,
+                                             cycles=cycles, time=time)
+
+        elif command == XTRST:
+            result = self._handler.xsvf_trst(mode=self._parse_enum("TRST mode", _trst_modes))
+
+        elif command in (XSETSDRMASKS, XSDRINC):
+            self._parse_error("obsolete command %#04x is not supported" % command)
+
+        else:
+            self._parse_error("unknown command %#04x" % command)
+
+        return result or True
+
+    def last_command_offset(self):
+        """Return the offset at which the last command starts."""
+        return self._cmd_pos
+
+    def parse_file(self):
+        while self.parse_command(): pass
+
+
+class XSVFEventHandler(metaclass=ABCMeta):
+    """
+    An abstract base class for Xilinx Serial Vector Format parsing events.
+
+    The methods of this class are called when a well-formed XSVF command is encountered.
+    Times are in microseconds, and TAP states are named as in SVF.
+    """
+
+    @abstractmethod
+    def xsvf_sir(self, tdi):
+        """Called when the ``XSIR`` or ``XSIR2`` command is encountered."""
+
+    @abstractmethod
+    def xsvf_sdr(self, tdi, tdo, mask):
+        """
+        Called when the ``XSDR`` or ``XSDRTDO`` command is encountered. ``tdo`` is the value
+        expected by the last ``XSDRTDO`` command, or ``None`` if TDO should not be checked.
+        """
+
+    @abstractmethod
+    def xsvf_sdr_part(self, part, tdi, tdo, mask):
+        """
+        Called when one of the ``XSDRB``, ``XSDRC``, ``XSDRE`` commands (``part`` is ``"begin"``,
+        ``"continue"`` or ``"end"``), or their ``XSDRTDOx`` counterparts, is encountered.
+        """
+
+    @abstractmethod
+    def xsvf_runtest(self, time):
+        """Called when the ``XRUNTEST`` command is encountered."""
+
+    @abstractmethod
+    def xsvf_repeat(self, count):
+        """Called when the ``XREPEAT`` command is encountered."""
+
+    @abstractmethod
+    def xsvf_state(self, state):
+        """Called when the ``XSTATE`` command is encountered."""
+
+    @abstractmethod
+    def xsvf_endir(self, state):
+        """Called when the ``XENDIR`` command is encountered."""
+
+    @abstractmethod
+    def xsvf_enddr(self, state):
+        """Called when the ``XENDDR`` command is encountered."""
+
+    @abstractmethod
+    def xsvf_comment(self, text):
+        """Called when the ``XCOMMENT`` command is encountered."""
+
+    @abstractmethod
+    def xsvf_wait(self, wait_state, end_state, cycles, time):
+        """
+        Called when the ``XWAIT`` or ``XWAITSTATE`` command is encountered. ``cycles`` is
+        ``None`` for ``XWAIT``.
+        """
+
+    @abstractmethod
+    def xsvf_trst(self, mode):
+        """Called when the ``XTRST`` command is encountered."""
+
+# -------------------------------------------------------------------------------------------------
+
+import re
+import unittest
+
+
+class XSVFMockEventHandler:
+    def __init__(self):
+        self.events = []
+
+    def __getattr__(self, name):
+        if name.startswith("xsvf_"):
+            def xsvf_event(**kwargs):
+                self.events.append((name, kwargs))
+            return xsvf_event
+        else:
+            return super().__getattr__(name)
+
+
+def bits(string):
+    return bitarray(string, endian="little")
+
+
+class XSVFParserTestCase(unittest.TestCase):
+    def setUp(self):
+        self.maxDiff = None
+
+    def assertParses(self, source, events):
+        self.handler = XSVFMockEventHandler()
+        self.parser = XSVFParser(source, self.handler)
+        self.parser.parse_file()
+        self.assertEqual(self.handler.events, events)
+
+    def assertErrors(self, source, error):
+        with self.assertRaisesRegex(XSVFParsingError, r"^{}".format(re.escape(error))):
+            self.handler = XSVFMockEventHandler()
+            self.parser = XSVFParser(source, self.handler)
+            self.parser.parse_file()
+
+    def test_complete(self):
+        self.assertParses(b"", [])
+        self.assertParses(b"\x00\x07\x20", [])
+
+    def test_sir(self):
+        self.assertParses(b"\x02\x06\x21",
+                          [("xsvf_sir", {"tdi": bits("100001")})])
+        self.assertParses(b"\x15\x00\x0a\x02\x01",
+                          [("xsvf_sir", {"tdi": bits("1000000001")})])
+
+        self.assertErrors(b"\x02\x10\x00",
+                          "unexpected end of file at offset 0x0")
+
+    def test_sdr(self):
+        self.assertParses(b"\x08\x00\x00\x00\x0c"
+                          b"\x03\x01\x23"
+                          b"\x01\x0f\xff"
+                          b"\x09\x00\x01\x03\x02"
+                          b"\x03\x00\x00",
+                          [("xsvf_sdr", {"tdi": bits("110001001000"),
+                                         "tdo": None, "mask": None}),
+                           ("xsvf_sdr", {"tdi": bits("100000000000"),
+                                         "tdo": bits("010000001100"),
+                                         "mask": bits("111111111111")}),
+                           ("xsvf_sdr", {"tdi": bits("000000000000"),
+                                         "tdo": bits("010000001100"),
+                                         "mask": bits("111111111111")})])
+
+    def test_sdr_part(self):
+        self.assertParses(b"\x08\x00\x00\x00\x04"
+                          b"\x0c\x01"
+                          b"\x0d\x02"
+                          b"\x11\x03\x0c",
+                          [("xsvf_sdr_part", {"part": "begin", "tdi": bits("1000"),
+                                              "tdo": None, "mask": None}),
+                           ("xsvf_sdr_part", {"part": "continue", "tdi": bits("0100"),
+                                              "tdo": None, "mask": None}),
+                           ("xsvf_sdr_part", {"part": "end", "tdi": bits("1100"),
+                                              "tdo": bits("0011"), "mask": bits("0000")})])
+
+    def test_runtest_repeat(self):
+        self.assertParses(b"\x04\x00\x00\x27\x10\x07\x20",
+                          [("xsvf_runtest", {"time": 10000}),
+                           ("xsvf_repeat", {"count": 32})])
+
+    def test_states(self):
+        self.assertParses(b"\x12\x00\x12\x06\x13\x01\x14\x00",
+                          [("xsvf_state", {"state": "RESET"}),
+                           ("xsvf_state", {"state": "DRPAUSE"}),
+                           ("xsvf_endir", {"state": "IRPAUSE"}),
+                           ("xsvf_enddr", {"state": "IDLE"})])
+
+        self.assertErrors(b"\x12\x10",
+                          "invalid TAP state 16 at offset 0x0")
+        self.assertErrors(b"\x12\x01\x13\x02",
+                          "invalid TAP state 2 at offset 0x2")
+
+    def test_wait(self):
+        self.assertParses(b"\x17\x01\x06\x00\x00\x01\x00"
+                          b"\x18\x06\x01\x00\x00\x00\x10\x00\x00\x00\x01",
+                          [("xsvf_wait", {"wait_state": "IDLE", "end_state": "DRPAUSE",
+                                          "cycles": None, "time": 256}),
+                           ("xsvf_wait", {"wait_state": "DRPAUSE", "end_state": "IDLE",
+                                          "cycles": 16, "time": 1})])
+
+    def test_comment_trst(self):
+        self.assertParses(b"\x16hello\x00\x1c\x02",
+                          [("xsvf_comment", {"text": "hello"}),
+                           ("xsvf_trst", {"mode": "Z"})])
+
+        self.assertErrors(b"\x1c\x04",
+                          "invalid TRST mode 4 at offset 0x0")
+
+    def test_unsupported(self):
+        self.assertErrors(b"\x12\x00\x0b",
+                          "obsolete command 0x0b is not supported at offset 0x2")
+        self.assertErrors(b"\x05",
+                          "unknown command 0x05 at offset 0x0")
+
+    def test_last_command_offset(self):
+        parser = XSVFParser(b"\x07\x00\x12\x01", XSVFMockEventHandler())
+        parser.parse_command()
+        parser.parse_command()
+        self.assertEqual(parser.last_command_offset(), 2)
+
+# -------------------------------------------------------------------------------------------------
+
+class XSVFPrintingEventHandler:
+    def __getattr__(self, name):
+        if name.startswith("xsvf_"):
+            def xsvf_event(**kwargs):
+                print((name, kwargs))
+            return xsvf_event
+        else:
+            return super().__getattr__(name)
+
+
+class XSVFNullEventHandler:
+    def __getattr__(self, name):
+        if name.startswith("xsvf_"):
+            return lambda **kwargs: None
+        else:
+            return super().__getattr__(name)
+
+
+def _synthetic_xsvf(blocks):
+    # The same commands as `jtag_svf._synthetic_svf(blocks)`.
+    import random
+    random = random.Random(0)
+    chunks = [bytes([XTRST, 1, XENDIR, 0, XENDDR, 0, XSTATE, 0, XSTATE, 1, XREPEAT, 0]),
+              struct.pack(">BL", XSDRSIZE, 1024), bytes([XTDOMASK]) + b"\xff" * 128,
+              struct.pack(">BL", XRUNTEST, 100)]
+    for _ in range(blocks):
+        chunks.append(bytes([XSIR, 8, random.getrandbits(8)]))
+        chunks.append(bytes([XSDRTDO]) + random.getrandbits(1024).to_bytes(128, "big") +
+                      random.getrandbits(1024).to_bytes(128, "big"))
+    chunks.append(bytes([XCOMPLETE]))
+    return b"".join(chunks)
+
+
+if __name__ == "__main__":
+    import sys
+    import mmap
+    import time
+    if sys.argv[1] == "--benchmark":
+        # Usage: python -m glasgow.protocol.jtag_xsvf --benchmark [BLOCKS]
+        from .jtag_svf import SVFParser, SVFNullEventHandler, _synthetic_svf
+        blocks = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+        for name, buffer, parser_cls, handler_cls in (
+                ("SVF",  _synthetic_svf(blocks),  SVFParser,  SVFNullEventHandler),
+                ("XSVF", _synthetic_xsvf(blocks), XSVFParser, XSVFNullEventHandler)):
+            started = time.perf_counter()
+            parser_cls(buffer, handler_cls()).parse_file()
+            elapsed = time.perf_counter() - started
+            print("%-4s: parsed %.1f MB in %.2f s (%.1f MB/s)"
+                  % (name, len(buffer) / 1e6, elapsed, len(buffer) / elapsed / 1e6))
+    else:
+        with open(sys.argv[1], "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            XSVFParser(buffer, XSVFPrintingEventHandler()).parse_file()
@@ -0,0 +1,274 @@
+import struct
+import logging
+from collections import OrderedDict
+
+from ..support.endpoint import ServerEndpoint
+
+
+__all__ = ["TraceStreamEncoder", "TraceStreamDecoder", "TraceStreamDecodingError",
+           "TraceStreamEndpoint"]
+
+
+# The trace stream is a sequence of frames. Every frame starts with a 3-byte header, consisting
+# of a frame type and a little-endian 16-bit payload length, followed by the payload. All
+# multi-byte fields in payloads are little-endian as well.
+FRAME_HEADER  = 0x00 # u32 clock frequency, u8 event count, {u8 kind, u8 width, u8 len, name}*
+FRAME_EVENTS  = 0x01 # u64 cycle, {u8 event index, value}*
+FRAME_OVERRUN = 0x02 # u64 cycle
+FRAME_DONE    = 0x03 # (empty)
+FRAME_DROPPED = 0x04 # u32 count of frames that were not delivered to this consumer
+
+KINDS = ("throttle", "change", "strobe")
+
+
+def _value_size(width):
+    return (width + 7) // 8
+
+
+class TraceStreamEncoder:
+    """
+    Event analyzer trace stream encoder.
+
+    Encodes the timeline produced by :class:`TraceDecoder` into a compact framed binary
+    representation that can be consumed incrementally by other processes.
+    """
+    def __init__(self, events, clock_freq):
+        self._events  = OrderedDict()
+        self._indexes = {}
+        for index, (name, kind, width) in enumerate(events):
+            self._events[name]  = (kind, width)
+            self._indexes[name] = index
+        assert len(self._events) < 256
+
+        payload = bytearray(struct.pack("<LB", int(clock_freq), len(self._events)))
+        for name, (kind, width) in self._events.items():
+            name = name.encode("utf-8")
+            payload += struct.pack("<BBB", KINDS.index(kind), width, len(name))
+            payload += name
+        self._header = self._frame(FRAME_HEADER, payload)
+
+    @staticmethod
+    def _frame(frame_type, payload=b""):
+        return struct.pack("<BH", frame_type, len(payload)) + payload
+
+    def header(self):
+        return self._header
+
+    def events(self, cycle, events):
+        """
+        Encode events, in the format returned by :meth:`TraceDecoder.flush`, that happened
+        at ``cycle``.
+        """
+        if events == "overrun":
+            return self._frame(FRAME_OVERRUN, struct.pack("<Q", cycle))
+
+        payload = bytearray(struct.pack("<Q", cycle))
+        for name, value in events.items():
+            _kind, width = self._events[name]
+            payload.append(self._indexes[name])
+            if width > 0:
+                payload += value.to_bytes(_value_size(width), "little")
+        return self._frame(FRAME_EVENTS, payload)
+
+    def done(self):
+        return self._frame(FRAME_DONE)
+
+    def dropped(self, count):
+        return self._frame(FRAME_DROPPED, struct.pack("<L", count))
+
+
+class TraceStreamDecodingError(Exception):
+    pass
+
+
+class TraceStreamDecoder:
+    """
+    Event analyzer trace stream decoder.
+
+    Decodes a trace stream produced by :class:`TraceStreamEncoder` into a timeline in the same
+    format as :meth:`TraceDecoder.flush`. Gaps caused by dropped frames are reported as
+    ``(None, "dropped")``, and the total number of dropped frames is kept in ``dropped``.
+    """
+    def __init__(self):
+        self.clock_freq = None
+        self.event_list = None
+        self.dropped    = 0
+
+        self._buffer   = bytearray()
+        self._timeline = []
+        self._done     = False
+
+    def events(self):
+        """
+        Return names, kinds and widths for all events in the stream, or ``None`` if the stream
+        header has not been received yet.
+        """
+        return self.event_list
+
+    def _process_frame(self, frame_type, payload):
+        if frame_type == FRAME_HEADER:
+            self.clock_freq, count = struct.unpack_from("<LB", payload, 0)
+            offset = 5
+            self.event_list = []
+            for _ in range(count):
+                kind, width, length = struct.unpack_from("<BBB", payload, offset)
+                offset += 3
+                name = payload[offset:offset + length].decode("utf-8")
+                offset += length
+                self.event_list.append((name, KINDS[kind], width))
+            return
+
+        if self.event_list is None:
+            raise TraceStreamDecodingError("frame type %#04x received before header" %
+                                           frame_type)
+
+        if frame_type == FRAME_EVENTS:
+            cycle, = struct.unpack_from("<Q", payload, 0)
+            offset = 8
+            events = OrderedDict()
+            while offset < len(payload):
+                index = payload[offset]
+                offset += 1
+                if index >= len(self.event_list):
+                    raise TraceStreamDecodingError("event index %d out of bounds" % index)
+                name, _kind, width = self.event_list[index]
+                if width > 0:
+                    size = _value_size(width)
+                    events[name] = int.from_bytes(payload[offset:offset + size], "little")
+                    offset += size
+                else:
+                    events[name] = None
+            self._timeline.append((cycle, events))
+        elif frame_type == FRAME_OVERRUN:
+            cycle, = struct.unpack_from("<Q", payload, 0)
+            self._timeline.append((cycle, "overrun"))
+            self._done = True
+        elif frame_type == FRAME_DONE:
+            self._done = True
+        elif frame_type == FRAME_DROPPED:
+            count, = struct.unpack_from("<L", payload, 0)
+            self.dropped += count
+            self._timeline.append((None, "dropped"))
+        # Unknown frame types are skipped for forward compatibility.
+
+    def process(self, data):
+        """
+        Incrementally parse a chunk of trace stream.
+        """
+        self._buffer += data
+        offset = 0
+        while len(self._buffer) - offset >= 3:
+            frame_type, length = struct.unpack_from("<BH", self._buffer, offset)
+            if len(self._buffer) - offset - 3 < length:
+                break
+            payload = bytes(self._buffer[offset + 3:offset + 3 + length])
+            self._process_frame(frame_type, payload)
+            offset += 3 + length
+        del self._buffer[:offset]
+
+    def flush(self):
+        """
+        Return the event timeline since the start of decoding or the previous flush.
+        """
+        timeline, self._timeline = self._timeline, []
+        return timeline
+
+    def is_done(self):
+        return self._done
+
+
+class TraceStreamEndpoint(ServerEndpoint):
+    """
+    A server endpoint that streams an event analyzer trace to any number of consumers.
+
+    Every new consumer first receives the stream header. Events are written without waiting for
+    consumers; if a consumer falls behind by more than ``buffer_size`` bytes, frames are dropped
+    for that consumer (and it is notified of that) instead of stalling the analyzer or the other
+    consumers.
+    """
+    async def __init__(self, name, logger, sock_addr, encoder, buffer_size=1 << 20):
+        self._encoder     = encoder
+        self._buffer_size = buffer_size
+
+        await super().__init__(name, logger, sock_addr, broadcast=True)
+
+    def _client_made(self, client):
+        super()._client_made(client)
+        client.dropped = 0
+        client.transport.set_write_buffer_limits(high=self._buffer_size)
+        client.transport.write(self._encoder.header())
+
+    def _client_paused(self, client):
+        self._log_peer(logging.WARNING, client.transport,
+                       "dropping events for slow consumer")
+
+    def data_received(self, data):
+        pass
+
+    def _send_frame(self, frame):
+        for client in self._clients:
+            if client.paused:
+                client.dropped += 1
+                continue
+            if client.dropped:
+                self._log_peer(logging.WARNING, client.transport,
+                               "dropped %d frames" % client.dropped)
+                client.transport.write(self._encoder.dropped(client.dropped))
+                client.dropped = 0
+            client.transport.write(frame)
+
+    def send_events(self, cycle, events):
+        self._send_frame(self._encoder.events(cycle, events))
+
+    def send_done(self):
+        self._send_frame(self._encoder.done())
+
+# -------------------------------------------------------------------------------------------------
+
+import unittest
+
+
+class TraceStreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.encoder = TraceStreamEncoder([
+            ("throttle", "throttle", 1),
+            ("fifo-in", "strobe", 8),
+            ("sync", "strobe", 0),
+            ("a-io", "change", 12),
+        ], clock_freq=30e6)
+        self.decoder = TraceStreamDecoder()
+
+    def test_header(self):
+        self.decoder.process(self.encoder.header())
+        self.assertEqual(self.decoder.clock_freq, 30000000)
+        self.assertEqual(self.decoder.events(), [
+            ("throttle", "throttle", 1),
+            ("fifo-in", "strobe", 8),
+            ("sync", "strobe", 0),
+            ("a-io", "change", 12),
+        ])
+
+    def test_no_header(self):
+        with self.assertRaisesRegex(TraceStreamDecodingError, r"before header"):
+            self.decoder.process(self.encoder.done())
+
+    def test_roundtrip(self):
+        timeline = [
+            (2,      OrderedDict([("fifo-in", 0xaa), ("sync", None)])),
+            (0x1234, OrderedDict([("a-io", 0xabc), ("throttle", 1)])),
+            (0x1235, "overrun"),
+        ]
+        data = self.encoder.header()
+        for cycle, events in timeline:
+            data += self.encoder.events(cycle, events)
+        for offset in range(len(data)):
+            self.decoder.process(data[offset:offset + 1])
+        self.assertEqual(self.decoder.flush(), timeline)
+        self.assertTrue(self.decoder.is_done())
+
+    def test_dropped(self):
+        self.decoder.process(self.encoder.header() + self.encoder.dropped(10) +
+                             self.encoder.done())
+        self.assertEqual(self.decoder.flush(), [(None, "dropped")])
+        self.assertEqual(self.decoder.dropped, 10)
+        self.assertTrue(self.decoder.is_done())
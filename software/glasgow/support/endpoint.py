@@ -21,7 +21,41 @@ def endpoint(spec):
     raise argparse.ArgumentTypeError("invalid format")
 
 
+class _BroadcastConnection(asyncio.Protocol):
+    # One of the connections of a broadcasting ServerEndpoint; with several connections at once,
+    # the endpoint needs to know which one every callback is for.
+    def __init__(self, endpoint):
+        self.endpoint  = endpoint
+        self.transport = None
+        self.paused    = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.endpoint._client_made(self)
+
+    def connection_lost(self, exc):
+        self.endpoint._client_lost(self)
+
+    def data_received(self, data):
+        self.endpoint.data_received(data)
+
+    def pause_writing(self):
+        self.paused = True
+        self.endpoint._client_paused(self)
+
+    def resume_writing(self):
+        self.paused = False
+
+
 class ServerEndpoint(aobject, asyncio.Protocol):
+    """
+    A stream socket server with a single client, or, if ``broadcast`` is true, any number of
+    clients that all receive the same data.
+
+    Received data is buffered without copying; once more than ``recv_buffer_size`` bytes are
+    buffered, reading from the socket is paused until half of them are consumed. In broadcast
+    mode, a client that does not keep up with sent data is disconnected.
+    """
     @classmethod
     def add_argument(cls, parser, name, default=None):
         metavar = name.upper().replace("_", "-")
@@ -36,20 +70,32 @@ class ServerEndpoint(aobject, asyncio.Protocol):
             name, metavar=metavar, type=endpoint, nargs=nargs, default=default,
             help=help)
 
-    async def __init__(self, name, logger, sock_addr):
+    async def __init__(self, name, logger, sock_addr, broadcast=False,
+                       recv_buffer_size=1 << 20):
         assert isinstance(sock_addr, tuple)
 
         self.name    = name
         self._logger = logger
 
+        self._broadcast = broadcast
+        self._clients   = set()
+        if broadcast:
+            protocol_factory = lambda: _BroadcastConnection(self)
+            backlog = 100
+        else:
+            protocol_factory = lambda: self
+            backlog = 1
+
         proto, *proto_args = sock_addr
         loop = asyncio.get_event_loop()
         if proto == "unix":
-            self.server = await loop.create_unix_server(lambda: self, *proto_args, backlog=1)
+            self.server = await loop.create_unix_server(protocol_factory, *proto_args,
+                                                        backlog=backlog)
             unix_path, = proto_args
             self._log(logging.INFO, "listening at unix:%s", unix_path)
         elif proto == "tcp":
-            self.server = await loop.create_server(lambda: self, *proto_args, backlog=1)
+            self.server = await loop.create_server(protocol_factory, *proto_args,
+                                                   backlog=backlog)
             tcp_host, tcp_port = proto_args
             self._log(logging.INFO, "listening at tcp:%s:%d", tcp_host or "*", tcp_port)
         else:
@@ -63,20 +109,37 @@ class ServerEndpoint(aobject, asyncio.Protocol):
         self._queue      = deque()
         self._future     = None
 
-        self._buffer = None
+        self._queued_bytes     = 0
+        self._recv_buffer_size = recv_buffer_size
+        self._reading_paused   = False
+
+        # The chunk being consumed, and the offset of the first byte not consumed yet.
+        self._buffer = b""
         self._pos    = 0
 
     def _log(self, level, message, *args):
         self._logger.log(level, self.name + ": " + message, *args)
 
-    def connection_made(self, transport):
-        self._send_epoch += 1
-
+    def _log_peer(self, level, transport, message):
         peername = transport.get_extra_info("peername")
         if peername:
-            self._log(logging.INFO, "new connection from [%s]:%d", *peername[0:2])
+            self._log(level, message + " from [%s]:%d", *peername[0:2])
+        else:
+            self._log(level, message)
+
+    def _transports(self):
+        if self._broadcast:
+            return [client.transport for client in self._clients]
         else:
-            self._log(logging.INFO, "new connection")
+            return [transport for transport in (self._transport, self._new_transport)
+                    if transport is not None]
+
+    def connection_made(self, transport):
+        self._send_epoch += 1
+
+        self._log_peer(logging.INFO, transport, "new connection")
+        if self._reading_paused:
+            transport.pause_reading()
 
         if self._transport is None:
             self._transport = transport
@@ -86,18 +149,35 @@ class ServerEndpoint(aobject, asyncio.Protocol):
             self._new_transport = transport
 
     def connection_lost(self, exc):
-        peername = self._transport.get_extra_info("peername")
-        if peername:
-            self._log(logging.INFO, "connection from [%s]:%d lost", *peername[0:2])
-        else:
-            self._log(logging.INFO, "connection lost")
+        self._log_peer(logging.INFO, self._transport, "connection lost")
 
         self._transport, self._new_transport = self._new_transport, None
         self._queue.append(exc)
         self._check_future()
 
+    def _client_made(self, client):
+        self._log_peer(logging.INFO, client.transport, "new connection")
+        if self._reading_paused:
+            client.transport.pause_reading()
+        self._clients.add(client)
+
+    def _client_lost(self, client):
+        self._log_peer(logging.INFO, client.transport, "connection lost")
+        self._clients.discard(client)
+
+    def _client_paused(self, client):
+        self._log_peer(logging.WARNING, client.transport, "closing slow connection")
+        client.transport.abort()
+
     def data_received(self, data):
         self._queue.append(data)
+        self._queued_bytes += len(data)
+        if not self._reading_paused and self._queued_bytes > self._recv_buffer_size:
+            self._log(logging.TRACE, "recv buffer full, pausing")
+            self._reading_paused = True
+            for transport in self._transports():
+                if not transport.is_closing():
+                    transport.pause_reading()
         self._check_future()
 
     def _check_future(self):
@@ -106,66 +186,114 @@ class ServerEndpoint(aobject, asyncio.Protocol):
             if isinstance(item, Exception):
                 self._future.set_exception(item)
             else:
+                if item is not None:
+                    self._queued_bytes -= len(item)
                 self._future.set_result(item)
             self._future = None
 
+        if self._reading_paused and self._queued_bytes <= self._recv_buffer_size // 2:
+            self._log(logging.TRACE, "recv buffer drained, resuming")
+            self._reading_paused = False
+            for transport in self._transports():
+                if not transport.is_closing():
+                    transport.resume_reading()
+
     async def _refill(self):
         self._future = future = asyncio.Future()
         self._check_future()
         self._buffer = await future
+        self._pos    = 0
         if self._buffer is None:
             self._buffer = b""
             self._log(logging.TRACE, "recv end-of-stream")
             self._recv_epoch += 1
 
+    def _take(self, length=None):
+        # Consume up to `length` bytes (or all bytes) of the current chunk, without copying them.
+        if length is None:
+            end = len(self._buffer)
+        else:
+            end = min(self._pos + length, len(self._buffer))
+        chunk = memoryview(self._buffer)[self._pos:end]
+        self._pos = end
+        return chunk
+
     async def recv(self, length=0):
-        data = bytearray()
-        while length == 0 or len(data) < length:
-            if not self._buffer:
-                self._log(logging.TRACE, "recv waits for %d bytes", length - len(data))
+        chunks   = []
+        received = 0
+        while received == 0 or received < length:
+            if self._pos == len(self._buffer):
+                self._log(logging.TRACE, "recv waits for %d bytes", length - received)
                 await self._refill()
 
-            if length == 0:
-                length = len(self._buffer)
+            chunk = self._take(length - received if length else None)
+            chunks.append(chunk)
+            received += len(chunk)
 
-            chunk = self._buffer[:length - len(data)]
-            self._buffer = self._buffer[len(chunk):]
-            data += chunk
-
-        self._log(logging.TRACE, "recv <%s>", data.hex())
+        data = b"".join(chunks)
+        if self._logger.isEnabledFor(logging.TRACE):
+            self._log(logging.TRACE, "recv <%s>", data.hex())
         return data
 
+    async def recv_into(self, buffer):
+        """
+        Receive exactly ``len(buffer)`` bytes into ``buffer``, a writable bytes-like object,
+        and return the number of bytes received.
+        """
+        view = memoryview(buffer).cast("B")
+        received = 0
+        while received < len(view):
+            if self._pos == len(self._buffer):
+                self._log(logging.TRACE, "recv waits for %d bytes", len(view) - received)
+                await self._refill()
+
+            chunk = self._take(len(view) - received)
+            view[received:received + len(chunk)] = chunk
+            received += len(chunk)
+
+        if self._logger.isEnabledFor(logging.TRACE):
+            self._log(logging.TRACE, "recv <%s>", view.hex())
+        return received
+
     async def recv_until(self, separator):
         separator = bytes(separator)
-        data = bytearray()
+        chunks = []
         while True:
-            if not self._buffer:
+            if self._pos == len(self._buffer):
                 self._log(logging.TRACE, "recv waits for <%s>", separator.hex())
                 await self._refill()
 
-            try:
-                index = self._buffer.index(separator)
-                chunk = self._buffer[:index]
-                self._buffer = self._buffer[index + 1:]
-                data += chunk
+            index = self._buffer.find(separator, self._pos)
+            if index == -1:
+                chunks.append(self._take())
+            else:
+                chunks.append(self._take(index - self._pos))
+                self._pos += len(separator)
                 break
 
-            except ValueError:
-                data += self._buffer
-                self._buffer = None
-
-        self._log(logging.TRACE, "recv <%s%s>", data.hex(), separator.hex())
+        data = b"".join(chunks)
+        if self._logger.isEnabledFor(logging.TRACE):
+            self._log(logging.TRACE, "recv <%s%s>", data.hex(), separator.hex())
         return data
 
     async def recv_wait(self):
-        if not self._buffer:
+        if self._pos == len(self._buffer):
             self._log(logging.TRACE, "recv wait")
             await self._refill()
 
     async def send(self, data):
         data = bytes(data)
-        if self._send_epoch == self._recv_epoch:
-            self._log(logging.TRACE, "send <%s>", data.hex())
+        if self._broadcast:
+            if self._logger.isEnabledFor(logging.TRACE):
+                self._log(logging.TRACE, "send <%s> to %d connections",
+                          data.hex(), len(self._clients))
+            for client in self._clients:
+                if not client.paused:
+                    client.transport.write(data)
+            return bool(self._clients)
+        elif self._send_epoch == self._recv_epoch:
+            if self._logger.isEnabledFor(logging.TRACE):
+                self._log(logging.TRACE, "send <%s>", data.hex())
             self._transport.write(data)
             return True
         else:
@@ -173,8 +301,8 @@ class ServerEndpoint(aobject, asyncio.Protocol):
             return False
 
     async def close(self):
-        if self._transport:
-            self._transport.close()
+        for transport in self._transports():
+            transport.close()
 
 # -------------------------------------------------------------------------------------------------
 
@@ -281,3 +409,70 @@ class ServerEndpointTestCase(unittest.TestCase):
     def test_tcp(self):
         asyncio.get_event_loop().run_until_complete(
             self.do_test_lifecycle())
+
+    async def do_test_recv_into(self):
+        sock = ("unix", "{}/test_recv_into_sock".format(tempfile.gettempdir()))
+        endp = await ServerEndpoint("test_recv_into", logging.getLogger(__name__), sock)
+
+        conn_rd, conn_wr = await asyncio.open_unix_connection(*sock[1:])
+        conn_wr.write(b"ABC")
+        await conn_wr.drain()
+        buffer = bytearray(5)
+        recv_fut = asyncio.ensure_future(endp.recv_into(buffer))
+        await asyncio.sleep(0.01)
+        self.assertFalse(recv_fut.done())
+        conn_wr.write(b"DE;F")
+        await conn_wr.drain()
+        self.assertEqual(await recv_fut, 5)
+        self.assertEqual(buffer, b"ABCDE")
+        self.assertEqual(await endp.recv_until(b";"), b"")
+        self.assertEqual(await endp.recv(), b"F")
+
+    def test_recv_into(self):
+        asyncio.get_event_loop().run_until_complete(
+            self.do_test_recv_into())
+
+    async def do_test_flow_control(self):
+        sock = ("unix", "{}/test_flow_control_sock".format(tempfile.gettempdir()))
+        endp = await ServerEndpoint("test_flow_control", logging.getLogger(__name__), sock,
+                                    recv_buffer_size=4)
+
+        conn_rd, conn_wr = await asyncio.open_unix_connection(*sock[1:])
+        conn_wr.write(b"ABC")
+        await conn_wr.drain()
+        await endp.recv_wait()
+        conn_wr.write(b"DEFGHI")
+        await conn_wr.drain()
+        await asyncio.sleep(0.01)
+        self.assertTrue(endp._reading_paused)
+        self.assertEqual(await endp.recv(9), b"ABCDEFGHI")
+        self.assertFalse(endp._reading_paused)
+
+    def test_flow_control(self):
+        asyncio.get_event_loop().run_until_complete(
+            self.do_test_flow_control())
+
+    async def do_test_broadcast(self):
+        sock = ("unix", "{}/test_broadcast_sock".format(tempfile.gettempdir()))
+        endp = await ServerEndpoint("test_broadcast", logging.getLogger(__name__), sock,
+                                    broadcast=True)
+
+        conn1_rd, conn1_wr = await asyncio.open_unix_connection(*sock[1:])
+        conn2_rd, conn2_wr = await asyncio.open_unix_connection(*sock[1:])
+        await asyncio.sleep(0.01)
+        self.assertTrue(await endp.send(b"XYZ"))
+        self.assertEqual(await conn1_rd.readexactly(3), b"XYZ")
+        self.assertEqual(await conn2_rd.readexactly(3), b"XYZ")
+        conn1_wr.write(b"AB")
+        await conn1_wr.drain()
+        self.assertEqual(await endp.recv(2), b"AB")
+        conn1_wr.close()
+        await asyncio.sleep(0.01)
+        self.assertTrue(await endp.send(b"UVW"))
+        self.assertEqual(await conn2_rd.readexactly(3), b"UVW")
+        await endp.close()
+        self.assertEqual(await conn2_rd.read(1), b"")
+
+    def test_broadcast(self):
+        asyncio.get_event_loop().run_until_complete(
+            self.do_test_broadcast())
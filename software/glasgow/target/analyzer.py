@@ -1,4 +1,5 @@
 import logging
+from collections import OrderedDict
 from migen import *
 from migen.fhdl.bitcontainer import value_bits_sign
 from migen.genlib.cdc import MultiReg
@@ -25,13 +26,55 @@ class GlasgowAnalyzer(Module):
         self.done, self.addr_done = registers.add_rw(1)
         self.comb += self.event_analyzer.done.eq(self.done)
 
-        self._pins = []
+        self._registers  = registers
+        self._pins       = []
+        self._statistics = []
+
+        self._trace_pins    = None
+        self._trace_fifos   = {"in", "out"}
+        self._trace_exclude = set()
+        self._unmatched     = set()
 
     def _name(self, applet, event):
         # return "{}-{}".format(applet.name, event)
         return event
 
+    def set_event_filter(self, pins=None, fifos=("in", "out"), exclude=()):
+        """
+        Restrict the events that are added to the analyzer. Only applet pins (or pin sets) named
+        in ``pins`` are traced, unless it is ``None``; only FIFOs with directions (``"in"`` or
+        ``"out"``) in ``fifos`` are traced; and no events with names in ``exclude`` are traced.
+
+        Must be called before the applet is built.
+        """
+        self._trace_pins    = None if pins is None else set(pins)
+        self._trace_fifos   = set(fifos)
+        self._trace_exclude = set(exclude)
+        self._unmatched     = set(self._trace_pins or ()) | self._trace_exclude
+
+    def set_delay_encoding(self, delay_width=16, delay_septets=5, heartbeat_cyc=None):
+        """
+        Configure how the analyzer measures and reports time between events; see
+        :class:`EventAnalyzer`. Must be called before the analyzer is finalized.
+        """
+        if 7 * delay_septets <= delay_width + 1:
+            raise ValueError("{} delay septets cannot hold a {}-bit delay"
+                             .format(delay_septets, delay_width))
+        self.event_analyzer.delay_width   = delay_width
+        self.event_analyzer.delay_septets = delay_septets
+        self.event_analyzer.heartbeat_cyc = heartbeat_cyc
+
+    def _is_traced(self, name):
+        self._unmatched.discard(name)
+        if name in self._trace_exclude:
+            self.logger.debug("not tracing event %r", name)
+            return False
+        return True
+
     def add_in_fifo_event(self, applet, fifo):
+        if "in" not in self._trace_fifos or not self._is_traced(self._name(applet, "fifo-in")):
+            return
+
         event_source = self.event_analyzer.add_event_source(
             name=self._name(applet, "fifo-in"), kind="strobe", width=8)
         event_source.sync += [
@@ -40,6 +83,9 @@ class GlasgowAnalyzer(Module):
         ]
 
     def add_out_fifo_event(self, applet, fifo):
+        if "out" not in self._trace_fifos or not self._is_traced(self._name(applet, "fifo-out")):
+            return
+
         event_source = self.event_analyzer.add_event_source(
             name=self._name(applet, "fifo-out"), kind="strobe", width=8)
         event_source.comb += [
@@ -48,9 +94,36 @@ class GlasgowAnalyzer(Module):
         ]
 
     def add_pin_event(self, applet, name, triple):
-        self._pins.append((self._name(applet, name), triple))
+        name = self._name(applet, name)
+        if self._trace_pins is not None and name not in self._trace_pins:
+            self.logger.debug("not tracing pin %r", name)
+            return
+        if not self._is_traced(name):
+            return
+
+        self._pins.append((name, triple))
+
+    def add_generic_event(self, applet, name, trigger, data=None, kind="strobe"):
+        """
+        Add an applet-specific event, emitted with the value of ``data`` (if any) whenever
+        ``trigger`` is asserted. The ``kind`` of the event (``"strobe"`` or ``"change"``) only
+        affects how it is presented. Such events usually capture what the applet is doing much
+        more compactly than its pins.
+        """
+        name = self._name(applet, name)
+        if not self._is_traced(name):
+            return
+
+        event_source = self.event_analyzer.add_event_source(
+            name=name, kind=kind, width=0 if data is None else len(data))
+        event_source.comb += event_source.trigger.eq(trigger)
+        if data is not None:
+            event_source.comb += event_source.data.eq(data)
 
     def _finalize_pin_events(self):
+        for name in sorted(self._unmatched):
+            self.logger.warning("event filter refers to unknown event %r", name)
+
         if not self._pins:
             return
 
@@ -86,3 +159,77 @@ class GlasgowAnalyzer(Module):
             io_event_source.trigger.eq(reg_reset | (sig_ios != reg_ios)),
             io_event_source.data.eq(sig_ios),
         ]
+
+    def _add_statistic(self, name, signal, hold):
+        latch = Signal.like(signal)
+        self.sync += If(~hold, latch.eq(signal))
+
+        addrs = []
+        for offset in range(0, len(signal), 8):
+            reg, addr = self._registers.add_ro(8)
+            self.comb += reg.eq(latch[offset:offset + 8])
+            addrs.append(addr)
+        self._statistics.append((name, addrs))
+
+    def _finalize_statistics(self):
+        self.stats_hold, self.addr_stats_hold = self._registers.add_rw(1)
+
+        overrun, self.addr_overrun = self._registers.add_ro(1)
+        self.comb += overrun.eq(self.event_analyzer.overrun)
+
+        analyzer = self.event_analyzer
+        self._add_statistic("cycles",   analyzer.cycle_count,      self.stats_hold)
+        self._add_statistic("throttle", analyzer.throttle_count,   self.stats_hold)
+        self._add_statistic("overrun",  analyzer.overrun_cycle,    self.stats_hold)
+        self._add_statistic("event",    analyzer.event_peak_level, self.stats_hold)
+        self._add_statistic("delay",    analyzer.delay_peak_level, self.stats_hold)
+        for event_source in analyzer.event_sources:
+            self._add_statistic(event_source.name + "-events", event_source.event_count,
+                                self.stats_hold)
+            if event_source.width > 0:
+                self._add_statistic(event_source.name + "-peak", event_source.peak_level,
+                                    self.stats_hold)
+
+    async def read_statistics(self, device):
+        """
+        Read a consistent snapshot of the event analyzer statistics. Returns a dictionary
+        of counters, with ``"overrun"`` being ``None`` if no overrun has occurred.
+        """
+        statistics = OrderedDict()
+        await device.write_register(self.addr_stats_hold, 1)
+        try:
+            for name, addrs in self._statistics:
+                value = 0
+                for index, addr in enumerate(addrs):
+                    value |= (await device.read_register(addr)) << (8 * index)
+                statistics[name] = value
+            if not await device.read_register(self.addr_overrun):
+                statistics["overrun"] = None
+        finally:
+            await device.write_register(self.addr_stats_hold, 0)
+        return statistics
+
+    def log_statistics(self, statistics, level=logging.INFO):
+        def level_repr(peak, depth):
+            return "peak level {}/{} ({:.0f}%)".format(peak, depth, 100 * peak / depth)
+
+        cycles = statistics["cycles"]
+        self.logger.log(level, "ran for %d cycles, throttled for %d cycles (%.1f%%)",
+                        cycles, statistics["throttle"],
+                        100 * statistics["throttle"] / cycles if cycles else 0)
+        if statistics["overrun"] is not None:
+            self.logger.log(level, "FIFO overrun at cycle %d", statistics["overrun"])
+        self.logger.log(level, "event FIFO: %s",
+                        level_repr(statistics["event"], self.event_analyzer.event_fifo.depth))
+        self.logger.log(level, "delay FIFO: %s",
+                        level_repr(statistics["delay"], self.event_analyzer.delay_fifo.depth))
+        for event_source in self.event_sources:
+            events = statistics[event_source.name + "-events"]
+            if event_source.width > 0:
+                self.logger.log(level, "event source %r: %d events, data FIFO: %s",
+                                event_source.name, events,
+                                level_repr(statistics[event_source.name + "-peak"],
+                                           event_source.depth))
+            else:
+                self.logger.log(level, "event source %r: %d events",
+                                event_source.name, events)
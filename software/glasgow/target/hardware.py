@@ -82,6 +82,7 @@ class GlasgowHardwareTarget(Module):
         if not self.finalized:
             if self.analyzer:
                 self.analyzer._finalize_pin_events()
+                self.analyzer._finalize_statistics()
 
             super().finalize(*args, **kwargs)
 